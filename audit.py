@@ -0,0 +1,41 @@
+import argparse, os, sys
+from source.functions.audit import ACTIONS, format_record, header, parse_time
+from source.functions.storage import create_store
+
+from dotenv import load_dotenv
+load_dotenv()
+
+def main():
+    parser = argparse.ArgumentParser(description="Export whitelist decisions without going through Discord.")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv", help="output format (default: csv)")
+    parser.add_argument("--guild", type=int, help="only decisions in this guild")
+    parser.add_argument("--user", type=int, help="only decisions about this user")
+    parser.add_argument("--admin", type=int, help="only decisions made by this admin")
+    parser.add_argument("--action", choices=ACTIONS, help="only this kind of decision")
+    parser.add_argument("--since", type=parse_time, help="only decisions from this time on (ISO 8601)")
+    parser.add_argument("--until", type=parse_time, help="only decisions before this time (ISO 8601)")
+    parser.add_argument("--output", help="file to write to (default: stdout)")
+    args = parser.parse_args()
+
+    # Opened read-only, so this is safe to run next to a live bot.
+    store = create_store(os.getenv("WHITELIST_STORAGE", "json"), "config/whitelist_log.json", "config/whitelist.db")
+    store.open(read_only=True)
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        output.write(header(args.format))
+        # Records are written as they are read, so memory use stays flat
+        # however long the log is.
+        records = store.query(
+            guild_id=args.guild, user_id=args.user, admin_id=args.admin,
+            action=args.action, since=args.since, until=args.until,
+            legacy_guild_id=int(os.getenv("LEGACY_GUILD_ID") or 0) or None,
+        )
+        for record in records:
+            output.write(format_record(record, args.format))
+    finally:
+        if args.output:
+            output.close()
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""In-process stand-ins for the parts of Discord the Whitelist cog talks to.
+
+Nothing here opens a socket.  REST calls (role grants, bans, DMs, messages)
+sleep for a configurable latency and record what they were asked to do, so
+the cog's own overhead can be measured without a live server.
+"""
+import asyncio
+import datetime
+import itertools
+
+import discord
+
+_ids = itertools.count(10**17)
+
+
+def next_id():
+    return next(_ids)
+
+
+# FakeREST: Shared settings and counters for every fake API call.
+class FakeREST:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+
+    async def call(self, route):
+        self.calls[route] = self.calls.get(route, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeRole:
+    def __init__(self, guild, role_id):
+        self.guild = guild
+        self.id = role_id
+        self.mention = f"<@&{role_id}>"
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRole) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeMessage:
+    def __init__(self, channel, embed=None, view=None, content=None):
+        self.id = next_id()
+        self.channel = channel
+        self.content = content
+        # Parsed back from the payload, as discord.py does with the API's reply.
+        self.embeds = [discord.Embed.from_dict(embed.to_dict())] if embed else []
+        self.components = []
+        if view is not None:
+            self.components = [discord.ActionRow(row) for row in view.to_components()]
+
+    async def edit(self, content=None, embed=None, view=None):
+        await self.channel.rest.call("edit_message")
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embeds = [discord.Embed.from_dict(embed.to_dict())]
+
+
+class FakeChannel:
+    def __init__(self, rest, channel_id):
+        self.rest = rest
+        self.id = channel_id
+        self.messages = []
+        self.mention = f"<#{channel_id}>"
+
+    async def send(self, content=None, embed=None, view=None):
+        await self.rest.call("send_message")
+        message = FakeMessage(self, embed, view, content)
+        self.messages.append(message)
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.rest.call("fetch_message")
+        message = next((message for message in self.messages if message.id == message_id), None)
+        if message is None:
+            raise discord.NotFound(FakeResponse(404), "Unknown Message")
+        return message
+
+
+# FakeMember: Passes isinstance(member, discord.Member) checks but keeps its
+# state in plain attributes instead of a connection state.
+class FakeMember(discord.Member):
+    def __init__(self, guild, user_id=None, joined_at=None):
+        self._fake = {
+            "guild": guild,
+            "id": user_id or next_id(),
+            "roles": [],
+            "joined_at": joined_at or datetime.datetime.now(datetime.timezone.utc),
+        }
+
+    id = property(lambda self: self._fake["id"])
+    guild = property(lambda self: self._fake["guild"])
+    roles = property(lambda self: self._fake["roles"])
+    joined_at = property(lambda self: self._fake["joined_at"])
+    name = property(lambda self: f"user{self.id}")
+    display_name = name
+    discriminator = property(lambda self: "0")
+    mention = property(lambda self: f"<@{self.id}>")
+    display_avatar = property(lambda self: f"https://cdn.discordapp.com/embed/avatars/{self.id % 5}.png")
+    avatar = property(lambda self: None if self.id % 3 == 0 else self.display_avatar)
+    bot = property(lambda self: False)
+    guild_permissions = property(lambda self: discord.Permissions.none())
+
+    def __repr__(self):
+        return f"<FakeMember id={self.id}>"
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    async def add_roles(self, *roles, reason=None):
+        await self.guild.rest.call("add_roles")
+        self._fake["roles"].extend(role for role in roles if role not in self._fake["roles"])
+
+    async def remove_roles(self, *roles, reason=None):
+        await self.guild.rest.call("remove_roles")
+        self._fake["roles"][:] = [role for role in self._fake["roles"] if role not in roles]
+
+    async def send(self, content=None, **kwargs):
+        await self.guild.rest.call("send_dm")
+        if self.id in self.guild.banned:
+            # Discord refuses DMs to users who share no guild with the bot.
+            raise discord.Forbidden(FakeResponse(403), {"code": 50007, "message": "Cannot send messages to this user"})
+
+    async def ban(self, reason=None, **kwargs):
+        await self.guild.ban(self, reason=reason)
+
+
+class FakeGuild:
+    def __init__(self, rest, guild_id=None):
+        self.rest = rest
+        self.id = guild_id or next_id()
+        self.members_by_id = {}
+        self.roles = {}
+        self.chunked = True
+        self.banned = set()
+
+    @property
+    def members(self):
+        return list(self.members_by_id.values())
+
+    def add_role(self, role_id=None):
+        role = FakeRole(self, role_id or next_id())
+        self.roles[role.id] = role
+        return role
+
+    def get_role(self, role_id):
+        return self.roles.get(role_id)
+
+    def add_member(self, user_id=None):
+        member = FakeMember(self, user_id)
+        self.members_by_id[member.id] = member
+        return member
+
+    def get_member(self, user_id):
+        return self.members_by_id.get(user_id)
+
+    async def fetch_member(self, user_id):
+        await self.rest.call("fetch_member")
+        member = self.members_by_id.get(user_id)
+        if member is None:
+            raise discord.NotFound(FakeResponse(404), "Unknown Member")
+        return member
+
+    async def fetch_members(self, limit=None, after=None):
+        after_id = after.id if after else 0
+        for user_id in sorted(self.members_by_id):
+            if user_id > after_id:
+                yield self.members_by_id[user_id]
+
+    async def ban(self, user, reason=None, **kwargs):
+        await self.rest.call("ban")
+        self.banned.add(user.id)
+        self.members_by_id.pop(user.id, None)
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.reason = "Fake"
+
+
+class FakeInteractionResponse:
+    def __init__(self, rest):
+        self.rest = rest
+
+    async def defer(self, ephemeral=False, thinking=False):
+        await self.rest.call("defer")
+
+    async def send_message(self, content=None, embed=None, ephemeral=False, **kwargs):
+        await self.rest.call("interaction_response")
+
+
+class FakeFollowup:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def send(self, content=None, embed=None, ephemeral=False, wait=False, **kwargs):
+        await self.channel.rest.call("followup")
+        return FakeMessage(self.channel, embed, None, content)
+
+
+class FakeInteraction:
+    def __init__(self, client, guild, user, channel, message=None):
+        self.client = client
+        self.guild = guild
+        self.user = user
+        self.message = message
+        self.response = FakeInteractionResponse(guild.rest)
+        self.followup = FakeFollowup(channel)
+
+
+# FakeBot: The bot attributes the cog uses.
+class FakeBot:
+    def __init__(self, rest):
+        self.rest = rest
+        self.loop = asyncio.get_running_loop()
+        self.channels = {}
+        self.guilds = []
+        self.cogs = {}
+        self.latency = 0.0
+        self.latencies = [(0, 0.0)]
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+    def get_guild(self, guild_id):
+        return next((guild for guild in self.guilds if guild.id == guild_id), None)
+
+    def get_user(self, user_id):
+        return next((guild.get_member(user_id) for guild in self.guilds if guild.get_member(user_id)), None)
+
+    async def fetch_user(self, user_id):
+        await self.rest.call("fetch_user")
+        user = self.get_user(user_id)
+        if user is None:
+            raise discord.NotFound(FakeResponse(404), "Unknown User")
+        return user
+
+    def add_dynamic_items(self, *items):
+        pass
+
+    def remove_dynamic_items(self, *items):
+        pass
+
+    def add_view(self, view, message_id=None):
+        pass
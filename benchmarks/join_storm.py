@@ -0,0 +1,198 @@
+"""Load test for the Whitelist cog's join and decision paths, offline.
+
+Runs the real cog against the in-process fakes in benchmarks/fake_discord.py:
+
+* load: cog_load with a whitelist log of --log-entries decisions (the first
+  load of the sqlite backend includes importing the JSON log).
+* joins: a storm of --joins members dispatched to on_member_join at once, a
+  --rejoin fraction of them already whitelisted.  Latency is how long the
+  handler took; review latency is join to review posted.
+* clicks: ReviewButton.callback on --clicks of the posted reviews, cycling
+  through accept, deny and silent deny.
+* slash: /whitelist accept on --slash fresh members.
+
+Each phase reports throughput, p50/p99 latency and the process's peak RSS.
+Route limits are lifted unless --throttle is given, so the numbers measure
+the bot rather than the token buckets.  Run from the repository root:
+
+    python -m benchmarks.join_storm --joins 10000 --log-entries 1000000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+
+GUILD_ID = 2000
+ROLE_ID = 3000
+CHANNEL_ID = 4000
+ADMIN_ID = 5000
+LOGGED_USER_BASE = 10_000  # Logged users are LOGGED_USER_BASE + i.
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report(name, count, elapsed, latencies):
+    rate = count / elapsed if elapsed else 0.0
+    print(
+        f"{name:<14} {count:>8}  {rate:>10.0f}/s  "
+        f"p50 {percentile(latencies, 0.50) * 1000:8.2f} ms  "
+        f"p99 {percentile(latencies, 0.99) * 1000:8.2f} ms  "
+        f"peak rss {peak_rss_mib():8.1f} MiB"
+    )
+
+
+# write_log: Writes a whitelist log of accepted users as a journal snapshot,
+# the format the JSON backend reads and the sqlite backend imports.
+def write_log(entries):
+    os.makedirs("config", exist_ok=True)
+    with open("config/whitelist_log.snapshot.jsonl", "w", encoding="utf-8") as f:
+        for i in range(entries):
+            record = {
+                "user_id": LOGGED_USER_BASE + i,
+                "guild_id": GUILD_ID,
+                "action": "accept",
+                "username": f"user{LOGGED_USER_BASE + i}",
+                "discriminator": "0",
+                "admin_id": ADMIN_ID,
+                "timestamp": "2024-01-01T00:00:00",
+            }
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+async def timed(latencies, coro):
+    started = time.perf_counter()
+    await coro
+    latencies.append(time.perf_counter() - started)
+
+
+async def run(args):
+    # Imported here so the environment is set before the cog reads it.
+    from benchmarks.fake_discord import FakeBot, FakeChannel, FakeGuild, FakeInteraction, FakeMessage, FakeREST
+    from source.functions import scheduler
+    from source.modules import whitelist
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if not args.throttle:
+        for route in scheduler.ROUTE_LIMITS:
+            scheduler.ROUTE_LIMITS[route] = (1e9, 1e9)
+
+    rest = FakeREST(args.rest_latency)
+    bot = FakeBot(rest)
+    guild = FakeGuild(rest, GUILD_ID)
+    guild.add_role(ROLE_ID)
+    channel = FakeChannel(rest, CHANNEL_ID)
+    bot.channels[CHANNEL_ID] = channel
+    bot.guilds.append(guild)
+    admin = guild.add_member(ADMIN_ID)
+
+    write_log(args.log_entries)
+    cog = whitelist.Whitelist(bot)
+    bot.cogs["Whitelist"] = cog
+    started = time.perf_counter()
+    await cog.cog_load()
+    elapsed = time.perf_counter() - started
+    report("load", args.log_entries, elapsed, [elapsed])
+
+    # Record join-to-review latency for every member whose review is posted.
+    join_started, review_latencies = {}, []
+    remember_reviews = cog.remember_reviews
+
+    async def remember_and_measure(members, message):
+        now = time.perf_counter()
+        review_latencies.extend(now - join_started[member.id] for member in members)
+        await remember_reviews(members, message)
+
+    cog.remember_reviews = remember_and_measure
+
+    rejoins = min(int(args.joins * args.rejoin), args.log_entries)
+    members = [guild.add_member(LOGGED_USER_BASE + i) for i in range(rejoins)]
+    members += [guild.add_member() for _ in range(args.joins - rejoins)]
+    handler_latencies = []
+    started = time.perf_counter()
+    for member in members:
+        join_started[member.id] = time.perf_counter()
+    await asyncio.gather(*(timed(handler_latencies, cog.on_member_join(member)) for member in members))
+    report("joins", len(members), time.perf_counter() - started, handler_latencies)
+    expected = args.joins - rejoins
+    while len(review_latencies) < expected:
+        await asyncio.sleep(0.01)
+    report("  reviewed", expected, time.perf_counter() - started, review_latencies)
+
+    actions = ("accept", "deny", "deny_silent")
+    view = whitelist.View(timeout=None)  # Only checked for truthiness.
+    click_latencies = []
+    clicks = []
+    for i, (_, user_id) in enumerate(list(cog.pending_reviews)[: args.clicks]):
+        button = whitelist.ReviewButton(actions[i % len(actions)], user_id)
+        button._view = view
+        message = FakeMessage(channel, whitelist.discord.Embed(title="New Member Joined"))
+        interaction = FakeInteraction(bot, guild, admin, channel, message)
+        clicks.append(timed(click_latencies, button.callback(interaction)))
+    started = time.perf_counter()
+    await asyncio.gather(*clicks)
+    report("clicks", len(clicks), time.perf_counter() - started, click_latencies)
+
+    slash_latencies = []
+    commands = [
+        timed(
+            slash_latencies,
+            whitelist.Whitelist.whitelist_accept.callback(
+                cog, FakeInteraction(bot, guild, admin, channel), guild.add_member()
+            ),
+        )
+        for _ in range(args.slash)
+    ]
+    started = time.perf_counter()
+    await asyncio.gather(*commands)
+    report("slash accept", len(commands), time.perf_counter() - started, slash_latencies)
+
+    await cog.cog_unload()
+    print(f"REST calls: {dict(sorted(rest.calls.items()))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--joins", type=int, default=10_000, help="members joining in the storm")
+    parser.add_argument("--rejoin", type=float, default=0.3, help="fraction of joins that are logged members")
+    parser.add_argument("--log-entries", type=int, default=100_000, help="decisions in the whitelist log")
+    parser.add_argument("--clicks", type=int, default=1_000, help="review buttons to click")
+    parser.add_argument("--slash", type=int, default=1_000, help="/whitelist accept commands to run")
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="json", help="WHITELIST_STORAGE backend")
+    parser.add_argument("--review-window", type=float, default=0.5, help="REVIEW_BATCH_WINDOW in seconds")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="seconds every fake API call takes")
+    parser.add_argument("--throttle", action="store_true", help="keep the scheduler's route limits")
+    args = parser.parse_args()
+
+    os.environ.update(
+        {
+            "WHITELIST_STORAGE": args.storage,
+            "WHITELIST_ROLE_ID": str(ROLE_ID),
+            "WHITELIST_CHANNEL_ID": str(CHANNEL_ID),
+            "REVIEW_BATCH_WINDOW": str(args.review_window),
+        }
+    )
+    os.environ.pop("METRICS_PORT", None)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            asyncio.run(run(args))
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Compares memory use of the default and lean (LEAN_MODE) client profiles.
+
+Builds a synthetic large guild and feeds it through discord.py's connection
+state the way the gateway would for each profile:
+
+* default: every member arrives (GUILD_CREATE plus startup chunking) along
+  with presences for the online ones.
+* lean: presences and chunking are off, so GUILD_CREATE only carries the bot
+  itself; the only members cached are the ones who join afterwards.
+
+Run from the repository root:
+
+    python -m benchmarks.member_cache --members 100000 --joins 500
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+
+import discord
+from discord.state import ConnectionState
+
+from source.functions.intents import client_options
+
+BOT_ID = 1000
+GUILD_ID = 2000
+
+
+def user_payload(user_id):
+    return {
+        "id": str(user_id),
+        "username": f"user{user_id}",
+        "discriminator": "0",
+        "global_name": f"User {user_id}",
+        "avatar": f"{random.getrandbits(128):032x}",
+    }
+
+
+def member_payload(user_id, role_ids):
+    return {
+        "user": user_payload(user_id),
+        "roles": [str(role_id) for role_id in random.sample(role_ids, 2)],
+        "joined_at": "2024-01-01T00:00:00+00:00",
+        "deaf": False,
+        "mute": False,
+        "flags": 0,
+    }
+
+
+def presence_payload(user_id):
+    return {
+        "user": {"id": str(user_id)},
+        "status": "online",
+        "client_status": {"desktop": "online"},
+        "activities": [{"name": "Some Game", "type": 0, "created_at": 0}],
+    }
+
+
+def guild_payload(member_ids, role_ids, presences):
+    return {
+        "id": str(GUILD_ID),
+        "name": "Synthetic Guild",
+        "owner_id": str(BOT_ID),
+        "member_count": len(member_ids),
+        "roles": [
+            {"id": str(role_id), "name": f"role{role_id}", "permissions": "0", "position": i, "color": 0, "hoist": False, "managed": False, "mentionable": False}
+            for i, role_id in enumerate(role_ids)
+        ],
+        "channels": [],
+        "members": [member_payload(user_id, role_ids) for user_id in member_ids],
+        "presences": [presence_payload(user_id) for user_id in presences],
+    }
+
+
+def build_state(options):
+    state = ConnectionState(
+        dispatch=lambda *args, **kwargs: None,
+        handlers={},
+        hooks={},
+        http=None,
+        intents=options["intents"],
+        member_cache_flags=options.get("member_cache_flags", discord.MemberCacheFlags.from_intents(options["intents"])),
+        chunk_guilds_at_startup=options.get("chunk_guilds_at_startup", True),
+    )
+    state.user = discord.ClientUser(
+        state=state, data={**user_payload(BOT_ID), "bot": True, "verified": True, "mfa_enabled": False}
+    )
+    return state
+
+
+def measure(lean, member_count, joins):
+    random.seed(0)
+    role_ids = list(range(3000, 3020))
+    gc.collect()
+    tracemalloc.start()
+    state = build_state(client_options(lean))
+
+    if lean:
+        data = guild_payload([BOT_ID], role_ids, [])
+    else:
+        member_ids = [BOT_ID] + list(range(10_000, 10_000 + member_count))
+        data = guild_payload(member_ids, role_ids, member_ids[: member_count // 3])
+    guild = state._add_guild_from_data(data)
+    del data
+
+    # Members joining after startup are cached in both profiles.
+    for user_id in range(10_000 + member_count, 10_000 + member_count + joins):
+        payload = member_payload(user_id, role_ids)
+        payload["guild_id"] = str(GUILD_ID)
+        state.parse_guild_member_add(payload)
+
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(guild.members), current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--members", type=int, default=100_000, help="members in the synthetic guild")
+    parser.add_argument("--joins", type=int, default=500, help="members joining after startup")
+    args = parser.parse_args()
+
+    for name, lean in (("default", False), ("lean", True)):
+        cached, current, peak = measure(lean, args.members, args.joins)
+        print(f"{name:<8} cached members: {cached:>8}  retained: {current / 2**20:8.1f} MiB  peak: {peak / 2**20:8.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
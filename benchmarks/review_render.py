@@ -0,0 +1,126 @@
+"""Compares building review messages from discord.py objects and from templates.
+
+Each path renders --joins single-member reviews and --digests digests of 25
+members, and each message is turned into a request payload the way
+channel.send() does it (discord.http.handle_message_parameters).  Members
+are real discord.Member objects built from gateway payloads.
+
+* objects: how reviews used to be built.  Every message got a new Embed with
+  fields, a strftime'd join time and a View with three ReviewButtons, or a
+  DigestView with three 25-option select menus.
+* templates: ReviewRenderer, which fills member fields into payloads
+  prepared when the cog loads.
+
+Reports CPU time and peak memory allocated per message.  Run from the
+repository root:
+
+    python -m benchmarks.review_render --joins 20000 --digests 1000
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+import discord
+from discord.ui import View
+
+from benchmarks.member_cache import build_state, guild_payload, member_payload
+from source.functions.intents import client_options
+from source.modules.whitelist import DigestView, ReviewButton, ReviewRenderer
+
+
+def objects_review(member):
+    embed = discord.Embed(title="New Member Joined", description=f"{member.mention} has joined the server")
+    embed.set_thumbnail(url=member.display_avatar)
+    embed.add_field(name="Username", value=member.name, inline=False)
+    embed.add_field(name="ID", value=member.id, inline=False)
+    embed.add_field(name="Joined At", value=member.joined_at.strftime("%Y-%m-%d %H:%M:%S"), inline=False)
+    view = View(timeout=None)
+    for action in ReviewButton.STYLES:
+        view.add_item(ReviewButton(action, member.id))
+    view.stop()
+    return embed, view
+
+
+def objects_digest(members):
+    embed = discord.Embed(
+        title="New Members Joined",
+        description="\n".join(
+            f"{member.mention} - {member.name} ({member.id}) - joined {member.joined_at.strftime('%Y-%m-%d %H:%M:%S')}"
+            for member in members
+        ),
+    )
+    embed.set_footer(text=f"{len(members)} pending")
+    view = DigestView(None, [(member.id, member.name) for member in members])
+    view.stop()
+    return embed, view
+
+
+def send(embed, view):
+    return discord.http.handle_message_parameters(embed=embed, view=view)
+
+
+def build_members(count):
+    state = build_state(client_options(True))
+    guild = state._add_guild_from_data(guild_payload([], list(range(3000, 3020)), []))
+    members = []
+    for user_id in range(10_000, 10_000 + count):
+        payload = member_payload(user_id, list(range(3000, 3020)))
+        payload["joined_at"] = "2024-05-01T18:30:00.123456+00:00"
+        members.append(discord.Member(data=payload, guild=guild, state=state))
+    return members
+
+
+# measure: CPU time per message over every batch, then peak allocation per
+# message over a sample with tracemalloc on (it slows everything down, so it
+# isn't on while timing).
+def measure(render, batches, sample=500):
+    started = time.process_time()
+    for batch in batches:
+        send(*render(batch))
+    cpu = (time.process_time() - started) / len(batches)
+
+    tracemalloc.start()
+    peaks = []
+    for batch in batches[:sample]:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        send(*render(batch))
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return cpu, sum(peaks) / len(peaks)
+
+
+async def run(args):
+    members = build_members(max(args.joins, args.digests * DigestView.PAGE_SIZE))
+    renderer = ReviewRenderer()
+    singles = members[: args.joins]
+    pages = [
+        members[i * DigestView.PAGE_SIZE : (i + 1) * DigestView.PAGE_SIZE] for i in range(args.digests)
+    ]
+
+    # Both paths must produce the same buttons and menus.
+    for old, new, batch in ((objects_review, renderer.review, singles[0]), (objects_digest, renderer.digest, pages[0])):
+        assert send(*old(batch)).payload["components"] == send(*new(batch)).payload["components"]
+
+    cases = [
+        ("review", "objects", objects_review, singles),
+        ("review", "templates", renderer.review, singles),
+        ("digest", "objects", objects_digest, pages),
+        ("digest", "templates", renderer.digest, pages),
+    ]
+    for kind, name, render, batches in cases:
+        cpu, allocated = measure(render, batches)
+        print(f"{kind:<7} {name:<10} {len(batches):>7} messages  {cpu * 1e6:9.1f} us/message  {allocated / 1024:8.1f} KiB/message")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--joins", type=int, default=20_000, help="single-member reviews to render")
+    parser.add_argument("--digests", type=int, default=1_000, help="25-member digests to render")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,45 +1,122 @@
-import discord, json, time, datetime, os, sys, subprocess
+import discord, asyncio, hashlib, json, datetime, logging, os, sys, time
 from discord.ext import commands
-from source.functions.colors import colors as cr
+from source.functions.intents import client_options, lean_mode
+from source.functions.lifecycle import Lifecycle
+from source.functions.log import setup_logging, stop_logging
 
 from dotenv import load_dotenv
 load_dotenv()
+# Logs go through a queue to a background thread; LOG_FORMAT picks color, json or plain.
+setup_logging()
+
+# Exit code a cluster uses to ask launcher.py to start it again.
+RESTART_EXIT_CODE = 75
+
+def parse_shard_ids(value):
+    # Accepts "0-3", "0,1,2" or a mix such as "0-3,8".
+    shard_ids = []
+    for part in value.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-")
+            shard_ids.extend(range(int(start), int(end) + 1))
+        elif part:
+            shard_ids.append(int(part))
+    return shard_ids
+
+def shard_options():
+    # SHARD_COUNT is "auto" (use Discord's recommended count) or a number.
+    # SHARD_IDS limits this process to some of the shards, which is how
+    # launcher.py splits shards across clusters.
+    shard_count = os.getenv("SHARD_COUNT", "auto").strip().lower()
+    shard_ids = os.getenv("SHARD_IDS", "").strip()
+    if shard_count in ("", "auto"):
+        if shard_ids:
+            raise SystemExit("SHARD_IDS requires an explicit SHARD_COUNT.")
+        return {}
+    options = {"shard_count": int(shard_count)}
+    if shard_ids:
+        options["shard_ids"] = parse_shard_ids(shard_ids)
+    return options
+
+# Hash of the last command tree synced to Discord, so restarts skip the
+# rate-limited global sync when no command changed.
+TREE_HASH_FILE = "config/tree_hash"
 
 class Client(commands.AutoShardedBot):
     def __init__(self, intents: discord.Intents, **kwargs):
-        super().__init__(command_prefix=".", intents=intents, shard_count=1, **kwargs)
+        super().__init__(command_prefix=".", intents=intents, **shard_options(), **kwargs)
         self.start_time = datetime.datetime.now()
+        self.started = time.perf_counter()
         self.added = False
-        self.date = (cr.GREY + time.strftime("%Y-%m-%d %H:%M:%S") + cr.ENDC)
+        # True while .dev reloads an extension.  Cogs that support it hand
+        # their live state to the reloaded instance instead of shutting down.
+        self.reloading = False
+        # Drains queued work before shutdown or restart. SHUTDOWN_TIMEOUT
+        # caps how long that may take.
+        self.lifecycle = Lifecycle(self, float(os.getenv("SHUTDOWN_TIMEOUT", "10")))
     async def setup_hook(self):
+        self.lifecycle.install_signal_handlers()
+        phase = time.perf_counter()
         with open("config/load.json", "r") as f:
             data = json.load(f)
 
+        # Extensions don't depend on each other, so they load concurrently.
+        extensions = []
         for extension in data.get("commands", []) + data.get("modules", []):
-            load_path = extension.get("load_path")
-            if not load_path:
-                print(self.date + cr.WARNING + " WARN" + cr.CYAN + f"     Skipping extension {extension.get('name')} because 'load_path' is not specified." + cr.ENDC)
+            if not extension.get("load_path"):
+                logging.warning("Skipping extension %s because 'load_path' is not specified.", extension.get('name'))
                 continue
+            extensions.append(extension)
+        await asyncio.gather(*(self.load_timed(extension) for extension in extensions))
+        logging.info("Loaded %d extensions in %.2fs", len(extensions), time.perf_counter() - phase)
 
-            try:
-                await self.load_extension(load_path)
-                print(self.date + cr.BLUE + " INFO" + cr.CYAN + f"     Loaded {extension['name']}" + cr.ENDC)
-            except Exception as exc:
-                print(self.date + cr.FAIL + " ERROR" + cr.CYAN + f"    Could not load {load_path} due to {exc.__class__.__name__}: {exc}" + cr.ENDC)
+        phase = time.perf_counter()
+        synced = await self.sync_tree()
+        logging.info("Command tree %s in %.2fs", "synced" if synced else "unchanged, sync skipped", time.perf_counter() - phase)
 
-    async def on_ready(self):
-        sync = await self.tree.sync()
-        print(self.date + cr.BLUE +  " INFO" + cr.CYAN + f"     {self.user.name}#{self.user.discriminator} just woke up!" + cr.ENDC)
-        print(self.date + cr.BLUE +  " INFO" + cr.CYAN + f"     Synced {len(sync)} commands" + cr.ENDC)
+    async def load_timed(self, extension):
+        started = time.perf_counter()
+        try:
+            await self.load_extension(extension["load_path"])
+            logging.info("Loaded %s in %.2fs", extension['name'], time.perf_counter() - started)
+        except Exception as exc:
+            logging.error("Could not load %s due to %s: %s", extension["load_path"], exc.__class__.__name__, exc)
+
+    def tree_hash(self):
+        # Everything Discord stores about the global commands, plus the
+        # application ID so switching tokens forces a sync.
+        commands = [command.to_dict(self.tree) for command in self.tree.get_commands()]
+        payload = json.dumps([self.application_id, commands], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
 
+    async def sync_tree(self, force=False):
+        # Syncs the global command tree if it changed since the last sync.
+        # Returns True if it synced.
+        current = self.tree_hash()
+        try:
+            with open(TREE_HASH_FILE, "r") as f:
+                previous = f.read().strip()
+        except FileNotFoundError:
+            previous = None
+        if not force and current == previous:
+            return False
+        synced = await self.tree.sync()
+        with open(TREE_HASH_FILE, "w") as f:
+            f.write(current)
+        logging.info("Synced %d commands", len(synced))
+        return True
+
+    async def on_ready(self):
+        # Runs again after reconnects; the tree is synced once in setup_hook.
         if not self.added:
             self.added = True
-        
+            logging.info("%s#%s just woke up! Ready %.2fs after start", self.user.name, self.user.discriminator, time.perf_counter() - self.started)
 
-intents = discord.Intents.all()
-client = Client(intents=intents)
+# LEAN_MODE in .env trims intents and member caching for large guilds.
+client = Client(**client_options(lean_mode()))
 client.remove_command("help")
-owner_id = 614807913302851594 # Replace with your ID
+owner_id = int(os.getenv("OWNER_ID") or 0) # Set OWNER_ID in .env to your ID
 
 with open('config/load.json', 'r') as file:
     load_data = json.load(file)
@@ -76,10 +153,16 @@ async def dev(ctx, *args):
         await ctx.send(f"Invalid action. Supported actions: `{supported_actions}`.")
         
 async def restart_bot(ctx, args):
-    await client.close()
-    subprocess.Popen([sys.executable, "bot.py"])
-    sys.exit(0)
+    await ctx.send("Restarting...")
+    client.lifecycle.request(restart=True)
     
+async def reload_with_handoff(load_path):
+    client.reloading = True
+    try:
+        await client.reload_extension(load_path)
+    finally:
+        client.reloading = False
+
 async def load_extension(ctx, args):
     if len(args) < 3:
         await ctx.send("Invalid usage. Please provide category, command, and full path to load.")
@@ -90,11 +173,11 @@ async def load_extension(ctx, args):
         try:
             await client.load_extension(full_path)
             await ctx.send(f"Loaded command: {command_name} from full path: {full_path}")
-            print(f"Loaded command: {command_name} from full path: {full_path}")
+            logging.info("Loaded command: %s from full path: %s", command_name, full_path)
         except Exception as e:
             
             await ctx.send(f"Failed to load command: {command_name}\n{type(e).__name__}: {e}")
-            print(f"Failed to load command: {command_name} {type(e).__name__}: {e}")
+            logging.error("Failed to load command: %s %s: %s", command_name, type(e).__name__, e)
     else:
         await ctx.send("Invalid command path.")
 
@@ -109,11 +192,11 @@ async def unload_extension(ctx, args):
         try:
             await client.unload_extension(command['load_path'])
             await ctx.send(f"Unloaded command: {command['name']} from category: {category}")
-            print(f"Unloaded command: {command['name']} from category: {category}")
+            logging.info("Unloaded command: %s from category: %s", command['name'], category)
         except Exception as e:
             
             await ctx.send(f"Failed to unload command: {command['name']} from category: {category}\n{type(e).__name__}: {e}")
-            print(f"Failed to unload command: {command['name']} from category: {category} {type(e).__name__}: {e}")
+            logging.error("Failed to unload command: %s from category: %s %s: %s", command['name'], category, type(e).__name__, e)
     else:
         await ctx.send("Command not found.")
 
@@ -126,13 +209,13 @@ async def reload_extension(ctx, args):
     command = next((cmd for cmd in load_data['commands'] if cmd['category'] == category and cmd['name'] == command_name), None)
     if command:
         try:
-            await client.reload_extension(command['load_path'])
+            await reload_with_handoff(command['load_path'])
             await ctx.send(f"Reloaded command: {command['name']} from category: {category}")
-            print(f"Reloaded command: {command['name']} from category: {category}")
+            logging.info("Reloaded command: %s from category: %s", command['name'], category)
         except Exception as e:
             
             await ctx.send(f"Failed to reload command: {command['name']}\n{type(e).__name__}: {e}")
-            print(f"Failed to reload command: {command['name']} {type(e).__name__}: {e}")
+            logging.error("Failed to reload command: %s %s: %s", command['name'], type(e).__name__, e)
     else:
         await ctx.send("Command not found.")
 
@@ -146,11 +229,11 @@ async def load_function(ctx, args):
         try:
             await client.load_extension(full_path)
             await ctx.send(f"Loaded function: {function_name} from full path: {full_path}")
-            print(f"Loaded function: {function_name} from full path: {full_path}")
+            logging.info("Loaded function: %s from full path: %s", function_name, full_path)
         except Exception as e:
             
             await ctx.send(f"Failed to load function: {function_name} from full path: {full_path}\n{type(e).__name__}: {e}")
-            print(f"Failed to load function: {function_name} from full path: {full_path} {type(e).__name__}: {e}")
+            logging.error("Failed to load function: %s from full path: %s %s: %s", function_name, full_path, type(e).__name__, e)
     else:
         await ctx.send("Invalid function path.")
 
@@ -163,16 +246,16 @@ async def reload_function(ctx, args):
     function_data = next((func for func in load_data['modules'] if func['name'] == function_name), None)
     if function_data:
         try:
-            await client.reload_extension(function_data['load_path'])
+            await reload_with_handoff(function_data['load_path'])
             await ctx.send(f"Reloaded function: {function_data['name']} from full path: {function_data['load_path']}")
-            print(f"Reloaded function: {function_data['name']} from full path: {function_data['load_path']}")
+            logging.info("Reloaded function: %s from full path: %s", function_data['name'], function_data['load_path'])
         except Exception as e:
             
             await ctx.send(f"Failed to reload function: {function_data['name']}\n{type(e).__name__}: {e}")
-            print(f"Failed to reload function: {function_data['name']} {type(e).__name__}: {e}")
+            logging.error("Failed to reload function: %s %s: %s", function_data['name'], type(e).__name__, e)
     else:
         await ctx.send("Function not found.")
-        print(f"Function not found: {function_name}")
+        logging.warning("Function not found: %s", function_name)
 
 async def reload_all_extensions(ctx, _):
     message = await ctx.send("Reloading all extensions...")
@@ -184,7 +267,7 @@ async def reload_all_extensions(ctx, _):
             continue  # Skip if there is no load_path
         
         try:
-            await client.reload_extension(load_path)
+            await reload_with_handoff(load_path)
             reloaded_count += 1
         except Exception as e:
             await ctx.send(f"Failed to reload {load_path}\n{type(e).__name__}: {e}")
@@ -192,13 +275,24 @@ async def reload_all_extensions(ctx, _):
     await message.edit(content=f"Reloaded {reloaded_count} extensions.")
 
 async def shutdown_bot(ctx, _):
-    sys.exit(0)
+    await ctx.send("Shutting down...")
+    client.lifecycle.request()
 
 async def sync(ctx, _):
-    if ctx.author.id != 614807913302851594:
+    if ctx.author.id != owner_id:
         return 
     await ctx.send("Syncing...")
-    await client.tree.sync()
+    await client.sync_tree(force=True)
     await ctx.send("Synced all commands!")
     
-client.run(os.getenv("TOKEN"))
\ No newline at end of file
+# log_handler=None lets discord.py's records go through the same pipeline.
+client.run(os.getenv("TOKEN"), log_handler=None)
+
+# client.run() returns once the lifecycle has drained and closed the client.
+if client.lifecycle.restart:
+    stop_logging()
+    if os.getenv("CLUSTER_ID"):
+        # Running under launcher.py, which starts the cluster again.
+        sys.exit(RESTART_EXIT_CODE)
+    # Replace this process so the old and new gateway sessions never overlap.
+    os.execv(sys.executable, [sys.executable] + sys.argv)
\ No newline at end of file
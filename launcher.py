@@ -0,0 +1,102 @@
+import argparse, json, logging, os, subprocess, sys, time, urllib.request
+from source.functions.log import setup_logging
+
+from dotenv import load_dotenv
+load_dotenv()
+setup_logging()
+
+# Must match RESTART_EXIT_CODE in bot.py.
+RESTART_EXIT_CODE = 75
+
+def recommended_shards(token):
+    # Asks Discord how many shards it recommends for this bot.
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "DiscordBot (whitelist-bot launcher)"},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)["shards"]
+
+def split_shards(shard_count, clusters):
+    # Gives each cluster a contiguous range of shard IDs, as evenly as possible.
+    size, extra = divmod(shard_count, clusters)
+    ranges, start = [], 0
+    for cluster_id in range(clusters):
+        end = start + size + (1 if cluster_id < extra else 0)
+        if end > start:
+            ranges.append(range(start, end))
+        start = end
+    return ranges
+
+def start_cluster(cluster_id, shard_count, shard_ids, split):
+    env = dict(
+        os.environ,
+        CLUSTER_ID=str(cluster_id),
+        SPLIT_MODE="1" if split else os.getenv("SPLIT_MODE", ""),
+        SHARD_COUNT=str(shard_count),
+        SHARD_IDS=f"{shard_ids.start}-{shard_ids.stop - 1}",
+    )
+    logging.info("Starting cluster %s with shards %s-%s", cluster_id, shard_ids.start, shard_ids.stop - 1)
+    return subprocess.Popen([sys.executable, "bot.py"], env=env)
+
+def start_worker(worker_id, count):
+    # Workers run the role grants, bans and DMs the clusters queue in split mode.
+    logging.info("Starting worker %s", worker_id)
+    return subprocess.Popen([sys.executable, "worker.py"], env=dict(os.environ, WORKER_COUNT=str(count)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot as several processes, each owning a slice of the shards.")
+    parser.add_argument("--clusters", type=int, default=os.cpu_count() or 1, help="number of bot processes (default: CPU count)")
+    parser.add_argument("--shards", default=os.getenv("SHARD_COUNT", "auto"), help='total shard count, or "auto" for Discord\'s recommendation')
+    parser.add_argument("--workers", type=int, default=0, help="worker processes for REST calls; turns on split mode (default: 0)")
+    args = parser.parse_args()
+
+    # The JSON journal is owned by a single process; clusters must share SQLite.
+    if os.getenv("WHITELIST_STORAGE", "json") != "sqlite":
+        raise SystemExit('Clusters share one whitelist store. Set WHITELIST_STORAGE="sqlite" in .env.')
+
+    if args.shards in ("", "auto"):
+        shard_count = recommended_shards(os.getenv("TOKEN"))
+        logging.info("Discord recommends %s shards", shard_count)
+    else:
+        shard_count = int(args.shards)
+
+    ranges = split_shards(shard_count, max(1, args.clusters))
+    processes = {cluster_id: start_cluster(cluster_id, shard_count, shard_ids, args.workers > 0) for cluster_id, shard_ids in enumerate(ranges)}
+    workers = {worker_id: start_worker(worker_id, args.workers) for worker_id in range(args.workers)}
+
+    try:
+        while processes:
+            time.sleep(1)
+            for cluster_id, process in list(processes.items()):
+                code = process.poll()
+                if code is None:
+                    continue
+                if code == 0:
+                    logging.info("Cluster %s shut down", cluster_id)
+                    del processes[cluster_id]
+                    continue
+                if code != RESTART_EXIT_CODE:
+                    logging.warning("Cluster %s exited with code %s, restarting in 5 seconds", cluster_id, code)
+                    time.sleep(5)
+                processes[cluster_id] = start_cluster(cluster_id, shard_count, ranges[cluster_id], args.workers > 0)
+            if not processes:
+                # Every cluster drained its queue and shut down, so the workers can stop too.
+                for process in workers.values():
+                    process.terminate()
+                for process in workers.values():
+                    process.wait()
+                break
+            for worker_id, process in list(workers.items()):
+                code = process.poll()
+                if code is not None:
+                    logging.warning("Worker %s exited with code %s, restarting", worker_id, code)
+                    workers[worker_id] = start_worker(worker_id, args.workers)
+    except KeyboardInterrupt:
+        for process in [*processes.values(), *workers.values()]:
+            process.terminate()
+        for process in [*processes.values(), *workers.values()]:
+            process.wait()
+
+if __name__ == "__main__":
+    main()
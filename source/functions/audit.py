@@ -0,0 +1,81 @@
+import csv
+import datetime
+import io
+import json
+
+# Columns of an export, in CSV order.
+EXPORT_FIELDS = ("timestamp", "guild_id", "user_id", "username", "action", "admin_id")
+
+# Every action the whitelist log records.  The last two are DMs that couldn't
+# be delivered, not decisions.
+ACTIONS = (
+    "accept",
+    "auto_accept",
+    "auto_rejoin",
+    "auto_federated",
+    "deny",
+    "silent_deny",
+    "auto_deny",
+    "rejoin_dm_failed",
+    "deny_dm_failed",
+)
+
+
+# parse_time: Turns a user-supplied ISO 8601 date or time into the format
+# decisions are stored in (naive local time), so filters compare as strings.
+# Raises ValueError for malformed input.
+def parse_time(value):
+    moment = datetime.datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment.isoformat()
+
+
+# header: The first line of an export file.
+def header(fmt):
+    if fmt != "csv":
+        return b""
+    return format_record(dict(zip(EXPORT_FIELDS, EXPORT_FIELDS)), fmt)
+
+
+# format_record: One decision as a line of CSV or JSON lines.
+def format_record(record, fmt):
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerow(
+            ["" if record.get(field) is None else record.get(field) for field in EXPORT_FIELDS]
+        )
+        return buffer.getvalue().encode()
+    return (json.dumps({field: record.get(field) for field in EXPORT_FIELDS}) + "\n").encode()
+
+
+# export_chunks: Groups streamed decisions into files of at most chunk_size
+# bytes, each starting with the header.  Only the chunk being filled is held
+# in memory.
+async def export_chunks(records, fmt, chunk_size):
+    head = header(fmt)
+    chunk, count = [head], 0
+    size = len(head)
+    async for record in records:
+        line = format_record(record, fmt)
+        if count and size + len(line) > chunk_size:
+            yield b"".join(chunk), count
+            chunk, count, size = [head], 0, len(head)
+        chunk.append(line)
+        size += len(line)
+        count += 1
+    if count:
+        yield b"".join(chunk), count
+
+
+# describe: One decision as a line of a history embed.
+def describe(record):
+    try:
+        moment = datetime.datetime.fromisoformat(record["timestamp"])
+        when = f"<t:{int(moment.timestamp())}:f>"
+    except (TypeError, ValueError):
+        when = "unknown time"
+    line = f"{when} **{record['action']}** <@{record['user_id']}>"
+    if record.get("admin_id"):
+        line += f" by <@{record['admin_id']}>"
+    return line
@@ -0,0 +1,62 @@
+import os
+
+
+# Settings every guild starts with.  The role and channel can be given in .env
+# for single-guild setups; otherwise they are set with /whitelist config.
+def default_config():
+    return {
+        "role_id": int(os.getenv("WHITELIST_ROLE_ID") or 0) or None,
+        "channel_id": int(os.getenv("WHITELIST_CHANNEL_ID") or 0) or None,
+        "auto_rejoin": True,  # Re-apply the role to logged members who rejoin.
+        "rejoin_dm": "You have been automatically whitelisted from a previous join.",
+        "deny_dm": "You have been denied access to this server. You will be banned shortly.",
+        # Join risk thresholds (0-1).  Members scoring below risk_accept_below
+        # are accepted and members scoring at least risk_deny_above are
+        # silently banned without review.  None turns either side off.
+        "risk_accept_below": None,
+        "risk_deny_above": None,
+        # Raid detection: raid_joins joins within raid_window seconds puts the
+        # guild in lockdown (raid_joins of None, the default, turns it off).
+        # Members who join during a lockdown get the quarantine role, if one
+        # is set.
+        "raid_joins": None,
+        "raid_window": 10,
+        "quarantine_role_id": None,
+        # [name, owner guild ID] of the trust lists whose members are
+        # whitelisted on joining.
+        "trust_lists": [],
+    }
+
+
+# GuildConfigService: Per-guild whitelist settings.  Reads are served from an
+# in-memory cache filled once at startup; updates are written through to the
+# whitelist store, so every process sharing the store sees the same settings
+# after its next load.
+class GuildConfigService:
+    PREFIX = "guild_config:"
+
+    def __init__(self, store):
+        self.store = store  # An AsyncStore.
+        self.defaults = default_config()
+        self.cache = {}  # guild_id -> settings dict
+
+    # load: Fills the cache with every stored guild configuration.
+    async def load(self):
+        """Loads every guild configuration into the cache."""
+        self.cache = {
+            int(key[len(self.PREFIX) :]): {**self.defaults, **value}
+            for key, value in await self.store.meta_items(self.PREFIX)
+        }
+
+    # get: Returns the settings for a guild, falling back to the defaults.
+    def get(self, guild_id):
+        """Returns the settings for a guild."""
+        return self.cache.get(guild_id, self.defaults)
+
+    # update: Changes settings for a guild and persists them.
+    async def update(self, guild_id, **changes):
+        """Updates and stores settings for a guild."""
+        config = {**self.get(guild_id), **changes}
+        await self.store.set_meta(f"{self.PREFIX}{guild_id}", config)
+        self.cache[guild_id] = config
+        return config
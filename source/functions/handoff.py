@@ -0,0 +1,28 @@
+# StateHandoff: Carries live state from a cog instance that is being
+# reloaded to the instance that replaces it, and buffers the events
+# dispatched while neither is loaded.  Lives outside the cog's module so it
+# survives the module being re-imported.
+class StateHandoff:
+    def __init__(self, state):
+        self.state = state  # Attribute name -> live object.
+        self.buffered = []  # (event name, args) in arrival order.
+        self.listeners = []  # (listener, event name) added to the bot.
+
+    # listen: Buffers the given events (e.g. "member_join") until release.
+    def listen(self, bot, *events):
+        for event in events:
+
+            async def buffer(*args, event=event):
+                self.buffered.append((event, args))
+
+            bot.add_listener(buffer, f"on_{event}")
+            self.listeners.append((buffer, f"on_{event}"))
+
+    # release: Stops buffering and returns the buffered events.
+    def release(self, bot):
+        """Removes the buffering listeners and returns what they caught."""
+        for listener, name in self.listeners:
+            bot.remove_listener(listener, name)
+        self.listeners = []
+        buffered, self.buffered = self.buffered, []
+        return buffered
@@ -0,0 +1,31 @@
+import os
+import discord
+
+
+# lean_mode: Whether LEAN_MODE is switched on in .env.
+def lean_mode():
+    return os.getenv("LEAN_MODE", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+# client_options: Gateway intents and caching options for the bot.  The
+# default profile enables everything.  The lean profile only enables what the
+# whitelist needs: guilds (roles and channels), members (joins and role
+# changes) and DM messages (so the owner can still use the .dev commands by
+# DMing the bot, since message content is not requested).  Only members who
+# join while the bot is running are cached, and guilds are not chunked at
+# startup; anything else is fetched on demand.
+def client_options(lean):
+    if not lean:
+        return {"intents": discord.Intents.all()}
+
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.members = True
+    intents.dm_messages = True
+    member_cache_flags = discord.MemberCacheFlags.none()
+    member_cache_flags.joined = True
+    return {
+        "intents": intents,
+        "member_cache_flags": member_cache_flags,
+        "chunk_guilds_at_startup": False,
+    }
@@ -0,0 +1,200 @@
+import glob
+import json
+import logging
+import os
+import time
+
+
+# WhitelistJournal: Append-only storage for the whitelist log.  New entries are
+# appended as single JSON lines to a journal file, and once the journal is
+# long enough it is renamed to the next numbered segment and a fresh journal
+# is started.  Rotating never copies or rereads the history, so an append
+# costs the same however long the log is.  The snapshot (written by the
+# legacy migration), the segments and the journal all use the JSON-lines
+# format so they can be streamed without loading the whole history into
+# memory.
+class WhitelistJournal:
+    # __init__: Derives the snapshot, segment and journal paths from the legacy
+    # log path (e.g. config/whitelist_log.json -> config/whitelist_log.snapshot.jsonl,
+    # config/whitelist_log.segment.000001.jsonl and config/whitelist_log.journal.jsonl).
+    def __init__(
+        self,
+        legacy_path,
+        fsync_batch=32,
+        fsync_interval=1.0,
+        rotate_every=50_000,
+    ):
+        base, _ = os.path.splitext(legacy_path)
+        self.legacy_path = legacy_path
+        self.snapshot_path = base + ".snapshot.jsonl"
+        self.segment_pattern = base + ".segment.{:06d}.jsonl"
+        self.journal_path = base + ".journal.jsonl"
+        self.fsync_batch = fsync_batch  # fsync after this many unsynced appends...
+        self.fsync_interval = fsync_interval  # ...or after this many seconds.
+        self.rotate_every = rotate_every  # Journal lines before rotation.
+        self._journal = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._journal_lines = 0
+
+    # open: Migrates the legacy file if needed and opens the journal for
+    # appending.
+    def open(self):
+        """Prepares the journal for use."""
+        directory = os.path.dirname(self.journal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.migrate_legacy()
+        self._repair_tail()
+        self._journal_lines = sum(1 for _ in self._iter_file(self.journal_path))
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    # migrate_legacy: One-time migration from the old JSON array format.  The
+    # legacy file is only renamed once the snapshot has been written safely, so
+    # a failed migration never loses data.
+    def migrate_legacy(self):
+        """Converts the legacy JSON array log into a snapshot file."""
+        if not os.path.exists(self.legacy_path) or os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.legacy_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except json.JSONDecodeError:
+            logging.error(
+                "Could not migrate %s: file is not valid JSON.  Leaving it in place.",
+                self.legacy_path,
+            )
+            return
+        self._write_snapshot(entries)
+        os.replace(self.legacy_path, self.legacy_path + ".migrated")
+        logging.info(
+            "Migrated %d entries from %s to %s.", len(entries), self.legacy_path, self.snapshot_path
+        )
+
+    # _repair_tail: Truncates a torn final line left by a crash mid-append, so
+    # the next append starts on a clean line.
+    def _repair_tail(self):
+        try:
+            with open(self.journal_path, "rb+") as f:
+                data = f.read()
+                if not data or data.endswith(b"\n"):
+                    return
+                keep = data.rfind(b"\n") + 1
+                f.truncate(keep)
+                logging.warning(
+                    "Discarded %d bytes of a torn write at the end of %s.",
+                    len(data) - keep,
+                    self.journal_path,
+                )
+        except FileNotFoundError:
+            return
+
+    # _iter_file: Yields every record in a JSON-lines file.  A malformed line
+    # (usually a torn write at the end of the journal after a crash) is skipped
+    # instead of discarding the whole file.
+    def _iter_file(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line_number, line in enumerate(f, start=1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        logging.warning(
+                            "Skipping malformed line %d in %s.", line_number, path
+                        )
+        except FileNotFoundError:
+            return
+
+    # segments: Returns the paths of the rotated segments, oldest first.  The
+    # numbers are zero-padded, so they sort by name.
+    def segments(self):
+        """Lists the rotated journal segments."""
+        return sorted(glob.glob(glob.escape(self.segment_pattern.split("{")[0]) + "[0-9]*.jsonl"))
+
+    # iter_records: Streams the snapshot, the segments and the journal.
+    def iter_records(self):
+        """Yields every logged record, oldest first."""
+        yield from self._iter_file(self.snapshot_path)
+        for path in self.segments():
+            yield from self._iter_file(path)
+        yield from self._iter_file(self.journal_path)
+
+    # load: Returns all records as a list.
+    def load(self):
+        """Loads every logged record into a list."""
+        return list(self.iter_records())
+
+    # append: Writes one record to the journal.  The write is flushed to the
+    # OS immediately; fsync is batched by count and time.
+    def append(self, record):
+        """Appends a record to the journal."""
+        self.append_many([record])
+
+    # append_many: Writes several records with a single flush.
+    def append_many(self, records):
+        """Appends several records to the journal."""
+        if self._journal is None:
+            self.open()
+        for record in records:
+            self._journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._journal.flush()
+        self._unsynced += len(records)
+        self._journal_lines += len(records)
+
+        if (
+            self._unsynced >= self.fsync_batch
+            or time.monotonic() - self._last_sync >= self.fsync_interval
+        ):
+            self.sync()
+        if self._journal_lines >= self.rotate_every:
+            self.rotate()
+
+    # sync: Forces buffered journal writes to disk.
+    def sync(self):
+        """Flushes and fsyncs the journal."""
+        if self._journal is None or self._unsynced == 0:
+            return
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    # _write_snapshot: Writes records to a temporary file, fsyncs it and
+    # atomically renames it over the snapshot.
+    def _write_snapshot(self, records):
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    # rotate: Renames the journal to the next segment and starts a new one.
+    # The rename is atomic, so after a crash every entry is in exactly one
+    # file: either still in the journal or already in the segment.
+    def rotate(self):
+        """Moves the journal into a new segment."""
+        self.sync()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        segments = self.segments()
+        number = int(segments[-1].rsplit(".", 2)[-2]) + 1 if segments else 1
+        segment_path = self.segment_pattern.format(number)
+        os.replace(self.journal_path, segment_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal_lines = 0
+        logging.info("Rotated whitelist journal into %s.", segment_path)
+
+    # close: Syncs and closes the journal file.
+    def close(self):
+        """Syncs and closes the journal."""
+        if self._journal is None:
+            return
+        self.sync()
+        self._journal.close()
+        self._journal = None
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import signal
+
+
+# Lifecycle: Shuts the bot down in order.  New work is refused first, then
+# every cog with a drain() coroutine finishes what it has in flight (queued
+# actions, buffered reviews, store writes) within a deadline, and only then
+# is the client closed, which unloads the cogs and closes their stores.
+# Whether to restart is left for the caller to act on once client.run()
+# has returned, so the old gateway session is gone before a new one starts.
+class Lifecycle:
+    def __init__(self, bot, timeout=10.0):
+        self.bot = bot
+        self.timeout = timeout  # Seconds allowed for draining.
+        self.stopping = False
+        self.restart = False
+        self.task = None
+
+    # install_signal_handlers: Drains on SIGTERM and SIGINT instead of dying
+    # mid-write.  Not supported by the Windows event loop, where the default
+    # handling stays in place.
+    def install_signal_handlers(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.request, False)
+            except (NotImplementedError, RuntimeError):
+                return
+
+    # request: Starts a shutdown or restart in the background, e.g. from a
+    # command handler that still wants to reply.
+    def request(self, restart=False):
+        """Schedules a graceful shutdown, or a restart if restart is True."""
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.shutdown(restart))
+        return self.task
+
+    async def shutdown(self, restart=False):
+        """Stops accepting work, drains in-flight work and closes the client."""
+        if self.stopping:
+            return
+        self.stopping = True
+        self.restart = restart
+        started = asyncio.get_running_loop().time()
+        logging.info("Draining in-flight work before %s.", "restart" if restart else "shutdown")
+        drains = [cog.drain() for cog in self.bot.cogs.values() if hasattr(cog, "drain")]
+        try:
+            await asyncio.wait_for(asyncio.gather(*drains), self.timeout)
+            logging.info("Drained in %.2fs.", asyncio.get_running_loop().time() - started)
+        except asyncio.TimeoutError:
+            logging.warning("Draining took longer than %.0fs; closing with work still queued.", self.timeout)
+        except Exception as e:
+            logging.exception("Error while draining: %s", e)
+        # Unloads every extension; cogs flush and close their stores there.
+        await self.bot.close()
@@ -0,0 +1,114 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from source.functions.colors import colors as cr
+
+# Fields that callers attach with extra={...} and that JSON records carry as
+# top-level keys, e.g. logging.info("Banned %s", user.id, extra=log_fields(guild, user, "ban")).
+FIELDS = ("guild_id", "user_id", "admin_id", "action", "route")
+
+# log_fields: Builds the extra={...} fields for a log call from the guild,
+# member and action it is about.  Guilds and users may be given as objects
+# or as IDs; fields left out are left off the record.
+def log_fields(guild=None, user=None, action=None):
+    """Returns the structured fields for a log call."""
+    fields = {"guild_id": getattr(guild, "id", guild), "user_id": getattr(user, "id", user), "action": action}
+    return {name: value for name, value in fields.items() if value is not None}
+
+
+LEVEL_COLORS = {
+    logging.DEBUG: cr.GREY,
+    logging.INFO: cr.BLUE,
+    logging.WARNING: cr.WARNING,
+    logging.ERROR: cr.FAIL,
+    logging.CRITICAL: cr.FAIL,
+}
+
+_listener = None
+
+
+# JsonFormatter: One JSON object per line, with the structured fields as
+# top-level keys so log pipelines can filter on guild, member and action.
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+# ColorFormatter: The colored console format bot.py has always printed
+# (grey time, colored level, cyan message).
+class ColorFormatter(logging.Formatter):
+    def format(self, record):
+        line = (
+            cr.GREY + self.formatTime(record, "%Y-%m-%d %H:%M:%S") + cr.ENDC
+            + LEVEL_COLORS.get(record.levelno, cr.BLUE) + f" {record.levelname:<9}"
+            + cr.CYAN + record.getMessage() + cr.ENDC
+        )
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+# DeferredQueueHandler: Hands records to the listener thread unformatted.
+# The stock QueueHandler merges the message with its arguments on the
+# calling thread; here that happens on the listener thread, so the event
+# loop only pays for creating the record.  Arguments must therefore not be
+# mutated after logging, which holds for the IDs and names logged here.
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
+
+
+FORMATTERS = {
+    "color": ColorFormatter,
+    "json": JsonFormatter,
+    "plain": lambda: logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"),
+}
+
+
+# setup_logging: Routes every logger through a queue to a background thread
+# that formats and writes the records.  LOG_FORMAT picks "color" (default),
+# "json" or "plain"; LOG_LEVEL sets the level.  Safe to call more than once.
+def setup_logging():
+    """Installs the queue-based logging pipeline."""
+    global _listener
+    if _listener is not None:
+        return _listener
+    log_format = os.getenv("LOG_FORMAT", "color").strip().lower()
+    if log_format not in FORMATTERS:
+        raise SystemExit(f"LOG_FORMAT must be one of {', '.join(FORMATTERS)}.")
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(FORMATTERS[log_format]())
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [DeferredQueueHandler(records)]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").strip().upper())
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+# stop_logging: Writes out queued records and stops the listener thread.
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,308 @@
+import asyncio
+import contextlib
+import datetime
+import itertools
+import logging
+import time
+import discord
+from source.functions.log import log_fields
+from source.functions.metrics import REGISTRY
+from source.functions.scheduler import PRIORITY_ADMIN, PRIORITY_DM
+
+# Discord error codes that only DMs run into.  40003 means DM channels are
+# being opened too fast, which holds for every recipient, so the whole queue
+# backs off.  50007 means this user can't be messaged (DMs closed, bot
+# blocked or no shared guild left), which retrying won't change.
+OPENING_TOO_FAST = 40003
+CANNOT_MESSAGE_USER = 50007
+
+DMS_TOTAL = REGISTRY.counter("whitelist_dms_total", "DMs handled by the DM queue.", ("kind", "result"))
+
+
+# DmQueue: Delivers the DMs the whitelist sends (rejoin and deny notices) in
+# the background.  Outbox writes are batched in the background, but each DM
+# waits for its write before it is sent, and is removed once it is delivered
+# or given up on, so DMs queued when the bot stops are sent after it starts
+# again.  A DM to a user that is already queued for the same guild and kind
+# is not queued twice.  A fixed pool of senders passes them to the
+# scheduler's DM route, except for DMs a ban waits on, which are sent
+# straight away.  When Discord says DM channels are being opened too fast,
+# sending pauses and the DM is retried.  DMs that can't be delivered are
+# recorded in the whitelist log as <kind>_dm_failed.
+class DmQueue:
+    def __init__(self, store, scheduler, bot, owner="0", concurrency=2, limit=10_000, max_attempts=3):
+        self.store = store  # An AsyncStore.
+        self.scheduler = scheduler
+        self.bot = bot  # Resolves users for DMs restored from the outbox.
+        self.owner = owner  # Cluster ID; each cluster only restores its own DMs.
+        self.concurrency = concurrency
+        self.limit = limit  # Queued DMs beyond this are dropped, unless a ban waits on them.
+        self.max_attempts = max_attempts
+        self.queue = asyncio.PriorityQueue()  # (priority, sequence, key)
+        self.sequence = itertools.count()
+        self.entries = {}  # key -> outbox entry not picked up by a sender yet
+        self.users = {}  # key -> the user object the DM was queued with
+        self.futures = {}  # key -> future resolved when the DM is delivered or given up on
+        self.urgent = set()  # Keys of DMs a ban is waiting on.
+        self.delivering = set()  # Tasks sending urgent DMs.
+        # Outbox changes not written yet, batched by _persist.
+        self.added = {}
+        self.removed = set()
+        self.dirty = asyncio.Event()
+        self.writing = asyncio.Lock()  # Held while the outbox is written.
+        self.resume_at = 0.0  # monotonic() time the senders pause until.
+        self.backoff = 5.0
+        self.senders = []
+        self.persist_task = None
+        self.closing = asyncio.Event()
+        self.recording = set()  # Failures of dropped DMs being written to the log.
+        self.sent = self.failed = self.dropped = self.deduplicated = 0
+
+    def __len__(self):
+        return len(self.futures)
+
+    # start: Restores the DMs left in the outbox and starts the senders.
+    async def start(self):
+        """Restores undelivered DMs and starts sending."""
+        restored = await self.store.outbox(self.owner)
+        for entry in restored:
+            self._queue(entry, None, PRIORITY_DM)
+        self.closing.clear()
+        self.senders = [asyncio.create_task(self._sender()) for _ in range(self.concurrency)]
+        self.persist_task = asyncio.create_task(self._persist())
+        if restored:
+            logging.info("Restored %s undelivered DMs.", len(restored))
+
+    # stop: Lets the senders finish the DMs they are sending, then writes the
+    # outbox.  DMs not sent yet stay in it, and anyone waiting on one (a ban)
+    # gets an error instead and carries on.  Safe to call more than once.
+    async def stop(self):
+        """Stops sending and saves the DMs still queued."""
+        self.closing.set()
+        for _ in self.senders:
+            self.queue.put_nowait((-1, next(self.sequence), None))
+        await asyncio.gather(*self.senders, *self.delivering, return_exceptions=True)
+        self.senders = []
+        if self.persist_task is not None:
+            self.persist_task.cancel()
+            await asyncio.gather(self.persist_task, return_exceptions=True)
+            self.persist_task = None
+        await asyncio.gather(*self.recording)
+        await self.flush()
+        for future in self.futures.values():
+            if not future.done():
+                future.set_result(RuntimeError("The DM queue stopped before the DM was sent"))
+        self.futures.clear()
+
+    # flush: Writes the outbox changes made since the last write.  Waits for
+    # a write already in progress first, so once it returns every DM queued
+    # before the call is in the outbox.
+    async def flush(self):
+        """Writes queued and delivered DMs to the outbox."""
+        async with self.writing:
+            added, removed = self.added, self.removed
+            self.added, self.removed = {}, set()
+            if not (added or removed):
+                return
+            try:
+                await self.store.update_outbox(list(added.values()), list(removed))
+            except (Exception, asyncio.CancelledError):
+                # Keep the changes for the next write, unless newer ones
+                # replaced them.  Writing them twice is harmless.
+                for key, entry in added.items():
+                    if key not in self.removed:
+                        self.added.setdefault(key, entry)
+                self.removed.update(key for key in removed if key not in self.added)
+                raise
+
+    # send: Queues a DM and returns a future that resolves to None once it is
+    # delivered, or to the exception it failed with.  Pass urgent=True when a
+    # ban waits on the DM; it is then sent right away at admin priority
+    # instead of waiting for a sender.
+    def send(self, guild_id, user, content, kind, urgent=False):
+        """Queues a DM to a user."""
+        key = (guild_id, user.id, kind)
+        if key in self.futures:
+            self.deduplicated += 1
+            DMS_TOTAL.inc(kind=kind, result="deduplicated")
+            if urgent and key in self.entries:
+                self._deliver_now(key, self.entries.pop(key))
+            return self.futures[key]
+        entry = {
+            "guild_id": guild_id,
+            "user_id": user.id,
+            "kind": kind,
+            "content": content,
+            "owner": self.owner,
+            "queued": time.time(),
+        }
+        if len(self.futures) >= self.limit and not urgent:
+            self.dropped += 1
+            DMS_TOTAL.inc(kind=kind, result="dropped")
+            error = OverflowError("DM queue full")
+            task = asyncio.create_task(self._record_failure(entry, user, error))
+            self.recording.add(task)
+            task.add_done_callback(self.recording.discard)
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(error)
+            return future
+        self.removed.discard(key)
+        self.added[key] = entry
+        self.dirty.set()
+        if self.closing.is_set():
+            # Saved by stop() and sent after the next start.
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(RuntimeError("The DM queue stopped before the DM was sent"))
+            return future
+        future = self._queue(entry, user, PRIORITY_ADMIN if urgent else PRIORITY_DM)
+        if urgent:
+            self._deliver_now(key, self.entries.pop(key))
+        return future
+
+    # settle: Waits for a DM from send() for at most timeout seconds (None
+    # waits as long as it takes).  Returns None if it was delivered,
+    # otherwise the error, or asyncio.TimeoutError if it is still queued.
+    async def settle(self, future, timeout=None):
+        """Waits for a queued DM to be delivered or given up on."""
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError as e:
+            return e
+
+    def _queue(self, entry, user, priority):
+        key = (entry["guild_id"], entry["user_id"], entry["kind"])
+        self.entries[key] = entry
+        if user is not None:
+            self.users[key] = user
+        future = self.futures[key] = asyncio.get_running_loop().create_future()
+        if priority != PRIORITY_ADMIN:
+            self.queue.put_nowait((priority, next(self.sequence), key))
+        return future
+
+    # _deliver_now: Sends an urgent DM in its own task.
+    def _deliver_now(self, key, entry):
+        self.urgent.add(key)
+        task = asyncio.create_task(self._deliver(key, entry))
+        self.delivering.add(task)
+        task.add_done_callback(self.delivering.discard)
+
+    # _sender: Takes DMs off the queue one at a time until stop() queues a
+    # None key.  DMs that turned urgent after being queued were taken out of
+    # entries and are skipped.
+    async def _sender(self):
+        while True:
+            _, _, key = await self.queue.get()
+            if key is None:
+                return
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                continue
+            pause = self.resume_at - time.monotonic()
+            if pause > 0:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.closing.wait(), pause)
+                if self.closing.is_set():
+                    return  # Still in the outbox for the next start.
+            await self._deliver(key, entry)
+
+    # _deliver: Makes sure the DM is in the outbox, then sends it through the
+    # scheduler and settles its future.  If the outbox can't be written the
+    # DM is sent anyway; it just won't survive a restart.
+    async def _deliver(self, key, entry):
+        guild_id, user_id, kind = key
+        urgent = key in self.urgent
+        user = self.users.pop(key, None)
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error("Error writing the DM outbox: %s", e)
+        try:
+            if user is None:
+                user = self.bot.get_user(user_id) or await self.bot.fetch_user(user_id)
+            await self.scheduler.run(
+                PRIORITY_ADMIN if urgent else PRIORITY_DM, "dm", ("dm",) + key, user.send, entry["content"]
+            )
+        except discord.HTTPException as e:
+            attempts = entry.get("attempts", 0) + 1
+            if (e.code == OPENING_TOO_FAST or e.status == 429) and attempts < self.max_attempts:
+                self._pause(e)
+                self.entries[key] = {**entry, "attempts": attempts}
+                if user is not None:
+                    self.users[key] = user
+                self.queue.put_nowait((PRIORITY_ADMIN if urgent else PRIORITY_DM, next(self.sequence), key))
+                DMS_TOTAL.inc(kind=kind, result="retried")
+                return
+            error = e
+        except Exception as e:
+            error = e
+        else:
+            error = None
+            self.sent += 1
+            self.backoff = 5.0
+            DMS_TOTAL.inc(kind=kind, result="sent")
+        if error is not None:
+            self.failed += 1
+            DMS_TOTAL.inc(kind=kind, result="failed")
+            await self._record_failure(entry, user, error)
+        self.urgent.discard(key)
+        self.added.pop(key, None)
+        self.removed.add(key)
+        self.dirty.set()
+        future = self.futures.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(error)
+
+    # _pause: Holds every sender back after a DM rate limit, doubling the
+    # pause each time it happens again before a DM gets through.
+    def _pause(self, error):
+        self.resume_at = max(self.resume_at, time.monotonic() + self.backoff)
+        logging.warning("DM rate limit hit (%s), pausing DMs for %.0fs.", error, self.backoff)
+        self.backoff = min(self.backoff * 2, 300.0)
+
+    # _record_failure: Logs an undeliverable DM and adds it to the whitelist
+    # log, so it shows up in /whitelist history and exports.
+    async def _record_failure(self, entry, user, error):
+        kind, user_id = entry["kind"], entry["user_id"]
+        extra = log_fields(entry["guild_id"], user_id, f"{kind}_dm")
+        if isinstance(error, discord.Forbidden) and error.code == CANNOT_MESSAGE_USER:
+            logging.warning("Can't send %s DM to user %s (DMs closed or bot blocked).", kind, user_id, extra=extra)
+        else:
+            logging.warning("Failed to send %s DM to user %s: %s", kind, user_id, error, extra=extra)
+        try:
+            await self.store.record(
+                {
+                    "user_id": user_id,
+                    "guild_id": entry["guild_id"],
+                    "action": f"{kind}_dm_failed",
+                    "username": getattr(user, "name", None),
+                    "discriminator": getattr(user, "discriminator", None),
+                    "admin_id": None,
+                    "timestamp": datetime.datetime.now().isoformat(),
+                }
+            )
+        except Exception as e:
+            logging.error("Error writing to whitelist log: %s", e)
+
+    # _persist: Writes outbox changes in the background, one batch per pass,
+    # so a burst of DMs costs a handful of writes.
+    async def _persist(self):
+        while True:
+            await self.dirty.wait()
+            self.dirty.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.exception("Error writing the DM outbox: %s", e)
+                await asyncio.sleep(1)
+                self.dirty.set()
+
+    def stats(self):
+        """Returns DM queue figures."""
+        return {
+            "queued": len(self.futures),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "deduplicated": self.deduplicated,
+            "paused": max(0.0, self.resume_at - time.monotonic()),
+        }
@@ -0,0 +1,43 @@
+import collections
+import time
+
+
+# JoinRateTracker: Counts joins per guild over a sliding window.  Each guild
+# keeps a deque of join times; old entries fall off the left as new ones are
+# added, so recording a join and reading the rate are O(1) amortised.
+class JoinRateTracker:
+    def __init__(self):
+        self.joins = {}  # guild_id -> deque of time.monotonic() values
+
+    # record: Adds a join and returns the number of joins in the last
+    # `window` seconds, including this one.
+    def record(self, guild_id, window, now=None):
+        now = time.monotonic() if now is None else now
+        joins = self.joins.setdefault(guild_id, collections.deque())
+        joins.append(now)
+        return self._trim(joins, window, now)
+
+    # count: Returns the number of joins in the last `window` seconds.
+    def count(self, guild_id, window, now=None):
+        joins = self.joins.get(guild_id)
+        if not joins:
+            return 0
+        return self._trim(joins, window, time.monotonic() if now is None else now)
+
+    @staticmethod
+    def _trim(joins, window, now):
+        while joins and joins[0] <= now - window:
+            joins.popleft()
+        return len(joins)
+
+
+# Lockdown: A guild whose join rate crossed its raid threshold.  Joiners are
+# held here instead of being posted for review one by one.
+class Lockdown:
+    def __init__(self, guild_id, rate):
+        self.guild_id = guild_id
+        self.started = time.monotonic()
+        self.peak_rate = rate  # Highest joins-per-window seen.
+        self.members = []  # Everyone queued for review during the lockdown.
+        self.unquarantined = []  # Queued members still waiting for the quarantine role.
+        self.task = None  # Watches the rate and ends the lockdown.
@@ -0,0 +1,110 @@
+import bisect
+import collections
+import datetime
+import re
+import discord
+
+# Names ending in a long run of digits, or starting like common spam
+# accounts, are typical of bulk-created accounts.
+SUSPICIOUS_NAME = re.compile(r"\d{4,}$|^(free|nitro|gift|steam|airdrop)", re.IGNORECASE)
+NAME_NOISE = re.compile(r"[\d_.\-]+")
+
+# Accounts younger than this many days score on the account age signal,
+# the youngest the most.
+ACCOUNT_AGE_DAYS = 30
+
+
+# account_age: 1.0 for accounts created at join time, falling to 0.0 for
+# accounts ACCOUNT_AGE_DAYS or older.  Creation time comes from the ID, so
+# no API call is needed.
+def account_age(members, scorer):
+    scores = []
+    for member in members:
+        joined = member.joined_at or datetime.datetime.now(datetime.timezone.utc)
+        age_days = (joined - discord.utils.snowflake_time(member.id)).total_seconds() / 86400
+        scores.append(min(1.0, max(0.0, 1 - age_days / ACCOUNT_AGE_DAYS)))
+    return scores
+
+
+# no_avatar: 1.0 for members who never set an avatar.
+def no_avatar(members, scorer):
+    return [1.0 if member.avatar is None else 0.0 for member in members]
+
+
+# name_pattern: 0.6 for a suspicious name, 1.0 when three or more members of
+# the burst share a name once digits and punctuation are removed
+# (raider1234, raider_99, ...).
+def name_pattern(members, scorer):
+    stems = [NAME_NOISE.sub("", member.name.lower()) for member in members]
+    counts = collections.Counter(stems)
+    scores = []
+    for member, stem in zip(members, stems):
+        if stem and counts[stem] >= 3:
+            scores.append(1.0)
+        elif SUSPICIOUS_NAME.search(member.name):
+            scores.append(0.6)
+        else:
+            scores.append(0.0)
+    return scores
+
+
+# burst_density: How crowded the minute around each join was, relative to
+# scorer.burst_size joins.  Counts come from the guild's recent join times,
+# so a raid split across several review windows still scores as one.
+def burst_density(members, scorer):
+    times = scorer.record_joins(members)
+    window = scorer.burst_window / 2
+    return [
+        min(1.0, (bisect.bisect_right(times, t + window) - bisect.bisect_left(times, t - window)) / scorer.burst_size)
+        for t in (scorer.join_time(member) for member in members)
+    ]
+
+
+# Weight and function of each signal.  Weights add up to 1, so scores stay
+# between 0 (looks fine) and 1 (looks like a raid account).
+DEFAULT_SIGNALS = {
+    "account_age": (0.4, account_age),
+    "no_avatar": (0.15, no_avatar),
+    "name_pattern": (0.2, name_pattern),
+    "burst_density": (0.25, burst_density),
+}
+
+
+# RiskScorer: Scores a burst of joins in one pass.  Each signal sees the
+# whole burst at once and returns one score per member, so signals that
+# compare members with each other (shared names, join density) cost one
+# pass instead of one per member.  Signals can be added or reweighted by
+# passing a different mapping of name -> (weight, function).
+class RiskScorer:
+    def __init__(self, signals=None, burst_window=60.0, burst_size=10, history=10_000):
+        self.signals = dict(DEFAULT_SIGNALS if signals is None else signals)
+        self.burst_window = burst_window  # Seconds.
+        self.burst_size = burst_size  # Joins per window that score 1.0.
+        self.history = history  # Join times kept per guild.
+        self.joins = {}  # guild_id -> sorted recent join timestamps
+
+    # join_time: A member's join time as a POSIX timestamp.
+    @staticmethod
+    def join_time(member):
+        joined = member.joined_at or datetime.datetime.now(datetime.timezone.utc)
+        return joined.timestamp()
+
+    # record_joins: Adds a burst to its guild's join history and returns the
+    # history, sorted, with joins older than the window dropped.
+    def record_joins(self, members):
+        times = self.joins.setdefault(members[0].guild.id, [])
+        for member in members:
+            bisect.insort(times, self.join_time(member))
+        cutoff = bisect.bisect_left(times, times[-1] - self.burst_window)
+        del times[: max(cutoff, len(times) - self.history)]
+        return times
+
+    def score(self, members):
+        """Returns a risk score between 0 and 1 for each member of a burst."""
+        if not members:
+            return []
+        totals = [0.0] * len(members)
+        for weight, signal in self.signals.values():
+            for i, value in enumerate(signal(members, self)):
+                totals[i] += weight * value
+        return totals
@@ -0,0 +1,336 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+import aiohttp
+import discord
+from source.functions.metrics import REGISTRY
+
+# Priorities, lowest value first: admin clicks jump ahead of background work
+# (auto-rejoins, reconciliation, bulk commands), which jumps ahead of DMs.
+PRIORITY_ADMIN = 0
+PRIORITY_AUTO = 1
+PRIORITY_DM = 2
+
+PRIORITY_NAMES = {PRIORITY_ADMIN: "admin", PRIORITY_AUTO: "auto", PRIORITY_DM: "dm"}
+
+# Requests per second and burst size for each kind of route.  discord.py still
+# honours Discord's own buckets; these keep a raid from draining them so
+# admin actions always find capacity.
+ROUTE_LIMITS = {
+    "roles": (5.0, 10),
+    "ban": (5.0, 10),
+    "dm": (1.0, 5),
+}
+
+
+WAIT_SECONDS = REGISTRY.histogram(
+    "whitelist_scheduler_wait_seconds", "Time actions spent queued before running.", ("priority",)
+)
+RUN_SECONDS = REGISTRY.histogram(
+    "whitelist_scheduler_run_seconds", "Time actions took to run, including retries.", ("priority",)
+)
+ACTIONS_TOTAL = REGISTRY.counter(
+    "whitelist_scheduler_actions_total", "Actions run by the scheduler.", ("priority", "result")
+)
+
+
+# TokenBucket: Allows `rate` acquisitions per second with bursts of up to
+# `capacity`.
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # delay: Takes a token and returns 0 if one is available, otherwise
+    # returns how many seconds until one will be.
+    def delay(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+# Job: One scheduled API call.  Ordered by priority, then submission order.
+class Job:
+    def __init__(self, priority, sequence, route, key, func, args, kwargs, future):
+        self.priority = priority
+        self.sequence = sequence
+        self.route = route
+        self.key = key
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.submitted = time.monotonic()
+        self.started = False
+        self.reserved = False  # Holds a token taken when it left its route's waiting list.
+        self.superseded = False  # Replaced by a higher priority copy; skipped.
+        self.counted = False  # Counted in the scheduler's backlog.
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+# ActionScheduler: Runs role grants, bans and DMs through priority queues and
+# per-route token buckets.  Failed calls are retried with jittered
+# exponential backoff when the failure is transient, and jobs with the same
+# key (e.g. banning the same member) share one execution instead of running
+# twice; if the second submission has a higher priority, the queued job is
+# moved up to it.
+class ActionScheduler:
+    def __init__(self, workers=4, max_retries=3, base_delay=1.0, rate_share=1.0):
+        self.workers = workers
+        # Fraction of ROUTE_LIMITS this scheduler may use.  Worker processes
+        # in split mode divide the limits between them.
+        self.rate_share = rate_share
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.queue = asyncio.PriorityQueue()
+        self.buckets = {}  # route -> TokenBucket
+        self.jobs = {}  # key -> the queued or running job
+        self.sequence = itertools.count()
+        self.tasks = []
+        # Jobs waiting for a token, as a priority heap per route, and the one
+        # timer per route that releases the next of them when a token is due.
+        self.waiting = {}
+        self.timers = {}
+        # Metrics: jobs not started yet, counters and wait/run time totals
+        # per priority.
+        self.backlog = {priority: 0 for priority in PRIORITY_NAMES}
+        self.completed = {priority: 0 for priority in PRIORITY_NAMES}
+        self.failed = {priority: 0 for priority in PRIORITY_NAMES}
+        self.retried = 0
+        self.deduplicated = 0
+        self.wait_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.wait_max = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.run_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+
+    def start(self):
+        """Starts the worker tasks."""
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stops the workers and cancels anything still queued."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for handle in self.timers.values():
+            handle.cancel()
+        self.timers.clear()
+        for jobs in self.waiting.values():
+            for job in jobs:
+                if not job.future.done():
+                    job.future.cancel()
+        self.waiting.clear()
+        while not self.queue.empty():
+            job = self.queue.get_nowait()
+            if not job.future.done():
+                job.future.cancel()
+        self.jobs.clear()
+        self.backlog = {priority: 0 for priority in PRIORITY_NAMES}
+
+    # drain: Waits until every queued, waiting and running job has
+    # finished.  Callers bound it with a timeout; whatever is left is
+    # cancelled by stop().
+    async def drain(self):
+        """Waits for the queue to empty."""
+        while True:
+            await self.queue.join()
+            if not any(self.waiting.values()):
+                return
+            # Waiting jobs are requeued as their bucket refills.
+            await asyncio.sleep(0.05)
+
+    # submit: Queues a call and returns a future for its result.  If a job
+    # with the same key is already queued or running, its future is returned
+    # instead, and a queued job is moved up to this call's priority if that
+    # is higher: it is replaced by a copy at the new priority and the
+    # original is skipped when it comes up.
+    def submit(self, priority, route, key, func, *args, **kwargs):
+        """Queues func(*args, **kwargs) and returns a future for its result."""
+        existing = self.jobs.get(key) if key is not None else None
+        if existing is not None:
+            self.deduplicated += 1
+            if priority < existing.priority and not existing.started:
+                existing.superseded = True
+                self._uncount(existing)
+                job = Job(
+                    priority, next(self.sequence), existing.route, key,
+                    existing.func, existing.args, existing.kwargs, existing.future,
+                )
+                job.submitted = existing.submitted
+                job.reserved = existing.reserved
+                self.jobs[key] = job
+                self._count(job)
+                self._enqueue(job)
+            return existing.future
+        future = asyncio.get_running_loop().create_future()
+        job = Job(priority, next(self.sequence), route, key, func, args, kwargs, future)
+        if key is not None:
+            self.jobs[key] = job
+            future.add_done_callback(lambda _: self.jobs.pop(key, None))
+        self._count(job)
+        self.queue.put_nowait(job)
+        return future
+
+    # _count / _uncount: Keep the per-priority backlog of jobs that haven't
+    # started.  A job leaves it once, when it starts or is skipped.
+    def _count(self, job):
+        job.counted = True
+        self.backlog[job.priority] += 1
+
+    def _uncount(self, job):
+        if job.counted:
+            job.counted = False
+            self.backlog[job.priority] -= 1
+
+    # _enqueue: Queues a job that moved up in priority.  If other jobs on
+    # its route are waiting for a token, it waits with them, so it is
+    # released ahead of the lower priority ones.
+    def _enqueue(self, job):
+        if self.waiting.get(job.route) and not job.reserved:
+            heapq.heappush(self.waiting[job.route], job)
+        else:
+            self.queue.put_nowait(job)
+
+    # run: Queues a call and waits for its result.  Exceptions raised by the
+    # call (e.g. discord.Forbidden) are raised here.
+    async def run(self, priority, route, key, func, *args, **kwargs):
+        """Queues func(*args, **kwargs) and waits for its result."""
+        return await asyncio.shield(self.submit(priority, route, key, func, *args, **kwargs))
+
+    # bucket: Returns the token bucket for a route such as "roles:<guild_id>".
+    def bucket(self, route):
+        if route not in self.buckets:
+            rate, capacity = ROUTE_LIMITS[route.split(":")[0]]
+            self.buckets[route] = TokenBucket(rate * self.rate_share, max(1.0, capacity * self.rate_share))
+        return self.buckets[route]
+
+    # _wait: Sets a job aside until its route has a token, arming the
+    # route's timer if it isn't already.
+    def _wait(self, job, delay):
+        heapq.heappush(self.waiting.setdefault(job.route, []), job)
+        if job.route not in self.timers:
+            self.timers[job.route] = asyncio.get_running_loop().call_later(delay, self._release, job.route)
+
+    # _release: Runs when a route's timer fires.  Takes a token for the
+    # highest priority job waiting on the route and puts it back on the
+    # queue, then arms the timer for the next token if more are waiting.
+    # One timer per route, whatever the backlog.
+    def _release(self, route):
+        self.timers.pop(route, None)
+        jobs = self.waiting.get(route, [])
+        while jobs and (jobs[0].future.done() or jobs[0].superseded):
+            self._uncount(heapq.heappop(jobs))
+        if not jobs:
+            self.waiting.pop(route, None)
+            return
+        delay = self.bucket(route).delay()
+        if delay == 0:
+            job = heapq.heappop(jobs)
+            job.reserved = True
+            self.queue.put_nowait(job)
+            if not jobs:
+                self.waiting.pop(route, None)
+                return
+            bucket = self.buckets[route]
+            delay = max(0.0, (1 - bucket.tokens) / bucket.rate)
+        self.timers[route] = asyncio.get_running_loop().call_later(delay, self._release, route)
+
+    # _worker: Runs jobs in priority order.  A job whose route has no tokens
+    # left, or already has jobs waiting, waits on the route until its turn,
+    # so the worker moves on to other routes instead of sleeping; a burst of
+    # DMs never holds up an admin's role grant.
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.future.done() or job.superseded:
+                    self._uncount(job)
+                    continue
+                if not job.reserved:
+                    if self.waiting.get(job.route):
+                        self._wait(job, 0)
+                        continue
+                    wait = self.bucket(job.route).delay()
+                    if wait > 0:
+                        self._wait(job, wait)
+                        continue
+                job.started = True
+                self._uncount(job)
+                waited = time.monotonic() - job.submitted
+                self.wait_total[job.priority] += waited
+                self.wait_max[job.priority] = max(self.wait_max[job.priority], waited)
+                WAIT_SECONDS.observe(waited, priority=PRIORITY_NAMES[job.priority])
+                started = time.monotonic()
+                try:
+                    result = await self._call(job)
+                except Exception as e:
+                    self.failed[job.priority] += 1
+                    ACTIONS_TOTAL.inc(priority=PRIORITY_NAMES[job.priority], result="failed")
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    self.completed[job.priority] += 1
+                    ACTIONS_TOTAL.inc(priority=PRIORITY_NAMES[job.priority], result="completed")
+                    if not job.future.done():
+                        job.future.set_result(result)
+                finally:
+                    self.run_total[job.priority] += time.monotonic() - started
+                    RUN_SECONDS.observe(time.monotonic() - started, priority=PRIORITY_NAMES[job.priority])
+            finally:
+                self.queue.task_done()
+
+    # _call: Runs a job, retrying server errors and connection problems.
+    # Client errors such as Forbidden or NotFound are not retried.
+    async def _call(self, job):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await job.func(*job.args, **job.kwargs)
+            except discord.HTTPException as e:
+                if e.status < 500 or attempt == self.max_retries:
+                    raise
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise
+                error = e
+            self.retried += 1
+            delay = self.base_delay * 2**attempt * random.uniform(0.5, 1.5)
+            logging.warning(
+                "Retrying %s in %.1fs after %s: %s",
+                job.route,
+                delay,
+                error.__class__.__name__,
+                error,
+                extra={"route": job.route},
+            )
+            await asyncio.sleep(delay)
+
+    # stats: Backlog and latency figures for monitoring.
+    def stats(self):
+        """Returns scheduler metrics."""
+        backlog = {name: self.backlog[priority] for priority, name in PRIORITY_NAMES.items()}
+        stats = {"backlog": backlog, "retried": self.retried, "deduplicated": self.deduplicated}
+        for priority, name in PRIORITY_NAMES.items():
+            done = self.completed[priority] + self.failed[priority]
+            stats[name] = {
+                "completed": self.completed[priority],
+                "failed": self.failed[priority],
+                "avg_wait": self.wait_total[priority] / done if done else 0.0,
+                "max_wait": self.wait_max[priority],
+                "avg_run": self.run_total[priority] / done if done else 0.0,
+            }
+        return stats
@@ -0,0 +1,609 @@
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from source.functions.journal import WhitelistJournal
+
+# Decisions that put a user on the whitelist, and decisions that take them off.
+ACCEPT_ACTIONS = {"accept", "auto_accept", "auto_rejoin", "auto_federated"}
+DENY_ACTIONS = {"deny", "silent_deny", "auto_deny"}
+
+
+# normalize_record: Fills in the fields that entries written before decisions
+# were recorded do not have.  Legacy entries are accepts with no guild.
+def normalize_record(record):
+    record.setdefault("action", "accept")
+    record.setdefault("guild_id", None)
+    record.setdefault("admin_id", None)
+    record.setdefault("timestamp", "")
+    return record
+
+
+# matches: Checks a record against the optional query filters.  Timestamps are
+# ISO 8601 strings, so they compare correctly as strings.  Legacy records (no
+# guild) belong to legacy_guild_id when it is set, and to every guild when it
+# isn't, the same as for the whitelist itself.
+def matches(
+    record, guild_id=None, user_id=None, action=None, since=None, until=None, admin_id=None, legacy_guild_id=None
+):
+    if guild_id is not None and record["guild_id"] != guild_id:
+        if record["guild_id"] is not None or legacy_guild_id not in (None, guild_id):
+            return False
+    if user_id is not None and record["user_id"] != user_id:
+        return False
+    if admin_id is not None and record["admin_id"] != admin_id:
+        return False
+    if action is not None and record["action"] != action:
+        return False
+    if since is not None and record["timestamp"] < since:
+        return False
+    if until is not None and record["timestamp"] >= until:
+        return False
+    return True
+
+
+# fold_whitelisted: Replays decisions in order and returns the set of
+# (guild_id, user_id) pairs whose latest decision is an accept.  A deny also
+# clears a legacy (guild-less) accept for that user, if it was made in a guild
+# the legacy accept applies to: legacy_guild_id, or any guild when it is unset.
+def fold_whitelisted(records, legacy_guild_id=None):
+    whitelisted = set()
+    for record in records:
+        key = (record["guild_id"], record["user_id"])
+        if record["action"] in ACCEPT_ACTIONS:
+            whitelisted.add(key)
+        elif record["action"] in DENY_ACTIONS:
+            whitelisted.discard(key)
+            if legacy_guild_id in (None, record["guild_id"]):
+                whitelisted.discard((None, record["user_id"]))
+    return whitelisted
+
+
+# WhitelistStore: The interface every storage backend implements.  Records are
+# plain dicts with user_id, guild_id, action, username, discriminator,
+# admin_id and timestamp keys.
+class WhitelistStore:
+    # open: read_only opens an existing store for queries only, e.g. from the
+    # audit CLI while the bot is running.
+    def open(self, read_only=False):
+        """Prepares the store for use."""
+        raise NotImplementedError
+
+    def close(self):
+        """Flushes and closes the store."""
+        raise NotImplementedError
+
+    def record(self, record):
+        """Stores one decision."""
+        self.record_many([record])
+
+    def record_many(self, records):
+        """Stores several decisions in one write."""
+        raise NotImplementedError
+
+    def query(
+        self, guild_id=None, user_id=None, action=None, since=None, until=None, admin_id=None, legacy_guild_id=None
+    ):
+        """Yields matching decisions, oldest first."""
+        raise NotImplementedError
+
+    def load(self):
+        """Loads every decision into a list."""
+        return list(self.query())
+
+    # tail: Lets processes sharing a store follow each other's decisions.
+    # A cursor of None returns no records, only the current position.  A
+    # store only one process can use has nothing to follow.
+    def tail(self, cursor=None, limit=10_000):
+        """Returns decisions stored after cursor and the cursor for the next call."""
+        return [], cursor
+
+    def whitelisted(self, legacy_guild_id=None):
+        """Returns the (guild_id, user_id) pairs that are currently whitelisted."""
+        return fold_whitelisted(self.query(), legacy_guild_id)
+
+    # Pending reviews are the members with a review message still waiting for a
+    # decision.  Each entry is a dict with guild_id, user_id, channel_id and
+    # message_id keys.
+    def pending(self):
+        """Returns every pending review."""
+        raise NotImplementedError
+
+    def add_pending(self, entries):
+        """Stores pending reviews."""
+        raise NotImplementedError
+
+    def remove_pending(self, guild_id, user_ids):
+        """Removes the pending reviews of the given users."""
+        raise NotImplementedError
+
+    # The DM outbox holds direct messages queued but not delivered yet, so
+    # they are sent after a restart.  Each entry is a dict with guild_id,
+    # user_id, kind, content, owner (the cluster that queued it) and queued
+    # keys; (guild_id, user_id, kind) identifies it.
+    def outbox(self, owner):
+        """Returns the undelivered DMs queued by owner."""
+        raise NotImplementedError
+
+    def update_outbox(self, added, removed):
+        """Stores new outbox entries and removes delivered ones by key."""
+        raise NotImplementedError
+
+    # Small key/value settings used for bookkeeping such as reconciliation
+    # cursors.  Values must be JSON serializable.
+    def get_meta(self, key, default=None):
+        """Returns a stored setting."""
+        raise NotImplementedError
+
+    def set_meta(self, key, value):
+        """Stores a setting.  A value of None removes it."""
+        raise NotImplementedError
+
+    def meta_items(self, prefix):
+        """Returns (key, value) pairs for every setting whose key starts with prefix."""
+        raise NotImplementedError
+
+
+# JsonStore: The default backend.  Keeps decisions in the append-only JSON
+# journal, which is fine for small deployments.
+class JsonStore(WhitelistStore):
+    def __init__(self, path):
+        self.journal = WhitelistJournal(path)
+        # Pending reviews are few, so they live in a small JSON file that is
+        # rewritten atomically on every change.
+        self.pending_path = os.path.splitext(path)[0] + ".pending.json"
+        self.meta_path = os.path.splitext(path)[0] + ".meta.json"
+        self.outbox_path = os.path.splitext(path)[0] + ".outbox.json"
+        self._pending = {}
+        self._meta = {}
+        self._outbox = {}
+
+    def open(self, read_only=False):
+        if not read_only:
+            self.journal.open()
+        entries = self._read_json(self.pending_path, [])
+        self._pending = {(entry["guild_id"], entry["user_id"]): entry for entry in entries}
+        self._meta = self._read_json(self.meta_path, {})
+        entries = self._read_json(self.outbox_path, [])
+        self._outbox = {(entry["guild_id"], entry["user_id"], entry["kind"]): entry for entry in entries}
+
+    def close(self):
+        self.journal.close()
+
+    def record_many(self, records):
+        self.journal.append_many(records)
+
+    def query(
+        self, guild_id=None, user_id=None, action=None, since=None, until=None, admin_id=None, legacy_guild_id=None
+    ):
+        for record in self.journal.iter_records():
+            record = normalize_record(record)
+            if matches(record, guild_id, user_id, action, since, until, admin_id, legacy_guild_id):
+                yield record
+
+    def pending(self):
+        return list(self._pending.values())
+
+    def add_pending(self, entries):
+        for entry in entries:
+            self._pending[(entry["guild_id"], entry["user_id"])] = entry
+        self._write_pending()
+
+    def remove_pending(self, guild_id, user_ids):
+        removed = [self._pending.pop((guild_id, user_id), None) for user_id in user_ids]
+        if any(removed):
+            self._write_pending()
+
+    def _write_pending(self):
+        self._write_json(self.pending_path, list(self._pending.values()))
+
+    def outbox(self, owner):
+        return [entry for entry in self._outbox.values() if entry["owner"] == owner]
+
+    def update_outbox(self, added, removed):
+        for entry in added:
+            self._outbox.setdefault((entry["guild_id"], entry["user_id"], entry["kind"]), entry)
+        for key in removed:
+            self._outbox.pop(tuple(key), None)
+        self._write_json(self.outbox_path, list(self._outbox.values()))
+
+    def get_meta(self, key, default=None):
+        return self._meta.get(key, default)
+
+    def set_meta(self, key, value):
+        if value is None:
+            self._meta.pop(key, None)
+        else:
+            self._meta[key] = value
+        self._write_json(self.meta_path, self._meta)
+
+    def meta_items(self, prefix):
+        return [(key, value) for key, value in self._meta.items() if key.startswith(prefix)]
+
+    # _read_json: Reads a small JSON file, returning default if it is missing
+    # or corrupted.
+    def _read_json(self, path, default):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+        except json.JSONDecodeError:
+            logging.error("Error decoding JSON from %s.  Ignoring its contents.", path)
+            return default
+
+    # _write_json: Replaces a small JSON file atomically.
+    def _write_json(self, path, data):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+# SqliteStore: Stores decisions in SQLite in WAL mode, indexed on
+# (guild_id, user_id) and on timestamp so lookups and time-range queries do
+# not scan the whole history.
+class SqliteStore(WhitelistStore):
+    COLUMNS = (
+        "guild_id",
+        "user_id",
+        "action",
+        "username",
+        "discriminator",
+        "admin_id",
+        "timestamp",
+    )
+
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self.legacy_path = legacy_path  # JSON log imported into an empty database.
+        self.connection = None
+
+    def open(self, read_only=False):
+        if read_only:
+            self.connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self.connection.row_factory = sqlite3.Row
+            self.connection.execute("PRAGMA busy_timeout=10000")
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # check_same_thread is off so the store can be driven from a worker
+        # thread; callers are responsible for not sharing it concurrently.
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        # Several cluster processes can share one database; wait for their
+        # write locks instead of failing straight away.
+        self.connection.execute("PRAGMA busy_timeout=10000")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS decisions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guild_id INTEGER,
+                user_id INTEGER NOT NULL,
+                action TEXT NOT NULL,
+                username TEXT,
+                discriminator TEXT,
+                admin_id INTEGER,
+                timestamp TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_decisions_guild_user
+                ON decisions (guild_id, user_id);
+            CREATE INDEX IF NOT EXISTS idx_decisions_timestamp
+                ON decisions (timestamp);
+            CREATE TABLE IF NOT EXISTS pending_reviews (
+                guild_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                channel_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                PRIMARY KEY (guild_id, user_id)
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS dm_outbox (
+                guild_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                content TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                queued REAL NOT NULL,
+                PRIMARY KEY (guild_id, user_id, kind)
+            );
+            """
+        )
+        self._import_legacy()
+
+    # _import_legacy: Copies an existing JSON log into a freshly created
+    # database, so switching backends keeps the history.
+    def _import_legacy(self):
+        if not self.legacy_path:
+            return
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM decisions").fetchone()
+        if count:
+            return
+        legacy = JsonStore(self.legacy_path)
+        legacy.open()
+        records = legacy.load()
+        legacy.close()
+        if records:
+            self.record_many(records)
+            logging.info("Imported %d entries from the JSON whitelist log into %s.", len(records), self.path)
+
+    def close(self):
+        if self.connection is None:
+            return
+        self.connection.close()
+        self.connection = None
+
+    def record_many(self, records):
+        rows = [
+            tuple(normalize_record(dict(record)).get(column) for column in self.COLUMNS)
+            for record in records
+        ]
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT INTO decisions ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                rows,
+            )
+
+    def query(
+        self, guild_id=None, user_id=None, action=None, since=None, until=None, admin_id=None, legacy_guild_id=None
+    ):
+        clauses, params = [], []
+        if guild_id is not None and legacy_guild_id in (None, guild_id):
+            clauses.append("(guild_id = ? OR guild_id IS NULL)")
+            params.append(guild_id)
+        elif guild_id is not None:
+            clauses.append("guild_id = ?")
+            params.append(guild_id)
+        if user_id is not None:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if action is not None:
+            clauses.append("action = ?")
+            params.append(action)
+        if admin_id is not None:
+            clauses.append("admin_id = ?")
+            params.append(admin_id)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("timestamp < ?")
+            params.append(until)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM decisions{where} ORDER BY id", params
+        )
+        for row in cursor:
+            yield dict(row)
+
+    def tail(self, cursor=None, limit=10_000):
+        if cursor is None:
+            (last,) = self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM decisions").fetchone()
+            return [], last
+        rows = self.connection.execute(
+            f"SELECT id, {', '.join(self.COLUMNS)} FROM decisions WHERE id > ? ORDER BY id LIMIT ?",
+            (cursor, limit),
+        ).fetchall()
+        if not rows:
+            return [], cursor
+        return [{column: row[column] for column in self.COLUMNS} for row in rows], rows[-1]["id"]
+
+    def pending(self):
+        cursor = self.connection.execute(
+            "SELECT guild_id, user_id, channel_id, message_id FROM pending_reviews"
+        )
+        return [dict(row) for row in cursor]
+
+    def add_pending(self, entries):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO pending_reviews (guild_id, user_id, channel_id, message_id) VALUES (?, ?, ?, ?)",
+                [
+                    (entry["guild_id"], entry["user_id"], entry["channel_id"], entry["message_id"])
+                    for entry in entries
+                ],
+            )
+
+    def remove_pending(self, guild_id, user_ids):
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM pending_reviews WHERE guild_id = ? AND user_id = ?",
+                [(guild_id, user_id) for user_id in user_ids],
+            )
+
+    def outbox(self, owner):
+        cursor = self.connection.execute(
+            "SELECT guild_id, user_id, kind, content, owner, queued FROM dm_outbox WHERE owner = ? ORDER BY queued",
+            (owner,),
+        )
+        return [dict(row) for row in cursor]
+
+    def update_outbox(self, added, removed):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO dm_outbox (guild_id, user_id, kind, content, owner, queued) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (entry["guild_id"], entry["user_id"], entry["kind"], entry["content"], entry["owner"], entry["queued"])
+                    for entry in added
+                ],
+            )
+            self.connection.executemany(
+                "DELETE FROM dm_outbox WHERE guild_id = ? AND user_id = ? AND kind = ?", list(removed)
+            )
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def set_meta(self, key, value):
+        with self.connection:
+            if value is None:
+                self.connection.execute("DELETE FROM meta WHERE key = ?", (key,))
+            else:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    (key, json.dumps(value)),
+                )
+
+    def meta_items(self, prefix):
+        cursor = self.connection.execute(
+            "SELECT key, value FROM meta WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+        )
+        return [(row["key"], json.loads(row["value"])) for row in cursor]
+
+
+# AsyncStore: Runs a store on a dedicated single-thread executor so file and
+# database I/O never blocks the event loop.  Writes are queued and committed by
+# a single writer task, which batches everything queued since the last commit
+# into one record_many call.  Because the executor has one thread, reads and
+# writes never run concurrently against the backend.
+class AsyncStore:
+    def __init__(self, store):
+        self.store = store
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="whitelist-store"
+        )
+        self.queue = asyncio.Queue()
+        self.writer_task = None
+
+    # run: Calls a blocking store method on the store thread.
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def open(self):
+        """Opens the store and starts the writer task."""
+        await self.run(self.store.open)
+        self.writer_task = asyncio.create_task(self._writer())
+
+    # _writer: Drains the queue and commits each batch in one write.  Every
+    # caller's future is resolved once its records are stored.
+    async def _writer(self):
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            records = [record for records, _ in batch for record in records]
+            try:
+                await self.run(self.store.record_many, records)
+            except Exception as e:
+                logging.exception("Error writing %d whitelist records: %s", len(records), e)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(None)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def record(self, record):
+        """Queues one decision and waits until it is stored."""
+        await self.record_many([record])
+
+    async def record_many(self, records):
+        """Queues several decisions and waits until they are stored."""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((list(records), future))
+        await future
+
+    async def flush(self):
+        """Waits for every queued write to be committed."""
+        await self.queue.join()
+
+    async def load(self):
+        """Loads every decision into a list."""
+        return await self.run(self.store.load)
+
+    async def whitelisted(self, legacy_guild_id=None):
+        """Returns the (guild_id, user_id) pairs that are currently whitelisted."""
+        return await self.run(self.store.whitelisted, legacy_guild_id)
+
+    async def query(self, **filters):
+        """Returns matching decisions as a list."""
+        return await self.run(lambda: list(self.store.query(**filters)))
+
+    # stream: Pulls matching decisions from the store thread a batch at a
+    # time, so only one batch is ever in memory however long the history is.
+    async def stream(self, batch_size=500, **filters):
+        """Yields matching decisions, oldest first."""
+        records = await self.run(lambda: iter(self.store.query(**filters)))
+        try:
+            while True:
+                batch = await self.run(lambda: list(itertools.islice(records, batch_size)))
+                if not batch:
+                    return
+                for record in batch:
+                    yield record
+        finally:
+            await self.run(records.close)
+
+    async def tail(self, cursor=None):
+        """Returns decisions stored after cursor and the cursor for the next call."""
+        return await self.run(self.store.tail, cursor)
+
+    async def pending(self):
+        """Returns every pending review."""
+        return await self.run(self.store.pending)
+
+    async def add_pending(self, entries):
+        """Stores pending reviews."""
+        await self.run(self.store.add_pending, entries)
+
+    async def remove_pending(self, guild_id, user_ids):
+        """Removes the pending reviews of the given users."""
+        await self.run(self.store.remove_pending, guild_id, user_ids)
+
+    async def outbox(self, owner):
+        """Returns the undelivered DMs queued by owner."""
+        return await self.run(self.store.outbox, owner)
+
+    async def update_outbox(self, added, removed):
+        """Stores new outbox entries and removes delivered ones by key."""
+        await self.run(self.store.update_outbox, added, removed)
+
+    async def get_meta(self, key, default=None):
+        """Returns a stored setting."""
+        return await self.run(self.store.get_meta, key, default)
+
+    async def set_meta(self, key, value):
+        """Stores a setting.  A value of None removes it."""
+        await self.run(self.store.set_meta, key, value)
+
+    async def meta_items(self, prefix):
+        """Returns (key, value) pairs for every setting whose key starts with prefix."""
+        return await self.run(self.store.meta_items, prefix)
+
+    async def close(self):
+        """Commits pending writes, stops the writer and closes the store."""
+        if self.writer_task is not None:
+            await self.flush()
+            self.writer_task.cancel()
+            self.writer_task = None
+        await self.run(self.store.close)
+        self.executor.shutdown(wait=True)
+
+
+# create_store: Builds the backend selected by name ("json" or "sqlite").
+def create_store(backend, json_path, sqlite_path):
+    if backend == "sqlite":
+        return SqliteStore(sqlite_path, legacy_path=json_path)
+    if backend != "json":
+        logging.warning("Unknown whitelist storage backend '%s', using json.", backend)
+    return JsonStore(json_path)
@@ -0,0 +1,441 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+import discord
+from source.functions.scheduler import PRIORITY_ADMIN, PRIORITY_NAMES
+
+
+# RemoteActionError: A worker failed to run an action for a reason other than
+# an HTTP error from Discord (e.g. a dropped connection after every retry).
+class RemoteActionError(Exception):
+    pass
+
+
+# encode_action: Describes a scheduled call as JSON a worker can replay.
+# Accepts the calls the whitelist makes: member.add_roles(role),
+# member.remove_roles(role), member.ban(), guild.ban(user) and user.send(text).
+def encode_action(func, args, kwargs):
+    target, name = getattr(func, "__self__", None), getattr(func, "__name__", None)
+    reason = kwargs.get("reason")
+    if name in ("add_roles", "remove_roles") and len(args) == 1:
+        return {
+            "op": name[:-1],
+            "guild_id": target.guild.id,
+            "user_id": target.id,
+            "role_id": args[0].id,
+            "reason": reason,
+        }
+    if name == "ban":
+        guild, user = (target.guild, target) if hasattr(target, "guild") else (target, args[0])
+        return {
+            "op": "ban",
+            "guild_id": guild.id,
+            "user_id": user.id,
+            "delete_message_seconds": kwargs.get("delete_message_seconds", 86400),
+            "reason": reason,
+        }
+    if name == "send" and len(args) == 1 and not kwargs:
+        return {"op": "dm", "user_id": target.id, "content": args[0]}
+    raise TypeError(f"{name} can't be run by a worker process")
+
+
+# perform: Runs an encoded action with a REST-only HTTP client.
+async def perform(http, action):
+    if action["op"] == "add_role":
+        await http.add_role(action["guild_id"], action["user_id"], action["role_id"], reason=action["reason"])
+    elif action["op"] == "remove_role":
+        await http.remove_role(action["guild_id"], action["user_id"], action["role_id"], reason=action["reason"])
+    elif action["op"] == "ban":
+        await http.ban(action["user_id"], action["guild_id"], action["delete_message_seconds"], reason=action["reason"])
+    elif action["op"] == "dm":
+        channel = await http.start_private_message(action["user_id"])
+        await http.send_message(
+            channel["id"], params=discord.http.handle_message_parameters(content=action["content"])
+        )
+    else:
+        raise ValueError(f"Unknown action {action['op']!r}")
+
+
+# encode_error / decode_error: Carry a failure from the worker back to the
+# caller, rebuilt as the same discord.py exception class so callers can keep
+# catching Forbidden, NotFound and HTTPException.
+def encode_error(error):
+    if isinstance(error, discord.HTTPException):
+        return {"type": type(error).__name__, "status": error.status, "code": error.code, "text": error.text}
+    return {"type": None, "text": f"{type(error).__name__}: {error}"}
+
+
+def decode_error(error):
+    if error["type"] is None:
+        return RemoteActionError(error["text"])
+    cls = getattr(discord, error["type"], discord.HTTPException)
+    if not (isinstance(cls, type) and issubclass(cls, discord.HTTPException)):
+        cls = discord.HTTPException
+    response = types.SimpleNamespace(status=error["status"], reason=error["type"])
+    return cls(response, {"code": error["code"], "message": error["text"]})
+
+
+# WorkQueue: A SQLite table of actions shared by the gateway process, which
+# adds them, and the worker processes, which claim and run them.  Each row
+# is queued, then running (claimed by a worker), then done or failed until
+# the process that added it collects the result.  WAL mode lets every
+# process read while one writes.
+class WorkQueue:
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+
+    def open(self):
+        """Opens the queue, creating it if needed."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA busy_timeout=10000")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                owner TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                route TEXT NOT NULL,
+                action TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'queued',
+                created REAL NOT NULL,
+                worker TEXT,
+                claimed_at REAL,
+                error TEXT,
+                waited REAL,
+                ran REAL,
+                retries INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (state, priority, id);
+            CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (owner, state);
+            """
+        )
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    # put_many: Adds (priority, route, action) jobs and returns their IDs.
+    def put_many(self, owner, jobs):
+        """Queues actions and returns their job IDs."""
+        ids = []
+        with self.connection:
+            for priority, route, action in jobs:
+                cursor = self.connection.execute(
+                    "INSERT INTO jobs (owner, priority, route, action, created) VALUES (?, ?, ?, ?, ?)",
+                    (owner, priority, route, json.dumps(action), time.time()),
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+
+    # promote: Raises queued jobs to a higher priority, given as (id,
+    # priority) pairs.  Jobs a worker already claimed are left alone.
+    def promote(self, jobs):
+        """Moves queued jobs up to a higher priority."""
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE jobs SET priority = min(priority, ?) WHERE id = ? AND state = 'queued'",
+                [(priority, job_id) for job_id, priority in jobs],
+            )
+
+    # claim: Marks up to `limit` queued jobs as running for a worker and
+    # returns them, highest priority first.  Jobs claimed by a worker that
+    # stopped responding `stale_after` seconds ago are claimed again.
+    def claim(self, worker, limit, max_priority=None, stale_after=300.0):
+        """Claims jobs for a worker."""
+        if limit <= 0:
+            return []
+        now = time.time()
+        priority_clause = "" if max_priority is None else " AND priority <= ?"
+        params = [now - stale_after] + ([] if max_priority is None else [max_priority]) + [limit]
+        with self.connection:
+            rows = self.connection.execute(
+                f"""
+                UPDATE jobs SET state = 'running', worker = ?, claimed_at = ?
+                WHERE id IN (
+                    SELECT id FROM jobs
+                    WHERE (state = 'queued' OR (state = 'running' AND claimed_at < ?)){priority_clause}
+                    ORDER BY priority, id LIMIT ?
+                )
+                RETURNING id, priority, route, action, created
+                """,
+                [worker, now] + params,
+            ).fetchall()
+        jobs = [
+            {**dict(row), "action": json.loads(row["action"]), "waited": max(0.0, now - row["created"])}
+            for row in rows
+        ]
+        return sorted(jobs, key=lambda job: (job["priority"], job["id"]))
+
+    # finish: Records the outcome of jobs as (id, error or None, waited, ran,
+    # retries) tuples.
+    def finish(self, results):
+        """Marks jobs as done or failed."""
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE jobs SET state = ?, error = ?, waited = ?, ran = ?, retries = ? WHERE id = ?",
+                [
+                    ("failed" if error else "done", json.dumps(error) if error else None, waited, ran, retries, job_id)
+                    for job_id, error, waited, ran, retries in results
+                ],
+            )
+
+    # collect: Returns and deletes the finished jobs an owner added.
+    def collect(self, owner):
+        """Returns the results of an owner's finished jobs."""
+        with self.connection:
+            rows = self.connection.execute(
+                """
+                DELETE FROM jobs WHERE owner = ? AND state IN ('done', 'failed')
+                RETURNING id, priority, error, waited, ran, retries
+                """,
+                (owner,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+# RemoteScheduler: Stands in for ActionScheduler when the bot runs in split
+# mode.  Calls are encoded and written to the work queue instead of being
+# run here, so the gateway's event loop only pays for a batched SQLite write
+# per tick while worker processes (worker.py) make the REST calls, wait out
+# rate limits and retry.  Has the same interface as ActionScheduler:
+# duplicate keys share one job (moved up to the higher priority when a
+# duplicate has one), run() raises the worker's error, and stats() reports
+# the same figures.
+class RemoteScheduler:
+    def __init__(self, queue, owner="0", poll_interval=0.05):
+        self.queue = queue  # A WorkQueue.
+        self.owner = owner  # Lets each gateway process collect only its own results.
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="work-queue")
+        self.outbox = []  # (priority, route, action, future) not written yet.
+        self.futures = {}  # job ID -> (priority, future)
+        self.jobs = {}  # key -> future of the queued or running job
+        self.job_ids = {}  # future -> job ID, once written
+        self.promotions = {}  # job ID -> higher priority not written yet
+        self.task = None
+        self.wakeup = asyncio.Event()
+        self.completed = {priority: 0 for priority in PRIORITY_NAMES}
+        self.failed = {priority: 0 for priority in PRIORITY_NAMES}
+        self.retried = 0
+        self.deduplicated = 0
+        self.wait_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.wait_max = {priority: 0.0 for priority in PRIORITY_NAMES}
+        self.run_total = {priority: 0.0 for priority in PRIORITY_NAMES}
+
+    def start(self):
+        """Starts writing jobs and collecting results."""
+        self.task = asyncio.create_task(self._pump())
+
+    async def stop(self):
+        """Stops collecting results and cancels the callers still waiting."""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        for *_, future in self.outbox:
+            future.cancel()
+        for _, future in self.futures.values():
+            future.cancel()
+        self.outbox.clear()
+        self.futures.clear()
+        self.jobs.clear()
+        self.job_ids.clear()
+        self.promotions.clear()
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.queue.close)
+        self.executor.shutdown(wait=True)
+
+    # drain: Waits until every job added by this process has a result.
+    async def drain(self):
+        """Waits for the queue to empty."""
+        while self.outbox or self.futures:
+            await asyncio.sleep(self.poll_interval)
+
+    def submit(self, priority, route, key, func, *args, **kwargs):
+        """Queues func(*args, **kwargs) for a worker and returns a future for its result."""
+        if key is not None and key in self.jobs:
+            self.deduplicated += 1
+            self._promote(self.jobs[key], priority)
+            return self.jobs[key]
+        action = encode_action(func, args, kwargs)
+        future = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self.jobs[key] = future
+            future.add_done_callback(lambda _: self.jobs.pop(key, None))
+        self.outbox.append((priority, route, action, future))
+        self.wakeup.set()
+        return future
+
+    async def run(self, priority, route, key, func, *args, **kwargs):
+        """Queues func(*args, **kwargs) for a worker and waits for its result."""
+        return await asyncio.shield(self.submit(priority, route, key, func, *args, **kwargs))
+
+    # _promote: Moves a job up to a duplicate's higher priority, as
+    # ActionScheduler does.  A job not written yet is changed in the outbox;
+    # a written one is updated in the queue on the next tick, unless a
+    # worker has claimed it by then.
+    def _promote(self, future, priority):
+        for i, (queued, route, action, pending) in enumerate(self.outbox):
+            if pending is future:
+                if priority < queued:
+                    self.outbox[i] = (priority, route, action, pending)
+                return
+        job_id = self.job_ids.get(future)
+        if job_id is not None and priority < self.futures[job_id][0]:
+            self.futures[job_id] = (priority, future)
+            self.promotions[job_id] = priority
+            self.wakeup.set()
+
+    # _exchange: One round trip on the queue thread: writes new jobs and
+    # priority changes, and collects finished jobs.
+    def _exchange(self, jobs, promotions):
+        if promotions:
+            self.queue.promote(promotions)
+        return self.queue.put_many(self.owner, jobs), self.queue.collect(self.owner)
+
+    # _pump: Writes everything submitted since the last tick in one
+    # transaction and resolves the futures of finished jobs.
+    async def _pump(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.queue.open)
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            outbox, self.outbox = self.outbox, []
+            promotions, self.promotions = self.promotions, {}
+            try:
+                ids, results = await loop.run_in_executor(
+                    self.executor,
+                    self._exchange,
+                    [(priority, route, action) for priority, route, action, _ in outbox],
+                    list(promotions.items()),
+                )
+            except Exception as e:
+                logging.exception("Error exchanging jobs with the work queue: %s", e)
+                self.outbox = outbox + self.outbox
+                for job_id, priority in promotions.items():
+                    self.promotions[job_id] = min(priority, self.promotions.get(job_id, priority))
+                await asyncio.sleep(1)
+                continue
+            for (priority, _, _, future), job_id in zip(outbox, ids):
+                self.futures[job_id] = (priority, future)
+                self.job_ids[future] = job_id
+            for result in results:
+                self._resolve(result)
+
+    def _resolve(self, result):
+        entry = self.futures.pop(result["id"], None)
+        if entry is None:
+            return  # Added by an earlier run of this process.
+        priority, future = entry
+        self.job_ids.pop(future, None)
+        waited, ran = result["waited"] or 0.0, result["ran"] or 0.0
+        self.retried += result["retries"] or 0
+        self.wait_total[priority] += waited
+        self.wait_max[priority] = max(self.wait_max[priority], waited)
+        self.run_total[priority] += ran
+        if result["error"]:
+            self.failed[priority] += 1
+            if not future.done():
+                future.set_exception(decode_error(json.loads(result["error"])))
+        else:
+            self.completed[priority] += 1
+            if not future.done():
+                future.set_result(None)
+
+    def stats(self):
+        """Returns scheduler metrics."""
+        backlog = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, *_ in self.outbox:
+            backlog[PRIORITY_NAMES[priority]] += 1
+        for priority, _ in self.futures.values():
+            backlog[PRIORITY_NAMES[priority]] += 1
+        stats = {"backlog": backlog, "retried": self.retried, "deduplicated": self.deduplicated}
+        for priority, name in PRIORITY_NAMES.items():
+            done = self.completed[priority] + self.failed[priority]
+            stats[name] = {
+                "completed": self.completed[priority],
+                "failed": self.failed[priority],
+                "avg_wait": self.wait_total[priority] / done if done else 0.0,
+                "max_wait": self.wait_max[priority],
+                "avg_run": self.run_total[priority] / done if done else 0.0,
+            }
+        return stats
+
+
+# run_worker: The loop of a worker process.  Claims jobs, runs them through a
+# local ActionScheduler (priorities, rate limits, retries) and records the
+# results.  Admin jobs are always claimed; other jobs only while fewer than
+# `capacity` are in flight, so a backlog of DMs waiting on their rate limit
+# never keeps an admin click from being picked up.  Once `stopping` is set,
+# no more jobs are claimed and the ones in flight are finished.
+async def run_worker(http, queue, scheduler, name, stopping, capacity=20, poll_interval=0.05):
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="work-queue")
+    await loop.run_in_executor(executor, queue.open)
+    running = set()
+    results = []
+
+    # execute: Runs one job.  Its wait is the time it sat in the work
+    # queue; its run time includes waiting on this worker's rate limits.
+    async def execute(job):
+        claimed = time.monotonic()
+        attempts = 0
+
+        async def call():
+            nonlocal attempts
+            attempts += 1
+            await perform(http, job["action"])
+
+        try:
+            await scheduler.run(job["priority"], job["route"], None, call)
+        except Exception as e:
+            error = encode_error(e)
+        else:
+            error = None
+        results.append((job["id"], error, job["waited"], time.monotonic() - claimed, max(0, attempts - 1)))
+
+    try:
+        while not stopping.is_set():
+            finished, results[:] = list(results), []
+            jobs = await loop.run_in_executor(executor, _worker_tick, queue, name, capacity - len(running), finished)
+            for job in jobs:
+                task = asyncio.create_task(execute(job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+            if not jobs:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(stopping.wait(), poll_interval)
+        await asyncio.gather(*running)
+        if results:
+            await loop.run_in_executor(executor, queue.finish, results)
+    finally:
+        for task in running:
+            task.cancel()
+        await loop.run_in_executor(executor, queue.close)
+        executor.shutdown(wait=True)
+
+
+# _worker_tick: One round trip on the queue thread for a worker: records
+# finished jobs and claims new ones.
+def _worker_tick(queue, name, room, finished):
+    if finished:
+        queue.finish(finished)
+    jobs = queue.claim(name, 1000, max_priority=PRIORITY_ADMIN)
+    return jobs + queue.claim(name, room - len(jobs))
@@ -1,93 +1,824 @@
 import discord
-import json
 import logging
 from discord.ext import commands
 from discord import app_commands
-from discord.ui import View, Button
+from discord.ui import View, Button, Select
+import asyncio
+import contextlib
 import datetime
+import io
+import os
+import time
+from source.functions.audit import ACTIONS, describe, export_chunks, parse_time
+from source.functions.federation import FederationIndex
+from source.functions.guild_config import GuildConfigService
+from source.functions.handoff import StateHandoff
+from source.functions.log import log_fields
+from source.functions.metrics import REGISTRY, MetricsServer
+from source.functions.notifications import DmQueue
+from source.functions.raid import JoinRateTracker, Lockdown
+from source.functions.risk import RiskScorer
+from source.functions.scheduler import (
+    PRIORITY_ADMIN,
+    PRIORITY_AUTO,
+    ActionScheduler,
+)
+from source.functions.storage import (
+    ACCEPT_ACTIONS,
+    DENY_ACTIONS,
+    AsyncStore,
+    create_store,
+)
+from source.functions.workqueue import RemoteScheduler, WorkQueue
 
-# Configure logging:  Sets up basic logging to the console.  You can adjust the
-# level (e.g., logging.DEBUG, logging.WARNING) to control the verbosity of the
-# logs.  The format string specifies how log messages are structured.
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+# Metrics:  Counters and timings for the join and decision paths.  They are
+# served in the Prometheus text format when METRICS_PORT is set in .env.
+JOIN_STAGE_SECONDS = REGISTRY.histogram(
+    "whitelist_join_stage_seconds", "Time spent in each stage of on_member_join.", ("stage",)
+)
+JOIN_TO_REVIEW_SECONDS = REGISTRY.histogram(
+    "whitelist_join_to_review_seconds", "Time from a member joining to their review being posted."
+)
+JOINS_TOTAL = REGISTRY.counter(
+    "whitelist_joins_total", "Member joins by how they were handled.", ("outcome",)
+)
+ACTION_STAGE_SECONDS = REGISTRY.histogram(
+    "whitelist_action_stage_seconds",
+    "Time spent in each stage of accept_user and deny_user.",
+    ("action", "stage"),
+)
+DECISIONS_TOTAL = REGISTRY.counter(
+    "whitelist_decisions_total", "Logged whitelist decisions.", ("action",)
+)
+FOLLOWUP_FAILURES_TOTAL = REGISTRY.counter(
+    "whitelist_followup_failures_total",
+    "Followups and message edits that failed because the webhook or message was gone.",
+    ("reason",),
+)
+RISK_SCORES = REGISTRY.histogram(
+    "whitelist_join_risk_score",
+    "Risk scores of joins sent for triage.",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+)
+LOCKDOWNS_TOTAL = REGISTRY.counter("whitelist_lockdowns_total", "Raid lockdowns started.")
+GUILDS_IN_LOCKDOWN = REGISTRY.gauge("whitelist_guilds_in_lockdown", "Guilds currently in raid lockdown.")
+PENDING_REVIEWS = REGISTRY.gauge("whitelist_pending_reviews", "Reviews waiting for a decision.")
+INDEX_SIZE = REGISTRY.gauge("whitelist_index_size", "Whitelisted users held in the in-memory index.")
+FEDERATED_IDS = REGISTRY.gauge("whitelist_federated_ids", "User IDs held across all trust lists.")
+DM_QUEUE = REGISTRY.gauge("whitelist_dm_queue", "DMs queued and not delivered yet.")
+SCHEDULER_BACKLOG = REGISTRY.gauge(
+    "whitelist_scheduler_backlog", "Actions queued in the action scheduler.", ("priority",)
+)
+GATEWAY_LATENCY = REGISTRY.gauge(
+    "discord_gateway_latency_seconds", "Heartbeat latency of each gateway shard.", ("shard",)
 )
 
 
 # ReviewButton Class: Represents a button in the review process (Accept or Deny).
-class ReviewButton(Button):
-    # __init__:  Initializes the button with a label, style, custom ID, and the
-    # member it's associated with.
-    def __init__(self, label, style, custom_id, member, silent=False):
-        super().__init__(label=label, style=style, custom_id=custom_id)
-        self.member = member  # The Discord member this button is for.
-        self.silent = silent
+# The action and member ID are encoded in the custom ID (e.g. wl:accept:<id>),
+# so the button keeps working after a restart without re-posting the review.
+class ReviewButton(
+    discord.ui.DynamicItem[Button],
+    template=r"wl:(?P<action>accept|deny|deny_silent):(?P<user_id>[0-9]+)",
+):
+    # Label and style for each action.
+    STYLES = {
+        "accept": ("Accept", discord.ButtonStyle.green),
+        "deny": ("Deny", discord.ButtonStyle.red),  # Regular Deny (with DM)
+        "deny_silent": ("Silent Deny", discord.ButtonStyle.grey),  # Silent Deny (no DM)
+    }
+
+    # __init__:  Initializes the button for an action and the ID of the member
+    # it's associated with.
+    def __init__(self, action, user_id):
+        label, style = self.STYLES[action]
+        super().__init__(
+            Button(label=label, style=style, custom_id=f"wl:{action}:{user_id}")
+        )
+        self.action = action
+        self.user_id = user_id  # The ID of the Discord member this button is for.
+
+    # from_custom_id: Rebuilds the button from the custom ID of a clicked
+    # component.  Called by discord.py for any message, including ones sent
+    # before the last restart.
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(match["action"], int(match["user_id"]))
 
     # callback:  This is the function that's called when the button is pressed.
-    # It checks the custom ID to determine whether to accept or deny the user.
+    # It checks the action to determine whether to accept or deny the user.
     async def callback(self, interaction: discord.Interaction):
         # Defer the interaction immediately
         await interaction.response.defer(ephemeral=True)
+        cog = interaction.client.get_cog("Whitelist")
         try:
-            # If the button is the "accept" button, call the accept_user method
-            # from the Whitelist cog.
-            if self.custom_id == "accept":
-                await self.view.cog.accept_user(interaction, self.member, self.view)
-            # If the button is the "deny" button, call the deny_user method from
-            # the Whitelist cog.
-            elif self.custom_id == "deny":
-                await self.view.cog.deny_user(interaction, self.member, self.view)
-            # If the button is the "deny_silent" button, call the deny_user method
-            # with the silent flag set to True.
-            elif self.custom_id == "deny_silent":
-                await self.view.cog.deny_user(interaction, self.member, self.view, silent=True)
+            member = await cog.resolve_member(interaction.guild, self.user_id)
+            if member is None and self.action == "accept":
+                await interaction.followup.send(
+                    f"<@{self.user_id}> is no longer in the server.", ephemeral=True
+                )
+                await cog.forget_reviews(interaction.guild.id, [self.user_id])
+                return
+            # Members who already left can still be denied; the ban works on
+            # any user.
+            member = member or discord.Object(self.user_id)
+            async with cog.claim_reviews(interaction.guild.id, [self.user_id]) as claimed:
+                if not claimed:
+                    await interaction.followup.send(
+                        f"<@{self.user_id}> is already being handled.", ephemeral=True
+                    )
+                    return
+                # If the button is the "accept" button, call the accept_user
+                # method from the Whitelist cog.
+                if self.action == "accept":
+                    await cog.accept_user(interaction, member, self.view)
+                # If the button is the "deny" button, call the deny_user method
+                # from the Whitelist cog.
+                elif self.action == "deny":
+                    await cog.deny_user(interaction, member, self.view)
+                # If the button is the "deny_silent" button, call the deny_user
+                # method with the silent flag set to True.
+                elif self.action == "deny_silent":
+                    await cog.deny_user(interaction, member, self.view, silent=True)
         except discord.errors.NotFound:
+            FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
             logging.exception(
                 "Webhook expired during button callback.  Unable to send followup."
             )
         except Exception as e:
-            logging.exception(f"An unexpected error occurred: {e}")
-
-
-# ReviewView Class: Represents the view containing the Accept and Deny buttons.
-class ReviewView(View):
-    # __init__: Initializes the view with the whitelist role ID, the member being
-    # reviewed, and a reference to the Whitelist cog.
-    def __init__(self, whitelist_role_id, member, cog):
-        super().__init__()
-        self.whitelist_role_id = whitelist_role_id  # The ID of the whitelist role.
-        self.member = member  # The Discord member being reviewed.
-        self.cog = cog  # Reference to the Whitelist cog, allowing access to its methods.
-        # Add the Accept and Deny buttons to the view.
-        self.add_item(
-            ReviewButton("Accept", discord.ButtonStyle.green, "accept", member)
-        )
-        self.add_item(
-            ReviewButton(
-                "Deny", discord.ButtonStyle.red, "deny", member)
-        ) # Regular Deny (with DM)
-        self.add_item(
-            ReviewButton(
-                "Silent Deny", discord.ButtonStyle.grey, "deny_silent", member, silent=True
+            logging.exception("An unexpected error occurred: %s", e)
+
+
+# DigestSelect Class: A select menu on a review digest.  Picking members
+# applies the menu's action (accept, deny or silent deny) to each of them.
+class DigestSelect(Select):
+    def __init__(self, action, placeholder, entries):
+        super().__init__(
+            custom_id=f"wl:digest:{action}",
+            placeholder=placeholder,
+            min_values=1,
+            max_values=max(1, len(entries)),
+            options=[
+                discord.SelectOption(label=name[:100], value=str(user_id), description=f"ID {user_id}")
+                for user_id, name in entries
+            ],
+        )
+        self.action = action
+
+    async def callback(self, interaction: discord.Interaction):
+        # Read the values before awaiting anything: the registered instance is
+        # shared by every digest, so the next click overwrites them.
+        member_ids = [int(value) for value in self.values]
+        await interaction.response.defer(ephemeral=True)
+        try:
+            await self.view.apply(interaction, self.action, member_ids)
+        except discord.errors.NotFound:
+            FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
+            logging.exception(
+                "Webhook expired during digest callback.  Unable to send followup."
             )
-        )  # Silent Deny (no DM)
+        except Exception as e:
+            logging.exception("An unexpected error occurred: %s", e)
+
+
+# DigestButton Class: A bulk action button on a review digest that applies its
+# action to every member still pending in the digest.
+class DigestButton(Button):
+    def __init__(self, action, label, style):
+        super().__init__(label=label, style=style, custom_id=f"wl:digest_all:{action}")
+        self.action = action
+
+    async def callback(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        try:
+            cog = self.view.cog
+            member_ids = [
+                entry["user_id"]
+                for entry in cog.pending_reviews.values()
+                if entry["message_id"] == interaction.message.id
+            ]
+            await self.view.apply(interaction, self.action, member_ids)
+        except discord.errors.NotFound:
+            FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
+            logging.exception(
+                "Webhook expired during digest callback.  Unable to send followup."
+            )
+        except Exception as e:
+            logging.exception("An unexpected error occurred: %s", e)
+
+
+# EmbedPayload / ComponentsPayload: Prebuilt message parts passed to
+# channel.send() and message.edit() in place of a discord.Embed or View.
+# This relies on how discord.py 2.4 (pinned in requirements.txt) handles
+# them: send() only accepts objects with a __discord_ui_view__ attribute as
+# views, handle_message_parameters() only calls to_dict() on embeds and
+# to_components() on views, and send()/edit() only call is_finished() to
+# decide whether to store the view.  check_payload_support() verifies this
+# when the module is imported, so an upgrade that changes it fails at
+# startup instead of on the first review.
+class EmbedPayload:
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def to_dict(self):
+        return self.data
+
+
+class ComponentsPayload:
+    __slots__ = ("rows",)
+    __discord_ui_view__ = True
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def to_components(self):
+        return self.rows
+
+    # Clicks are routed by custom ID, so there is no view to keep.
+    def is_finished(self):
+        return True
+
+
+# check_payload_support: Builds a request from the payload classes the way
+# channel.send() does and checks it carries them unchanged.
+def check_payload_support():
+    embed = {"type": "rich", "title": "check"}
+    rows = [{"type": 1, "components": [{"type": 2, "style": 1, "label": "check", "custom_id": "check"}]}]
+    try:
+        params = discord.http.handle_message_parameters(embed=EmbedPayload(embed), view=ComponentsPayload(rows))
+        supported = params.payload.get("embeds") == [embed] and params.payload.get("components") == rows
+    except Exception:
+        supported = False
+    if not supported:
+        raise RuntimeError(
+            f"discord.py {discord.__version__} doesn't accept prebuilt review payloads; "
+            "ReviewRenderer was written against discord.py 2.4.0 (see requirements.txt)."
+        )
+
+
+check_payload_support()
+
+
+# ReviewRenderer: Builds review messages from templates prepared once.  The
+# button and select menu payloads are taken from a ReviewButton row and a
+# DigestView when the cog loads, so a review only fills in the member's
+# mention, name, ID, avatar and join time instead of constructing an Embed,
+# a View and its items for every join.  Join times are Discord timestamps,
+# which are cheaper than strftime and shown in each admin's own timezone.
+class ReviewRenderer:
+    def __init__(self):
+        row = View(timeout=None)
+        for action in ReviewButton.STYLES:
+            row.add_item(ReviewButton(action, 0))
+        row.stop()
+        # (custom ID prefix, button payload) for each review button.
+        self.review_buttons = [
+            (button["custom_id"][:-1], button) for button in row.to_components()[0]["components"]
+        ]
+        digest = DigestView(None)
+        digest.stop()
+        *selects, buttons = digest.to_components()
+        self.digest_selects = [select["components"][0] for select in selects]
+        self.digest_buttons = buttons  # The same for every digest.
+
+    @staticmethod
+    def joined(member):
+        return f"<t:{int(member.joined_at.timestamp())}:f>" if member.joined_at else "Unknown"
+
+    # review: The embed and buttons for a single member.
+    def review(self, member):
+        user_id = str(member.id)
+        embed = {
+            "type": "rich",
+            "title": "New Member Joined",
+            "description": f"<@{user_id}> has joined the server",
+            "thumbnail": {"url": str(member.display_avatar)},
+            "fields": [
+                {"name": "Username", "value": member.name, "inline": False},
+                {"name": "ID", "value": user_id, "inline": False},
+                {"name": "Joined At", "value": self.joined(member), "inline": False},
+            ],
+        }
+        buttons = [{**button, "custom_id": prefix + user_id} for prefix, button in self.review_buttons]
+        return EmbedPayload(embed), ComponentsPayload([{"type": 1, "components": buttons}])
+
+    # digest: The embed and menus for up to DigestView.PAGE_SIZE members.
+    # The three menus list the same members, so they share one options list.
+    def digest(self, members):
+        embed = {
+            "type": "rich",
+            "title": "New Members Joined",
+            "description": "\n".join(
+                f"<@{member.id}> - {member.name} ({member.id}) - joined {self.joined(member)}" for member in members
+            ),
+            "footer": {"text": f"{len(members)} pending"},
+        }
+        return EmbedPayload(embed), self.digest_components([(member.id, member.name) for member in members])
+
+    # digest_components: The menus and buttons of a digest listing the given
+    # (user_id, name) pairs.  Also used to redraw a digest after a decision,
+    # so no live view bound to the cog is ever attached to a message.
+    def digest_components(self, entries):
+        options = [
+            {"label": name[:100], "value": str(user_id), "default": False, "description": f"ID {user_id}"}
+            for user_id, name in entries
+        ]
+        rows = [
+            {"type": 1, "components": [{**select, "max_values": max(1, len(options)), "options": options}]}
+            for select in self.digest_selects
+        ]
+        rows.append(self.digest_buttons)
+        return ComponentsPayload(rows)
+
+
+# HistoryView Class: Pages through the results of /whitelist history.  The
+# records come from a stream over the store and are read one page at a time,
+# so the view holds a single page however long the history is.
+class HistoryView(View):
+    PAGE_SIZE = 10
+
+    def __init__(self, records, title):
+        super().__init__(timeout=300)
+        self.records = records  # Async iterator from AsyncStore.stream.
+        self.title = title
+        self.page = 0
+        self.lookahead = None  # First record of the next page, if any.
+
+    # next_page: Reads the next page from the stream and renders it.
+    async def next_page(self):
+        page = [self.lookahead] if self.lookahead else []
+        self.lookahead = None
+        async for record in self.records:
+            if len(page) == self.PAGE_SIZE:
+                self.lookahead = record
+                break
+            page.append(record)
+        self.page += 1
+        self.next_button.disabled = self.lookahead is None
+        embed = discord.Embed(
+            title=self.title,
+            description="\n".join(describe(record) for record in page) or "No matching decisions.",
+        )
+        embed.set_footer(text=f"Page {self.page}")
+        return embed
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.grey)
+    async def next_button(self, interaction: discord.Interaction, button: Button):
+        await interaction.response.edit_message(embed=await self.next_page(), view=self)
+        if self.lookahead is None:
+            await self.close()
+
+    # close: Stops the view and releases the store cursor.
+    async def close(self):
+        self.stop()
+        await self.records.aclose()
+
+    async def on_timeout(self):
+        await self.records.aclose()
+
+
+# DigestView Class: Reviews up to 25 members in a single message.  Used when
+# several members join within the review window, so a raid produces one
+# message per page instead of one message per member.  The custom IDs are
+# fixed and everything else is read from the clicked message and the pending
+# reviews, so one stateless instance registered with bot.add_view serves
+# every digest, including ones posted before a restart.
+class DigestView(View):
+    PAGE_SIZE = 25  # Discord allows at most 25 options in a select menu.
+
+    # __init__: entries is a list of (user_id, name) pairs for the members in
+    # the digest.  The registered stateless instance has none.
+    def __init__(self, cog, entries=()):
+        super().__init__(timeout=None)
+        self.cog = cog
+        entries = list(entries)
+        self.add_item(DigestSelect("accept", "Accept members...", entries))
+        self.add_item(DigestSelect("deny", "Deny members...", entries))
+        self.add_item(DigestSelect("deny_silent", "Silently deny members...", entries))
+        self.add_item(DigestButton("accept", "Accept All", discord.ButtonStyle.green))
+        self.add_item(DigestButton("deny", "Deny All", discord.ButtonStyle.red))
+        self.add_item(DigestButton("deny_silent", "Silent Deny All", discord.ButtonStyle.grey))
+
+    # apply: Runs an action for the given member IDs through the cog's
+    # accept_user/deny_user helpers, then updates the digest message.  Members
+    # are claimed before the action runs, so two admins clicking at once never
+    # process the same member twice.
+    async def apply(self, interaction, action, member_ids):
+        guild = interaction.guild
+        async with self.cog.claim_reviews(guild.id, member_ids) as claimed:
+            for member_id in claimed:
+                if action != "accept":
+                    # deny_user bans members who already left as well.
+                    await self.cog.deny_user(
+                        interaction, discord.Object(member_id), None, silent=action == "deny_silent"
+                    )
+                    continue
+                member = await self.cog.resolve_member(guild, member_id)
+                if member is None:
+                    await self.cog.forget_reviews(guild.id, [member_id])
+                else:
+                    await self.cog.accept_user(interaction, member, None)
+        await self.refresh(interaction.message)
+
+    # refresh: Rewrites a digest message so it only lists the members that are
+    # still pending.  Works from the message itself, without refetching
+    # members.
+    async def refresh(self, message):
+        remaining = {
+            entry["user_id"]
+            for entry in self.cog.pending_reviews.values()
+            if entry["message_id"] == message.id
+        }
+        embed = message.embeds[0]
+        if not remaining:
+            embed.title = "Members Reviewed"
+            embed.description = "Every member in this digest has been handled."
+            embed.color = discord.Color.blurple()
+            embed.set_footer(text=None)
+            await message.edit(embed=embed, view=None)
+            return
+
+        embed.description = "\n".join(
+            line
+            for line in (embed.description or "").splitlines()
+            if any(f"({user_id})" in line for user_id in remaining)
+        )
+        embed.set_footer(text=f"{len(remaining)} pending")
+        select = next(
+            child
+            for row in message.components
+            for child in row.children
+            if isinstance(child, discord.SelectMenu)
+        )
+        entries = [
+            (int(option.value), option.label)
+            for option in select.options
+            if int(option.value) in remaining
+        ]
+        await message.edit(embed=embed, view=self.cog.renderer.digest_components(entries))
 
 
 # Whitelist Class:  This is the main cog that handles the whitelist functionality.
 class Whitelist(commands.Cog):
+    # Attributes handed to the replacement instance on a hot reload.  They are
+    # passed by reference, so callbacks of the old instance that are still
+    # running update the same objects, and queued actions and writes keep
+    # going on the same scheduler and store.
+    HANDOFF_STATE = (
+        "store",
+        "configs",
+        "scheduler",
+        "metrics_server",
+        "whitelist_index",
+        "review_buffer",
+        "review_flushers",
+        "pending_reviews",
+        "reviews_in_flight",
+        "join_times",
+        "reconcile_task",
+        "risk",
+        "background_tasks",
+        "join_rates",
+        "lockdowns",
+        "quarantining",
+        "federation",
+        "federation_task",
+        "dms",
+    )
+
     # __init__: Initializes the cog with the bot instance and configuration
     # settings.
     def __init__(self, bot):
         self.bot = bot  # The Discord bot instance.
-        # Replace with your actual whitelist role ID.  This is the role that will
-        # be assigned to whitelisted users.
-        self.whitelist_role_id = 1336950517099790389
-        # Replace with your actual whitelist channel ID.  This is the channel
-        # where new member join requests will be sent.
-        self.whitelist_channel = 1336950948182097971
         self.whitelist_log_file = (
             "config/whitelist_log.json"  # The file where whitelist logs are stored.
         )
+        self.whitelist_db_file = "config/whitelist.db"  # Used by the sqlite backend.
+        # Storage backend for whitelist decisions.  Set WHITELIST_STORAGE=sqlite
+        # in .env for large deployments; the JSON journal is the default.  All
+        # store I/O runs on a dedicated thread and writes go through a single
+        # writer task, so concurrent accepts never race.
+        self.store = AsyncStore(
+            create_store(
+                os.getenv("WHITELIST_STORAGE", "json"),
+                self.whitelist_log_file,
+                self.whitelist_db_file,
+            )
+        )
+        # Per-guild settings (whitelist role, review channel, rejoin policy and
+        # DM texts), cached in memory and written through to the store.  Set
+        # with /whitelist config.
+        self.configs = GuildConfigService(self.store)
+        # Entries logged before decisions carried a guild only count for this
+        # guild.  If it isn't set they count everywhere, which is right for
+        # single-guild setups.
+        self.legacy_guild_id = int(os.getenv("LEGACY_GUILD_ID") or 0) or None
+        # Resident index of whitelisted (guild_id, user_id) pairs.  Built once in
+        # cog_load and kept up to date by log_decision so rejoin checks never
+        # touch the disk.  Entries logged before decisions carried a guild use
+        # None as their guild.
+        self.whitelist_index = set()
+        # Joins are buffered for this many seconds and then posted together as
+        # one digest per page of members.  Set REVIEW_BATCH_WINDOW=0 to post
+        # every join on its own.
+        self.review_window = float(os.getenv("REVIEW_BATCH_WINDOW", "3"))
+        self.review_buffer = {}  # guild_id -> members waiting for the window.
+        self.review_flushers = {}  # guild_id -> task that posts the buffer.
+        # Reviews posted but not decided yet, keyed by (guild_id, user_id).
+        # Mirrored in the store so buttons keep working after a restart.
+        self.pending_reviews = {}
+        self.reviews_in_flight = set()  # (guild_id, user_id) being decided now.
+        # One stateless view instance that handles every digest message.
+        self.digest_view = DigestView(self)
+        self.renderer = ReviewRenderer()  # Builds review and digest messages.
+        # Every role grant, ban and DM goes through the scheduler, so admin
+        # clicks are served before auto-rejoins and DMs, and duplicate actions
+        # on the same member run once.  With SPLIT_MODE set they are written
+        # to a SQLite work queue instead and run by worker.py processes, so
+        # REST calls, rate-limit waits and retries stay off the gateway's
+        # event loop.
+        self.work_queue_file = "config/work_queue.db"
+        if os.getenv("SPLIT_MODE"):
+            self.scheduler = RemoteScheduler(WorkQueue(self.work_queue_file), os.getenv("CLUSTER_ID", "0"))
+        else:
+            self.scheduler = ActionScheduler()
+        # Rejoin and deny DMs are queued, persisted in the store's outbox and
+        # sent by DM_CONCURRENCY senders, so no decision waits on them.  A
+        # ban only waits for the deny DM, for up to DM_BAN_WAIT seconds after
+        # an admin's click or per member of a bulk deny, because a banned
+        # user can't be messaged.
+        self.dms = DmQueue(
+            self.store,
+            self.scheduler,
+            bot,
+            os.getenv("CLUSTER_ID", "0"),
+            concurrency=int(os.getenv("DM_CONCURRENCY", "2")),
+        )
+        self.dm_ban_wait = float(os.getenv("DM_BAN_WAIT", "10"))
+        self.join_times = {}  # (guild_id, user_id) -> perf_counter() at join.
+        # Scores each burst of joins before review; see triage.
+        self.risk = RiskScorer()
+        self.background_tasks = set()  # Automatic actions in progress; see start_background.
+        # Join rate per guild, and the guilds in raid lockdown by ID.
+        self.join_rates = JoinRateTracker()
+        self.lockdowns = {}
+        self.quarantining = set()  # (guild_id, user_id) whose quarantine role is still queued.
+        # Trust lists shared between guilds; see /whitelist federation.  Every
+        # FEDERATION_SYNC_INTERVAL seconds, decisions made by other processes
+        # sharing the store are applied to the index and the lists.
+        self.federation = FederationIndex(self.store)
+        self.federation_interval = float(os.getenv("FEDERATION_SYNC_INTERVAL", "30"))
+        self.federation_task = None
+        # Serves the metrics registry over HTTP if METRICS_PORT is set.  Each
+        # cluster process uses METRICS_PORT + CLUSTER_ID.
+        self.metrics_server = None
+        if os.getenv("METRICS_PORT"):
+            self.metrics_server = MetricsServer(
+                REGISTRY,
+                os.getenv("METRICS_HOST", "127.0.0.1"),
+                int(os.getenv("METRICS_PORT")) + int(os.getenv("CLUSTER_ID", "0")),
+            )
+        self.reconcile_task = None  # Startup pass over members missed while offline.
+        self.reconcile_chunk_size = 1000  # Members processed per saved cursor.
+        # Maximum number of concurrent role/ban requests made by bulk commands.
+        self.bulk_concurrency = int(os.getenv("BULK_CONCURRENCY", "5"))
+
+    # cog_load: Called by discord.py when the cog is added to the bot.  Reads
+    # the whitelist log a single time to build the in-memory index.
+    async def cog_load(self):
+        handoff = getattr(self.bot, "whitelist_handoff", None)
+        if handoff is not None:
+            self.bot.whitelist_handoff = None
+            self.adopt(handoff)
+            return
+        started = time.perf_counter()
+        await self.store.open()  # Migrates the legacy JSON array on first run.
+        self.scheduler.start()
+        await self.dms.start()
+        REGISTRY.add_collector(self.collect_metrics)
+        if self.metrics_server:
+            await self.metrics_server.start()
+        await self.configs.load()
+        # Taken first, so decisions other processes make while the index is
+        # built are applied by the first sync instead of being missed.
+        _, self.federation.cursor = await self.store.tail()
+        self.whitelist_index = await self.store.whitelisted(self.legacy_guild_id)
+        await self.federation.load(self.whitelist_index)
+        await self.bind_subscriptions()
+        logging.info(
+            "Loaded %s whitelisted users into the index and %s trust lists in %.2fs.",
+            len(self.whitelist_index),
+            len(self.federation.lists),
+            time.perf_counter() - started,
+        )
+        if self.federation_interval > 0:
+            self.federation_task = self.bot.loop.create_task(self.sync_federation())
+        # Restore outstanding reviews.  The review buttons and digest menus are
+        # routed by custom ID, so this needs no API calls.
+        self.pending_reviews = {
+            (entry["guild_id"], entry["user_id"]): entry
+            for entry in await self.store.pending()
+        }
+        self.bot.add_dynamic_items(ReviewButton)
+        self.bot.add_view(self.digest_view)
+        logging.info("Restored %s pending reviews.", len(self.pending_reviews))
+
+    # is_whitelisted: Checks the in-memory index for a user in a guild.
+    def is_whitelisted(self, guild_id, user_id):
+        """Returns True if the user's latest decision in the guild is an accept."""
+        if (guild_id, user_id) in self.whitelist_index:
+            return True
+        if self.legacy_guild_id not in (None, guild_id):
+            return False
+        return (None, user_id) in self.whitelist_index
+
+    # get_whitelist_role: Returns the guild's configured whitelist role, or
+    # None if it isn't configured or no longer exists.
+    def get_whitelist_role(self, guild):
+        role_id = self.configs.get(guild.id)["role_id"]
+        return guild.get_role(role_id) if role_id else None
+
+    # cog_unload: Called when the cog is removed.  Makes sure every logged
+    # entry reaches the disk, unless the cog is being reloaded, in which case
+    # its state is handed to the new instance instead.
+    async def cog_unload(self):
+        self.bot.remove_dynamic_items(ReviewButton)
+        self.digest_view.stop()
+        REGISTRY.remove_collector(self.collect_metrics)
+        if getattr(self.bot, "reloading", False):
+            self.hand_off()
+            return
+        if self.federation_task is not None:
+            self.federation_task.cancel()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        await self.dms.stop()
+        await self.scheduler.stop()
+        await self.store.close()
+
+    # hand_off: Leaves this instance's live state on the bot for the instance
+    # that replaces it.  Nothing is closed or flushed, and joins dispatched
+    # before the new instance is loaded are buffered.
+    def hand_off(self):
+        handoff = StateHandoff({name: getattr(self, name) for name in self.HANDOFF_STATE})
+        handoff.listen(self.bot, "member_join")
+        self.bot.whitelist_handoff = handoff
+        logging.info("Handing off whitelist state for reload.")
+
+    # adopt: Takes over the state left by hand_off and replays the joins that
+    # arrived in between.  Makes no awaits, so no event can slip in between
+    # releasing the buffer and discord.py registering this instance's
+    # listeners.
+    def adopt(self, handoff):
+        for name, value in handoff.state.items():
+            setattr(self, name, value)
+        REGISTRY.add_collector(self.collect_metrics)
+        self.bot.add_dynamic_items(ReviewButton)
+        self.bot.add_view(self.digest_view)
+        joins = handoff.release(self.bot)
+        for _, (member,) in joins:
+            self.bot.loop.create_task(self.on_member_join(member))
+        logging.info(
+            "Adopted whitelist state: %s indexed users, %s pending reviews, %s joins replayed.",
+            len(self.whitelist_index),
+            len(self.pending_reviews),
+            len(joins),
+        )
+
+    # accepting: False once a graceful shutdown or restart has begun.
+    def accepting(self):
+        lifecycle = getattr(self.bot, "lifecycle", None)
+        return lifecycle is None or not lifecycle.stopping
+
+    # drain: Called by the lifecycle manager before shutdown.  Posts buffered
+    # reviews right away instead of waiting out the window, then waits for
+    # queued actions and store writes.  The reconciliation pass stops; its
+    # saved cursor resumes it after the restart, and it also picks up members
+    # who join while the bot is stopping.
+    async def drain(self):
+        """Finishes in-flight work before shutdown."""
+        if self.reconcile_task is not None:
+            self.reconcile_task.cancel()
+        if self.federation_task is not None:
+            self.federation_task.cancel()
+        for lockdown in list(self.lockdowns.values()):
+            lockdown.task.cancel()
+        buffered = [lockdown.members for lockdown in self.lockdowns.values()]
+        self.lockdowns.clear()
+        buffered += list(self.review_buffer.values())
+        self.review_buffer.clear()
+        for task in list(self.review_flushers.values()):
+            task.cancel()
+        await asyncio.gather(*(self.post_reviews(members) for members in buffered))
+        # DMs not sent yet stay in the outbox for the next start.
+        await self.dms.stop()
+        await self.scheduler.drain()
+        await asyncio.gather(*self.background_tasks)
+        await self.store.flush()
+
+    # collect_metrics: Refreshes gauges right before the registry is scraped.
+    def collect_metrics(self):
+        PENDING_REVIEWS.set(len(self.pending_reviews))
+        GUILDS_IN_LOCKDOWN.set(len(self.lockdowns))
+        INDEX_SIZE.set(len(self.whitelist_index))
+        FEDERATED_IDS.set(self.federation.size())
+        DM_QUEUE.set(len(self.dms))
+        for priority, count in self.scheduler.stats()["backlog"].items():
+            SCHEDULER_BACKLOG.set(count, priority=priority)
+        for shard_id, latency in getattr(self.bot, "latencies", [(0, self.bot.latency)]):
+            GATEWAY_LATENCY.set(latency, shard=shard_id)
+
+    # resolve_member: Looks up a member in the cache, falling back to the API.
+    # Returns None if they are no longer in the guild.
+    async def resolve_member(self, guild, user_id):
+        """Returns the guild member with the given ID, or None."""
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+        try:
+            return await guild.fetch_member(user_id)
+        except discord.NotFound:
+            return None
+
+    # claim_reviews: Marks reviews as being decided for the duration of the
+    # block and yields the IDs that were not already claimed by someone else.
+    @contextlib.asynccontextmanager
+    async def claim_reviews(self, guild_id, user_ids):
+        claimed = [
+            user_id
+            for user_id in dict.fromkeys(user_ids)
+            if (guild_id, user_id) not in self.reviews_in_flight
+        ]
+        self.reviews_in_flight.update((guild_id, user_id) for user_id in claimed)
+        try:
+            yield claimed
+        finally:
+            self.reviews_in_flight.difference_update(
+                (guild_id, user_id) for user_id in claimed
+            )
+
+    # remember_reviews: Records that a review message was posted for members.
+    async def remember_reviews(self, members, message):
+        entries = [
+            {
+                "guild_id": member.guild.id,
+                "user_id": member.id,
+                "channel_id": message.channel.id,
+                "message_id": message.id,
+            }
+            for member in members
+        ]
+        now = time.perf_counter()
+        for entry in entries:
+            key = (entry["guild_id"], entry["user_id"])
+            self.pending_reviews[key] = entry
+            joined = self.join_times.pop(key, None)
+            if joined is not None:
+                JOIN_TO_REVIEW_SECONDS.observe(now - joined)
+        await self.store.add_pending(entries)
+
+    # reviews_of: Returns the pending review entries of the given members.
+    def reviews_of(self, guild_id, members):
+        return [
+            self.pending_reviews[(guild_id, member.id)]
+            for member in members
+            if (guild_id, member.id) in self.pending_reviews
+        ]
+
+    # redraw_reviews: Updates the review messages of members decided outside
+    # them (the bulk commands), so no buttons are left for members who were
+    # already handled.  A single review is marked with title and color and
+    # loses its buttons; a digest is refreshed like after a pick from its
+    # menu.  Call it after the decisions are logged.
+    async def redraw_reviews(self, entries, title, color):
+        messages = {(entry["channel_id"], entry["message_id"]) for entry in entries}
+        for channel_id, message_id in messages:
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                continue
+            try:
+                message = await channel.fetch_message(message_id)
+                if any(isinstance(child, discord.SelectMenu) for row in message.components for child in row.children):
+                    await self.digest_view.refresh(message)
+                    continue
+                embed = message.embeds[0]
+                embed.title = title
+                embed.color = color
+                await message.edit(embed=embed, view=None)
+            except discord.HTTPException as e:
+                logging.error("Failed to update review message %s: %s", message_id, e)
+
+    # forget_reviews: Drops pending reviews once a decision has been made.
+    async def forget_reviews(self, guild_id, user_ids):
+        removed = [
+            user_id
+            for user_id in user_ids
+            if self.pending_reviews.pop((guild_id, user_id), None) is not None
+        ]
+        if removed:
+            await self.store.remove_pending(guild_id, removed)
 
     # whitelist_group: Creates a slash command group named "whitelist" for
     # managing whitelist commands.
@@ -106,80 +837,108 @@ class Whitelist(commands.Cog):
         silent: bool = False,
     ):
         """Denies a user and bans them from the server, with an option to do so silently."""
+        # In LEAN_MODE the member may not be cached; fetch them on demand.  If
+        # they already left, the ban below still works on the user, which is
+        # looked up when only the ID is known (a review for someone who left).
+        if not isinstance(user, discord.Member):
+            member = await self.resolve_member(interaction.guild, user.id)
+            if member is not None:
+                user = member
+            elif not isinstance(user, discord.User):
+                user = self.bot.get_user(user.id) or await self.bot.fetch_user(user.id)
+        # The DM jumps ahead of other queued DMs and the ban waits for it,
+        # for at most DM_BAN_WAIT seconds.  Failures are logged and recorded
+        # by the DM queue.
         if not silent:
-            try:
-                await user.send(
-                    "You have been denied access to this server. You will be banned shortly."
+            with ACTION_STAGE_SECONDS.time(action="deny", stage="dm"):
+                delivery = self.dms.send(
+                    interaction.guild.id,
+                    user,
+                    self.configs.get(interaction.guild.id)["deny_dm"],
+                    "deny",
+                    urgent=True,
                 )
-                logging.info(f"Successfully sent DM to user {user.id} before banning.")
-            except discord.Forbidden:
-                # Log a warning if the bot can't send a DM (likely due to the
-                # user's privacy settings).
-                logging.warning(
-                    f"Failed to send DM to user {user.id} (DMs closed or user blocked bot), proceeding with ban."
+                error = await self.dms.settle(delivery, self.dm_ban_wait)
+            if error is None:
+                logging.info(
+                    "Successfully sent DM to user %s before banning.",
+                    user.id,
+                    extra=log_fields(interaction.guild, user, "deny_dm"),
                 )
-                try:
-                    await interaction.followup.send(
-                        f"Failed to send message to {user.mention} (DMs closed). Banning anyway.",
-                        ephemeral=True,
-                    )
-                except discord.errors.NotFound:
-                    logging.exception(
-                        "Webhook expired while sending DM failure message.  Unable to send followup."
+            else:
+                if isinstance(error, asyncio.TimeoutError):
+                    logging.warning(
+                        "DM to user %s still queued after %.0fs, proceeding with ban.",
+                        user.id,
+                        self.dm_ban_wait,
+                        extra=log_fields(interaction.guild, user, "deny_dm"),
                     )
-                except Exception as e:
-                    logging.exception(f"An unexpected error occurred: {e}")
-
-            except Exception as e:
-                # Log any other exceptions that occur while trying to send the DM.
-                logging.exception(f"Error sending DM to user {user.id}: {e}")
+                    message = f"The message to {user.mention} is still queued. Banning anyway."
+                elif isinstance(error, discord.Forbidden):
+                    message = f"Failed to send message to {user.mention} (DMs closed). Banning anyway."
+                else:
+                    message = f"An error occurred while trying to message {user.mention}. Banning anyway."
                 try:
-                    await interaction.followup.send(
-                        f"An error occurred while trying to message {user.mention}. Banning anyway.",
-                        ephemeral=True,
-                    )
+                    await interaction.followup.send(message, ephemeral=True)
                 except discord.errors.NotFound:
+                    FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
                     logging.exception(
                         "Webhook expired while sending DM failure message.  Unable to send followup."
                     )
                 except Exception as e:
-                    logging.exception(f"An unexpected error occurred: {e}")
+                    logging.exception("An unexpected error occurred: %s", e)
 
         # Proceed with the ban regardless of DM status
         try:
-            await user.ban(reason="Denied by admin")
-            logging.info(f"Successfully banned user {user.id}.")
+            with ACTION_STAGE_SECONDS.time(action="deny", stage="ban"):
+                await self.scheduler.run(
+                    PRIORITY_ADMIN,
+                    f"ban:{interaction.guild.id}",
+                    ("ban", interaction.guild.id, user.id),
+                    interaction.guild.ban,
+                    user,
+                    reason="Denied by admin",
+                )
+            logging.info("Successfully banned user %s.", user.id, extra=log_fields(interaction.guild, user, "ban"))
         except discord.Forbidden:
             # Log an error if the bot doesn't have permission to ban the user.
-            logging.error(f"Failed to ban user {user.id}")
+            logging.error("Failed to ban user %s", user.id, extra=log_fields(interaction.guild, user, "ban"))
             try:
                 await interaction.followup.send(
                     f"Failed to ban {user.mention}. Insufficient permissions.",
                     ephemeral=True,
                 )
             except discord.errors.NotFound:
+                FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
                 logging.exception(
                     "Webhook expired while sending ban failure message.  Unable to send followup."
                 )
             except Exception as e:
-                logging.exception(f"An unexpected error occurred: {e}")
+                logging.exception("An unexpected error occurred: %s", e)
             return  # Important: Exit if ban fails
         except Exception as e:
             # Log any other exceptions that occur while trying to ban the user.
-            logging.exception(f"Error banning user {user.id}: {e}")
+            logging.exception("Error banning user %s: %s", user.id, e, extra=log_fields(interaction.guild, user, "ban"))
             try:
                 await interaction.followup.send(
                     f"An error occurred while trying to ban {user.mention}.",
                     ephemeral=True,
                 )
             except discord.errors.NotFound:
+                FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
                 logging.exception(
                     "Webhook expired while sending ban failure message.  Unable to send followup."
                 )
             except Exception as e:
-                logging.exception(f"An unexpected error occurred: {e}")
+                logging.exception("An unexpected error occurred: %s", e)
             return  # Important: Exit if ban fails
 
+        # Record the decision so denies show up in the history as well.
+        with ACTION_STAGE_SECONDS.time(action="deny", stage="log"):
+            await self.log_decision(
+                user, interaction.guild, "silent_deny" if silent else "deny", interaction.user
+            )
+
         # Edit the original embed to indicate the user was denied and remove the
         # buttons.
         if view and interaction.message:  # Check if it's a button interaction
@@ -191,11 +950,12 @@ class Whitelist(commands.Cog):
                     embed=embed, view=None
                 )  # Remove the buttons
             except discord.errors.NotFound:
+                FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
                 logging.exception(
                     "Message not found while editing embed.  Likely deleted."
                 )
             except Exception as e:
-                logging.exception(f"An unexpected error occurred: {e}")
+                logging.exception("An unexpected error occurred: %s", e)
 
     # accept_user: A helper function that accepts a user and adds them to the
     # whitelist role.
@@ -203,7 +963,22 @@ class Whitelist(commands.Cog):
         self, interaction: discord.Interaction, user: discord.Member, view: View
     ):
         """Accepts a user and adds them to the whitelist."""
-        whitelist_role = interaction.guild.get_role(self.whitelist_role_id)
+        # In LEAN_MODE the member may not be cached; fetch them on demand.
+        if not isinstance(user, discord.Member):
+            member = await self.resolve_member(interaction.guild, user.id)
+            if member is None:
+                try:
+                    await interaction.followup.send(
+                        f"{user.mention} is no longer in the server.", ephemeral=True
+                    )
+                except discord.errors.NotFound:
+                    FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
+                    logging.exception(
+                        "Webhook expired while sending member not found message.  Unable to send followup."
+                    )
+                return
+            user = member
+        whitelist_role = self.get_whitelist_role(interaction.guild)
         # Check if the whitelist role exists.
         if not whitelist_role:
             try:
@@ -211,11 +986,12 @@ class Whitelist(commands.Cog):
                     "Whitelist role not found.  Check configuration.", ephemeral=True
                 )
             except discord.errors.NotFound:
+                FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
                 logging.exception(
                     "Webhook expired while sending role not found message.  Unable to send followup."
                 )
             except Exception as e:
-                logging.exception(f"An unexpected error occurred: {e}")
+                logging.exception("An unexpected error occurred: %s", e)
             return
 
         # Check if the user already has the whitelist role.
@@ -225,63 +1001,76 @@ class Whitelist(commands.Cog):
                     f"{user.mention} is already in the whitelist", ephemeral=True
                 )
             except discord.errors.NotFound:
+                FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
                 logging.exception(
                     "Webhook expired while sending already whitelisted message.  Unable to send followup."
                 )
             except Exception as e:
-                logging.exception(f"An unexpected error occurred: {e}")
+                logging.exception("An unexpected error occurred: %s", e)
             return
 
         try:
-            await user.add_roles(whitelist_role)  # Add the whitelist role to the user.
-            await self.log_whitelist_user(user)  # Log the whitelisting action.
-            logging.info(f"Successfully added role to user {user.id}")
+            with ACTION_STAGE_SECONDS.time(action="accept", stage="add_roles"):
+                await self.grant_role(PRIORITY_ADMIN, user, whitelist_role)  # Add the whitelist role to the user.
+            with ACTION_STAGE_SECONDS.time(action="accept", stage="log"):
+                await self.log_whitelist_user(
+                    user, interaction.user
+                )  # Log the whitelisting action.
+            logging.info(
+                "Successfully added role to user %s", user.id, extra=log_fields(interaction.guild, user, "accept")
+            )
         except discord.Forbidden:
             # Log an error if the bot doesn't have permission to add the role.
-            logging.error(f"Failed to add role to user {user.id}")
+            logging.error("Failed to add role to user %s", user.id, extra=log_fields(interaction.guild, user, "accept"))
             try:
                 await interaction.followup.send(
                     f"Failed to add whitelist role to {user.mention}. Insufficient permissions.",
                     ephemeral=True,
                 )
             except discord.errors.NotFound:
+                FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
                 logging.exception(
                     "Webhook expired while sending permission error message.  Unable to send followup."
                 )
             except Exception as e:
-                logging.exception(f"An unexpected error occurred: {e}")
+                logging.exception("An unexpected error occurred: %s", e)
             return  # Exit if adding role fails
         except Exception as e:
             # Log any other exceptions that occur while trying to add the role.
-            logging.exception(f"Error adding role to user {user.id}: {e}")
+            logging.exception(
+                "Error adding role to user %s: %s", user.id, e, extra=log_fields(interaction.guild, user, "accept")
+            )
             try:
                 await interaction.followup.send(
                     f"An error occurred while trying to add the whitelist role to {user.mention}.",
                     ephemeral=True,
                 )
             except discord.errors.NotFound:
+                FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
                 logging.exception(
                     "Webhook expired while sending generic error message.  Unable to send followup."
                 )
             except Exception as e:
-                logging.exception(f"An unexpected error occurred: {e}")
+                logging.exception("An unexpected error occurred: %s", e)
             return  # Exit if adding role fails
 
         # Edit the original embed to indicate the user was accepted and remove
         # the buttons.
-        embed = interaction.message.embeds[0]  # Get the original embed
-        embed.title = "Member Accepted"
-        embed.color = discord.Color.green()  # Change the embed color
-        try:
-            await interaction.message.edit(
-                embed=embed, view=None
-            )  # Remove the buttons
-        except discord.errors.NotFound:
-            logging.exception(
-                "Message not found while editing embed.  Likely deleted."
-            )
-        except Exception as e:
-            logging.exception(f"An unexpected error occurred: {e}")
+        if view and interaction.message:  # Check if it's a button interaction
+            embed = interaction.message.embeds[0]  # Get the original embed
+            embed.title = "Member Accepted"
+            embed.color = discord.Color.green()  # Change the embed color
+            try:
+                await interaction.message.edit(
+                    embed=embed, view=None
+                )  # Remove the buttons
+            except discord.errors.NotFound:
+                FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
+                logging.exception(
+                    "Message not found while editing embed.  Likely deleted."
+                )
+            except Exception as e:
+                logging.exception("An unexpected error occurred: %s", e)
 
     # whitelist_deny: A slash command that denies a user.  It can only be used
     # by users with administrator permissions.
@@ -313,111 +1102,1315 @@ class Whitelist(commands.Cog):
         # Call the accept_user helper function.
         await self.accept_user(interaction, user, None)  # Pass None for view
 
-    # load_whitelist_log: Loads the whitelist log from the JSON file.
-    async def load_whitelist_log(self):
-        """Loads the whitelist log from file."""
+    # select_members: Resolves the members targeted by a bulk command from the
+    # role, join-time and ID filters.  Times are read like the history and
+    # export filters (local time unless they give an offset) and made aware
+    # to compare with joined_at.  Raises ValueError for malformed input.
+    async def select_members(self, guild, role, joined_after, joined_before, user_ids):
+        def join_time(value):
+            return datetime.datetime.fromisoformat(parse_time(value)).astimezone()
+
+        after = join_time(joined_after) if joined_after else None
+        before = join_time(joined_before) if joined_before else None
+
+        if user_ids:
+            ids = [int(part) for part in user_ids.replace(",", " ").split()]
+            candidates = []
+            for user_id in ids:
+                member = guild.get_member(user_id)
+                if member is None:
+                    try:
+                        member = await guild.fetch_member(user_id)
+                    except discord.NotFound:
+                        continue
+                candidates.append(member)
+        elif guild.chunked:
+            candidates = guild.members
+        else:
+            # The member cache is incomplete (e.g. LEAN_MODE), so ask the API.
+            candidates = [member async for member in guild.fetch_members(limit=None)]
+
+        return [
+            member
+            for member in candidates
+            if not member.bot
+            and (role is None or role in member.roles)
+            and (after is None or (member.joined_at and member.joined_at >= after))
+            and (before is None or (member.joined_at and member.joined_at < before))
+        ]
+
+    # run_bulk: Runs an action for every member through a bounded pool of
+    # workers.  discord.py already waits out per-route rate-limit buckets; the
+    # pool keeps the number of in-flight requests small enough that the bucket
+    # is drained steadily instead of queueing hundreds of requests at once.
+    # Progress is reported by editing a single followup message.
+    async def run_bulk(self, interaction, members, action, label):
+        """Runs an action for many members and returns the ones it succeeded for."""
+        progress = await interaction.followup.send(
+            f"{label}: 0/{len(members)}", ephemeral=True, wait=True
+        )
+        semaphore = asyncio.Semaphore(self.bulk_concurrency)
+        succeeded, failed = [], []
+        last_update = time.monotonic()
+
+        async def worker(member):
+            nonlocal last_update
+            async with semaphore:
+                try:
+                    await action(member)
+                    succeeded.append(member)
+                except Exception as e:
+                    logging.error(
+                        "%s failed for user %s: %s", label, member.id, e, extra=log_fields(member.guild, member, "bulk")
+                    )
+                    failed.append(member)
+                # Throttle progress edits so they don't compete with the
+                # actions themselves for rate limit.
+                if time.monotonic() - last_update >= 2:
+                    last_update = time.monotonic()
+                    try:
+                        await progress.edit(
+                            content=f"{label}: {len(succeeded) + len(failed)}/{len(members)}"
+                        )
+                    except discord.HTTPException:
+                        pass
+
+        await asyncio.gather(*(worker(member) for member in members))
         try:
-            with open(self.whitelist_log_file, "r") as f:
-                return json.load(f)  # Load the JSON data from the file.
-        except FileNotFoundError:
-            return []  # Return an empty list if the file doesn't exist.
-        except json.JSONDecodeError:
-            # Log an error if the JSON file is corrupted.
-            logging.error(
-                f"Error decoding JSON from {self.whitelist_log_file}.  Returning empty list."
+            await progress.edit(
+                content=f"{label}: done. {len(succeeded)} succeeded, {len(failed)} failed."
             )
-            return []  # Return empty list to avoid errors
+        except discord.errors.NotFound:
+            FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
+            logging.exception(
+                "Webhook expired while sending bulk summary.  Unable to send followup."
+            )
+        return succeeded
 
-    # log_whitelist_user: Logs a whitelisted user to the whitelist log file.
-    async def log_whitelist_user(self, user: discord.Member):
-        """Logs a whitelisted user to the whitelist log file."""
-        whitelist_log = await self.load_whitelist_log()  # Load the existing log.
+    # whitelist_bulk_accept: A slash command that accepts every member matching
+    # the filters.  It can only be used by users with administrator
+    # permissions.
+    @whitelist_group.command(name="bulk-accept")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        role="Only members with this role",
+        joined_after="Only members who joined at or after this time (ISO 8601, local time unless an offset is given)",
+        joined_before="Only members who joined before this time (ISO 8601, local time unless an offset is given)",
+        user_ids="Space or comma separated user IDs",
+    )
+    async def whitelist_bulk_accept(
+        self,
+        interaction: discord.Interaction,
+        role: discord.Role = None,
+        joined_after: str = None,
+        joined_before: str = None,
+        user_ids: str = None,
+    ):
+        """Accept every member matching the filters"""
+        await interaction.response.defer(ephemeral=True)
+        whitelist_role = self.get_whitelist_role(interaction.guild)
+        if not whitelist_role:
+            await interaction.followup.send(
+                "Whitelist role not found.  Check configuration.", ephemeral=True
+            )
+            return
+        members = await self.bulk_targets(
+            interaction, role, joined_after, joined_before, user_ids
+        )
+        if members is None:
+            return
+        members = [member for member in members if whitelist_role not in member.roles]
 
-        # Append the new user's information to the log.
-        whitelist_log.append(
-            {
-                "user_id": user.id,
-                "username": user.name,
-                "discriminator": user.discriminator,
-                "timestamp": datetime.datetime.now().isoformat(),  # Store as ISO 8601
+        async def accept(member):
+            await self.grant_role(PRIORITY_ADMIN, member, whitelist_role, reason="Bulk accepted by admin")
+
+        accepted = await self.run_bulk(interaction, members, accept, "Accepting")
+        reviews = self.reviews_of(interaction.guild.id, accepted)
+        await self.log_decisions(accepted, interaction.guild, "accept", interaction.user)
+        await self.redraw_reviews(reviews, "Member Accepted", discord.Color.green())
+
+    # whitelist_bulk_deny: A slash command that denies and bans every member
+    # matching the filters.  It can only be used by users with administrator
+    # permissions.
+    @whitelist_group.command(name="bulk-deny")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        role="Only members with this role",
+        joined_after="Only members who joined at or after this time (ISO 8601, local time unless an offset is given)",
+        joined_before="Only members who joined before this time (ISO 8601, local time unless an offset is given)",
+        user_ids="Space or comma separated user IDs",
+        silent="Whether to silently deny the users (no DM)",
+    )
+    async def whitelist_bulk_deny(
+        self,
+        interaction: discord.Interaction,
+        role: discord.Role = None,
+        joined_after: str = None,
+        joined_before: str = None,
+        user_ids: str = None,
+        silent: bool = False,
+    ):
+        """Deny and ban every member matching the filters"""
+        await interaction.response.defer(ephemeral=True)
+        members = await self.bulk_targets(
+            interaction, role, joined_after, joined_before, user_ids
+        )
+        if members is None:
+            return
+        # Never ban the admin running the command or anyone with the
+        # administrator permission.
+        members = [
+            member
+            for member in members
+            if member != interaction.user and not member.guild_permissions.administrator
+        ]
+
+        deny_dm = self.configs.get(interaction.guild.id)["deny_dm"]
+
+        # Each ban waits for the member's DM for up to DM_BAN_WAIT seconds,
+        # as after a click, so a stalled DM can't hold the whole bulk deny
+        # up.  Failures are recorded by the queue.
+        async def deny(member):
+            if not silent:
+                error = await self.dms.settle(
+                    self.dms.send(member.guild.id, member, deny_dm, "deny", urgent=True), self.dm_ban_wait
+                )
+                if isinstance(error, asyncio.TimeoutError):
+                    logging.warning(
+                        "DM to user %s still queued after %.0fs, proceeding with ban.",
+                        member.id,
+                        self.dm_ban_wait,
+                        extra=log_fields(member.guild, member, "deny_dm"),
+                    )
+            await self.scheduler.run(
+                PRIORITY_ADMIN,
+                f"ban:{member.guild.id}",
+                ("ban", member.guild.id, member.id),
+                member.ban,
+                reason="Bulk denied by admin",
+            )
+
+        denied = await self.run_bulk(interaction, members, deny, "Denying")
+        reviews = self.reviews_of(interaction.guild.id, denied)
+        await self.log_decisions(
+            denied, interaction.guild, "silent_deny" if silent else "deny", interaction.user
+        )
+        await self.redraw_reviews(reviews, "Member Denied", discord.Color.red())
+
+    # bulk_targets: Validates the filters of a bulk command and resolves the
+    # matching members.  Returns None (after telling the admin why) if the
+    # filters are missing or malformed.
+    async def bulk_targets(self, interaction, role, joined_after, joined_before, user_ids):
+        if not any((role, joined_after, joined_before, user_ids)):
+            await interaction.followup.send(
+                "Provide at least one filter (role, joined_after, joined_before or user_ids).",
+                ephemeral=True,
+            )
+            return None
+        try:
+            members = await self.select_members(
+                interaction.guild, role, joined_after, joined_before, user_ids
+            )
+        except ValueError as e:
+            await interaction.followup.send(f"Invalid filter: {e}", ephemeral=True)
+            return None
+        if not members:
+            await interaction.followup.send("No members matched.", ephemeral=True)
+            return None
+        return members
+
+    # config_group: A "/whitelist config" subgroup for per-guild settings.
+    config_group = app_commands.Group(
+        name="config", description="Configure the whitelist for this server", parent=whitelist_group
+    )
+
+    # config_reply: Confirms a settings change to the admin.
+    async def config_reply(self, interaction, message):
+        try:
+            await interaction.response.send_message(message, ephemeral=True)
+        except discord.errors.NotFound:
+            FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
+            logging.exception(
+                "Interaction expired while confirming configuration change."
+            )
+
+    # config_show: Shows the current settings for this server.
+    @config_group.command(name="show")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def config_show(self, interaction: discord.Interaction):
+        """Show the whitelist settings for this server"""
+        config = self.configs.get(interaction.guild.id)
+        embed = discord.Embed(title="Whitelist Settings")
+        embed.add_field(
+            name="Role", value=f"<@&{config['role_id']}>" if config["role_id"] else "Not set", inline=False
+        )
+        embed.add_field(
+            name="Review Channel", value=f"<#{config['channel_id']}>" if config["channel_id"] else "Not set", inline=False
+        )
+        embed.add_field(name="Auto Rejoin", value="On" if config["auto_rejoin"] else "Off", inline=False)
+        embed.add_field(name="Rejoin DM", value=config["rejoin_dm"], inline=False)
+        embed.add_field(name="Deny DM", value=config["deny_dm"], inline=False)
+        embed.add_field(
+            name="Join Risk",
+            value=(
+                f"Accept below {config['risk_accept_below'] if config['risk_accept_below'] is not None else 'off'}, "
+                f"deny from {config['risk_deny_above'] if config['risk_deny_above'] is not None else 'off'}"
+            ),
+            inline=False,
+        )
+        embed.add_field(
+            name="Raid Lockdown",
+            value=(
+                f"{config['raid_joins']} joins within {config['raid_window']}s"
+                if config["raid_joins"]
+                else "Off"
+            ),
+            inline=False,
+        )
+        embed.add_field(
+            name="Quarantine Role",
+            value=f"<@&{config['quarantine_role_id']}>" if config["quarantine_role_id"] else "Not set",
+            inline=False,
+        )
+        embed.add_field(
+            name="Trust Lists", value=", ".join(name for name, _ in config["trust_lists"]) or "None", inline=False
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    # config_role: Sets the role given to whitelisted members.
+    @config_group.command(name="role")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def config_role(self, interaction: discord.Interaction, role: discord.Role):
+        """Set the role given to whitelisted members"""
+        await self.configs.update(interaction.guild.id, role_id=role.id)
+        await self.config_reply(interaction, f"Whitelist role set to {role.mention}.")
+
+    # config_channel: Sets the channel where reviews are posted.
+    @config_group.command(name="channel")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def config_channel(self, interaction: discord.Interaction, channel: discord.TextChannel):
+        """Set the channel where new members are reviewed"""
+        await self.configs.update(interaction.guild.id, channel_id=channel.id)
+        await self.config_reply(interaction, f"Review channel set to {channel.mention}.")
+
+    # config_rejoin: Turns automatic re-whitelisting of rejoining members on
+    # or off.
+    @config_group.command(name="rejoin")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(enabled="Whether previously accepted members are whitelisted again when they rejoin")
+    async def config_rejoin(self, interaction: discord.Interaction, enabled: bool):
+        """Turn automatic whitelisting of rejoining members on or off"""
+        await self.configs.update(interaction.guild.id, auto_rejoin=enabled)
+        await self.config_reply(interaction, f"Auto rejoin turned {'on' if enabled else 'off'}.")
+
+    # config_risk: Sets the join risk thresholds.  A threshold that isn't
+    # given is turned off.
+    @config_group.command(name="risk")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        accept_below="Accept members scoring below this without review (0-1, omit to turn off)",
+        deny_above="Silently ban members scoring at least this without review (0-1, omit to turn off)",
+    )
+    async def config_risk(
+        self,
+        interaction: discord.Interaction,
+        accept_below: app_commands.Range[float, 0.0, 1.0] = None,
+        deny_above: app_commands.Range[float, 0.0, 1.0] = None,
+    ):
+        """Set the join risk thresholds for automatic accepts and denies"""
+        if accept_below is not None and deny_above is not None and accept_below > deny_above:
+            await self.config_reply(interaction, "`accept_below` can't be higher than `deny_above`.")
+            return
+        await self.configs.update(
+            interaction.guild.id, risk_accept_below=accept_below, risk_deny_above=deny_above
+        )
+        await self.config_reply(
+            interaction,
+            f"Auto-accept below: {accept_below if accept_below is not None else 'off'}, "
+            f"auto-deny from: {deny_above if deny_above is not None else 'off'}.",
+        )
+
+    # config_raid: Sets the raid detection threshold.
+    @config_group.command(name="raid")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        joins="Joins within the window that start a lockdown (0 turns raid detection off)",
+        window="Length of the window in seconds",
+    )
+    async def config_raid(
+        self,
+        interaction: discord.Interaction,
+        joins: app_commands.Range[int, 0, 10000],
+        window: app_commands.Range[int, 1, 3600] = 10,
+    ):
+        """Set the join rate that puts this server into raid lockdown"""
+        await self.configs.update(interaction.guild.id, raid_joins=joins or None, raid_window=window)
+        if joins:
+            await self.config_reply(interaction, f"Lockdown starts at {joins} joins within {window} seconds.")
+        else:
+            await self.config_reply(interaction, "Raid detection turned off.")
+
+    # config_quarantine: Sets or clears the role given to members who join
+    # during a lockdown.
+    @config_group.command(name="quarantine")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(role="Role for members who join during a lockdown (omit to turn off)")
+    async def config_quarantine(self, interaction: discord.Interaction, role: discord.Role = None):
+        """Set the role given to members who join during a raid lockdown"""
+        await self.configs.update(interaction.guild.id, quarantine_role_id=role.id if role else None)
+        await self.config_reply(
+            interaction, f"Quarantine role set to {role.mention}." if role else "Quarantine role turned off."
+        )
+
+    # config_dm: Sets the text of the rejoin or deny DM.
+    @config_group.command(name="dm")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(kind="Which message to change", text="The new message")
+    @app_commands.choices(
+        kind=[
+            app_commands.Choice(name="rejoin", value="rejoin_dm"),
+            app_commands.Choice(name="deny", value="deny_dm"),
+        ]
+    )
+    async def config_dm(
+        self, interaction: discord.Interaction, kind: app_commands.Choice[str], text: str
+    ):
+        """Set the DM sent to rejoining or denied members"""
+        await self.configs.update(interaction.guild.id, **{kind.value: text})
+        await self.config_reply(interaction, f"{kind.name.capitalize()} DM updated.")
+
+    # federation_group: A "/whitelist federation" subgroup for trust lists.
+    # A list is owned by the guild that created it, which chooses the guilds
+    # whose accepted members the list vouches for; any guild can subscribe
+    # to a list to whitelist those members when they join.
+    federation_group = app_commands.Group(
+        name="federation", description="Share trusted members between servers", parent=whitelist_group
+    )
+
+    # owned_list: Returns a trust list if this guild owns it, otherwise tells
+    # the admin why not and returns None.
+    async def owned_list(self, interaction, name):
+        trust_list = self.federation.lists.get(name)
+        if trust_list is None:
+            await self.config_reply(interaction, f"There is no trust list named `{name}`.")
+            return None
+        if trust_list["owner"] != interaction.guild.id:
+            await self.config_reply(interaction, f"Only the server that created `{name}` can change it.")
+            return None
+        return trust_list
+
+    # bind_subscriptions: Ties subscriptions saved by name alone, before they
+    # recorded the list's owner, to the list's current owner.  Subscriptions
+    # to lists that no longer exist are dropped.
+    async def bind_subscriptions(self):
+        for guild_id, config in list(self.configs.cache.items()):
+            if not any(isinstance(entry, str) for entry in config["trust_lists"]):
+                continue
+            bound = [
+                [entry, self.federation.lists[entry]["owner"]] if isinstance(entry, str) else entry
+                for entry in config["trust_lists"]
+                if not isinstance(entry, str) or entry in self.federation.lists
+            ]
+            await self.configs.update(guild_id, trust_lists=bound)
+
+    # federation_create: Creates a trust list fed by this guild.
+    @federation_group.command(name="create")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(name="Name other servers subscribe with")
+    async def federation_create(self, interaction: discord.Interaction, name: app_commands.Range[str, 1, 32]):
+        """Create a trust list of the members accepted in this server"""
+        name = name.lower()
+        if name in self.federation.lists:
+            await self.config_reply(interaction, f"A trust list named `{name}` already exists.")
+            return
+        await self.federation.save(
+            name, {"owner": interaction.guild.id, "guilds": [interaction.guild.id]}, self.whitelist_index
+        )
+        await self.config_reply(
+            interaction,
+            f"Created `{name}` with {len(self.federation.members[name])} trusted members. "
+            "Add more servers with `/whitelist federation add`.",
+        )
+
+    # federation_delete: Deletes a trust list this guild owns.  Subscribers
+    # are bound to this guild as the owner, so a list another guild creates
+    # under the same name later isn't trusted by them.
+    @federation_group.command(name="delete")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def federation_delete(self, interaction: discord.Interaction, name: str):
+        """Delete a trust list owned by this server"""
+        name = name.lower()
+        if await self.owned_list(interaction, name) is None:
+            return
+        await self.federation.save(name, None, self.whitelist_index)
+        await self.config_reply(interaction, f"Deleted `{name}`.")
+
+    # federation_add: Adds a guild whose accepted members the list trusts.
+    @federation_group.command(name="add")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(name="Trust list owned by this server", guild_id="ID of the server to trust")
+    async def federation_add(self, interaction: discord.Interaction, name: str, guild_id: str):
+        """Trust the members accepted in another server"""
+        name = name.lower()
+        trust_list = await self.owned_list(interaction, name)
+        if trust_list is None:
+            return
+        if not guild_id.isdigit():
+            await self.config_reply(interaction, "`guild_id` must be a server ID.")
+            return
+        guilds = sorted(set(trust_list["guilds"]) | {int(guild_id)})
+        await self.federation.save(name, {**trust_list, "guilds": guilds}, self.whitelist_index)
+        await self.config_reply(
+            interaction, f"`{name}` now trusts {len(guilds)} servers and {len(self.federation.members[name])} members."
+        )
+
+    # federation_remove: Stops trusting a guild's accepted members.
+    @federation_group.command(name="remove")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(name="Trust list owned by this server", guild_id="ID of the server to stop trusting")
+    async def federation_remove(self, interaction: discord.Interaction, name: str, guild_id: str):
+        """Stop trusting the members accepted in a server"""
+        name = name.lower()
+        trust_list = await self.owned_list(interaction, name)
+        if trust_list is None:
+            return
+        guilds = [guild for guild in trust_list["guilds"] if str(guild) != guild_id]
+        await self.federation.save(name, {**trust_list, "guilds": guilds}, self.whitelist_index)
+        await self.config_reply(
+            interaction, f"`{name}` now trusts {len(guilds)} servers and {len(self.federation.members[name])} members."
+        )
+
+    # federation_subscribe: Whitelists members of a trust list in this guild.
+    @federation_group.command(name="subscribe")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def federation_subscribe(self, interaction: discord.Interaction, name: str):
+        """Whitelist members of a trust list when they join this server"""
+        name = name.lower()
+        trust_list = self.federation.lists.get(name)
+        if trust_list is None:
+            await self.config_reply(interaction, f"There is no trust list named `{name}`.")
+            return
+        trust_lists = [entry for entry in self.configs.get(interaction.guild.id)["trust_lists"] if entry[0] != name]
+        await self.configs.update(interaction.guild.id, trust_lists=[*trust_lists, [name, trust_list["owner"]]])
+        await self.config_reply(interaction, f"Members trusted by `{name}` are now whitelisted when they join.")
+
+    # federation_unsubscribe: Stops using a trust list in this guild.
+    @federation_group.command(name="unsubscribe")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def federation_unsubscribe(self, interaction: discord.Interaction, name: str):
+        """Stop whitelisting members of a trust list"""
+        name = name.lower()
+        trust_lists = self.configs.get(interaction.guild.id)["trust_lists"]
+        await self.configs.update(
+            interaction.guild.id, trust_lists=[entry for entry in trust_lists if entry[0] != name]
+        )
+        await self.config_reply(interaction, f"Unsubscribed from `{name}`.")
+
+    # federation_show: Lists the trust lists this guild subscribes to, owns
+    # or feeds.
+    @federation_group.command(name="show")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def federation_show(self, interaction: discord.Interaction):
+        """Show the trust lists this server uses, owns or feeds"""
+        guild_id = interaction.guild.id
+        embed = discord.Embed(title="Trust Lists")
+        for name, trust_list in sorted(self.federation.lists.items()):
+            roles = []
+            if [name, trust_list["owner"]] in self.configs.get(guild_id)["trust_lists"]:
+                roles.append("subscribed")
+            if trust_list["owner"] == guild_id:
+                roles.append("owner")
+            if guild_id in trust_list["guilds"]:
+                roles.append("trusted")
+            if not roles:
+                continue
+            embed.add_field(
+                name=name,
+                value=(
+                    f"{', '.join(roles).capitalize()}. {len(trust_list['guilds'])} servers, "
+                    f"{len(self.federation.members[name])} members."
+                ),
+                inline=False,
+            )
+        if not embed.fields:
+            embed.description = "This server doesn't use any trust lists."
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    # audit_filters: Builds store query filters from the history and export
+    # options.  Replies with an error and returns None for a bad time.
+    async def audit_filters(self, interaction, user, admin, action, since, until):
+        try:
+            return {
+                "guild_id": interaction.guild.id,
+                "legacy_guild_id": self.legacy_guild_id,
+                "user_id": user.id if user else None,
+                "admin_id": admin.id if admin else None,
+                "action": action.value if action else None,
+                "since": parse_time(since) if since else None,
+                "until": parse_time(until) if until else None,
             }
+        except ValueError:
+            await interaction.response.send_message(
+                "Times must be ISO 8601, e.g. `2024-05-01` or `2024-05-01T18:30`.", ephemeral=True
+            )
+            return None
+
+    # whitelist_history: Shows matching decisions as paginated embeds, oldest
+    # first.
+    @whitelist_group.command(name="history")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        user="Only decisions about this user",
+        admin="Only decisions made by this admin",
+        action="Only this kind of decision",
+        since="Only decisions from this time on (ISO 8601, e.g. 2024-05-01)",
+        until="Only decisions before this time (ISO 8601)",
+    )
+    @app_commands.choices(action=[app_commands.Choice(name=action, value=action) for action in ACTIONS])
+    async def whitelist_history(
+        self,
+        interaction: discord.Interaction,
+        user: discord.User = None,
+        admin: discord.User = None,
+        action: app_commands.Choice[str] = None,
+        since: str = None,
+        until: str = None,
+    ):
+        """Show whitelist decisions for this server"""
+        filters = await self.audit_filters(interaction, user, admin, action, since, until)
+        if filters is None:
+            return
+        await interaction.response.defer(ephemeral=True)
+        view = HistoryView(
+            self.store.stream(batch_size=HistoryView.PAGE_SIZE + 1, **filters), "Whitelist History"
         )
+        # The view keeps the stream open only if it was sent and has another
+        # page; otherwise it is closed here, whatever went wrong.
+        sent = False
+        try:
+            embed = await view.next_page()
+            await interaction.followup.send(embed=embed, view=view, ephemeral=True)
+            sent = True
+        except discord.errors.NotFound:
+            FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
+            logging.exception("Webhook expired while sending history.  Unable to send followup.")
+        finally:
+            if not sent or view.lookahead is None:
+                await view.close()
+
+    # whitelist_export: Sends matching decisions as CSV or JSON-lines files.
+    # Records are streamed into one file at a time of at most
+    # EXPORT_CHUNK_SIZE bytes, so memory use doesn't grow with the history.
+    EXPORT_CHUNK_SIZE = 8 * 1024 * 1024
 
+    @whitelist_group.command(name="export")
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(
+        format="File format",
+        user="Only decisions about this user",
+        admin="Only decisions made by this admin",
+        action="Only this kind of decision",
+        since="Only decisions from this time on (ISO 8601, e.g. 2024-05-01)",
+        until="Only decisions before this time (ISO 8601)",
+    )
+    @app_commands.choices(
+        format=[app_commands.Choice(name="CSV", value="csv"), app_commands.Choice(name="JSON lines", value="jsonl")],
+        action=[app_commands.Choice(name=action, value=action) for action in ACTIONS],
+    )
+    async def whitelist_export(
+        self,
+        interaction: discord.Interaction,
+        format: app_commands.Choice[str],
+        user: discord.User = None,
+        admin: discord.User = None,
+        action: app_commands.Choice[str] = None,
+        since: str = None,
+        until: str = None,
+    ):
+        """Export whitelist decisions for this server"""
+        filters = await self.audit_filters(interaction, user, admin, action, since, until)
+        if filters is None:
+            return
+        await interaction.response.defer(ephemeral=True)
+        files, total = 0, 0
+        records = self.store.stream(**filters)
         try:
-            with open(self.whitelist_log_file, "w") as f:
-                json.dump(whitelist_log, f, indent=4)  # Write the updated log to the file.
+            async for data, count in export_chunks(records, format.value, self.EXPORT_CHUNK_SIZE):
+                files += 1
+                total += count
+                await interaction.followup.send(
+                    file=discord.File(
+                        io.BytesIO(data), filename=f"whitelist-{interaction.guild.id}-{files}.{format.value}"
+                    ),
+                    ephemeral=True,
+                )
+            await interaction.followup.send(f"Exported {total} decisions in {files} file(s).", ephemeral=True)
+        except discord.errors.NotFound:
+            FOLLOWUP_FAILURES_TOTAL.inc(reason="not_found")
+            logging.exception("Webhook expired while sending export.  Unable to send followup.")
+        finally:
+            await records.aclose()
+
+    # whitelist_status: Shows the action scheduler's backlog and latency.
+    @whitelist_group.command(name="status")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def whitelist_status(self, interaction: discord.Interaction):
+        """Show queued actions and their latency"""
+        stats = self.scheduler.stats()
+        embed = discord.Embed(title="Whitelist Status")
+        embed.add_field(
+            name="Backlog",
+            value=", ".join(f"{name}: {count}" for name, count in stats["backlog"].items()),
+            inline=False,
+        )
+        for name in ("admin", "auto", "dm"):
+            figures = stats[name]
+            embed.add_field(
+                name=name.capitalize(),
+                value=(
+                    f"{figures['completed']} done, {figures['failed']} failed\n"
+                    f"wait avg {figures['avg_wait']:.2f}s / max {figures['max_wait']:.2f}s\n"
+                    f"run avg {figures['avg_run']:.2f}s"
+                ),
+                inline=True,
+            )
+        lockdown = self.lockdowns.get(interaction.guild.id)
+        if lockdown is not None:
+            embed.add_field(
+                name="Raid Lockdown",
+                value=(
+                    f"Active for {(time.monotonic() - lockdown.started) / 60:.1f} minutes, "
+                    f"{len(lockdown.members)} members queued"
+                ),
+                inline=False,
+            )
+        dms = self.dms.stats()
+        embed.add_field(
+            name="DM Queue",
+            value=(
+                f"{dms['queued']} queued, {dms['sent']} sent, {dms['failed']} failed, {dms['dropped']} dropped"
+                + (f"\nPaused for {dms['paused']:.0f}s (rate limited)" if dms["paused"] else "")
+            ),
+            inline=False,
+        )
+        embed.set_footer(text=f"{stats['retried']} retried, {stats['deduplicated']} deduplicated")
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    # load_whitelist_log: Loads the whitelist log from the storage backend.
+    async def load_whitelist_log(self):
+        """Loads the whitelist log from file."""
+        return await self.store.load()
+
+    # log_decision: Records an accept or deny decision in the storage backend
+    # and updates the in-memory index.
+    async def log_decision(self, user, guild, action, admin=None):
+        """Logs a whitelist decision for a user."""
+        await self.log_decisions([user], guild, action, admin)
+
+    # log_decisions: Records the same decision for several users in a single
+    # batched write.
+    async def log_decisions(self, users, guild, action, admin=None):
+        """Logs a whitelist decision for several users at once."""
+        guild_id = guild.id if guild else None
+        timestamp = datetime.datetime.now().isoformat()  # Store as ISO 8601
+        try:
+            await self.store.record_many(
+                [
+                    {
+                        "user_id": user.id,
+                        "guild_id": guild_id,
+                        "action": action,
+                        "username": user.name,
+                        "discriminator": user.discriminator,
+                        "admin_id": admin.id if admin else None,
+                        "timestamp": timestamp,
+                    }
+                    for user in users
+                ]
+            )
         except Exception as e:
-            # Log an error if writing to the log file fails.
-            logging.error(f"Error writing to whitelist log file: {e}")
+            # Log an error if writing to the store fails.
+            logging.error("Error writing to whitelist log: %s", e)
+
+        if guild_id is not None:
+            await self.forget_reviews(guild_id, [user.id for user in users])
+
+        DECISIONS_TOTAL.inc(len(users), action=action)
+
+        # Keep the in-memory index and the trust lists in sync.
+        for user in users:
+            self.apply_decision(guild_id, user.id, action)
+
+    # apply_decision: Updates the whitelist index, and the trust lists the
+    # guild feeds, after a decision.  Legacy accepts follow the same rule as
+    # fold_whitelisted.
+    def apply_decision(self, guild_id, user_id, action):
+        if action in ACCEPT_ACTIONS:
+            self.whitelist_index.add((guild_id, user_id))
+        elif action in DENY_ACTIONS:
+            self.whitelist_index.discard((guild_id, user_id))
+            if self.legacy_guild_id in (None, guild_id):
+                self.whitelist_index.discard((None, user_id))
+        else:
+            return
+        if guild_id is not None:
+            self.federation.apply(guild_id, user_id, action in ACCEPT_ACTIONS, self.whitelist_index)
+
+    # sync_federation: Follows decisions made by other processes sharing the
+    # store, so guilds served by another cluster see each other's accepts.
+    # Decisions in guilds this process serves were already applied by
+    # log_decisions.  Trust lists changed elsewhere are picked up too.
+    async def sync_federation(self):
+        while True:
+            await asyncio.sleep(self.federation_interval)
+            try:
+                await self.federation.refresh(self.whitelist_index)
+                while True:
+                    records, self.federation.cursor = await self.store.tail(self.federation.cursor)
+                    if not records:
+                        break
+                    for record in records:
+                        guild_id = record["guild_id"]
+                        if guild_id is not None and self.bot.get_guild(guild_id) is None:
+                            self.apply_decision(guild_id, record["user_id"], record["action"])
+            except Exception as e:
+                logging.exception("Error syncing federated decisions: %s", e)
+
+    # log_whitelist_user: Logs a whitelisted user to the whitelist log.
+    async def log_whitelist_user(self, user: discord.Member, admin=None):
+        """Logs a whitelisted user to the whitelist log file."""
+        await self.log_decision(user, user.guild, "accept", admin)
 
     # on_member_join: This event listener is triggered when a new member joins the
     # server.
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
         """Handles new members joining the server."""
-        whitelist_role = member.guild.get_role(self.whitelist_role_id)
+        if not self.accepting():
+            JOINS_TOTAL.inc(outcome="stopping")
+            return  # Caught by the reconciliation pass after the restart.
+        started = time.perf_counter()
+        whitelist_role = self.get_whitelist_role(member.guild)
         # Check if the whitelist role exists.
         if not whitelist_role:
             logging.error("Whitelist role not found. Check configuration.")
+            JOINS_TOTAL.inc(outcome="no_role")
             return
 
         # If the member already has the whitelist role, do nothing.
         if whitelist_role in member.roles:
+            JOINS_TOTAL.inc(outcome="already_whitelisted")
             return
 
-        whitelist_log = await self.load_whitelist_log()  # Load the whitelist log.
+        # Only recorded for joins that go on to a decision or a review, which
+        # take it back out.
+        self.join_times[(member.guild.id, member.id)] = started
+        config = self.configs.get(member.guild.id)
+        self.check_join_rate(member.guild, config)
 
-        # Check if the user is already in the whitelist log (e.g., if they left
-        # and rejoined).
-        for log_entry in whitelist_log:
-            if log_entry["user_id"] == member.id:
-                try:
-                    await member.add_roles(
-                        whitelist_role
+        # Check if the user is already in the whitelist index (e.g., if they left
+        # and rejoined).  This is a set lookup, no disk I/O.  Guilds can turn
+        # this off, in which case rejoining members are reviewed again.
+        rejoin = config["auto_rejoin"] and self.is_whitelisted(member.guild.id, member.id)
+        # Members vouched for by a trust list the guild subscribes to are
+        # whitelisted the same way.  One IdSet lookup per list, no I/O.
+        trust_list = None
+        if not rejoin and config["trust_lists"]:
+            trust_list = self.federation.trusted(config["trust_lists"], member.id)
+        JOIN_STAGE_SECONDS.observe(time.perf_counter() - started, stage="check")
+        if rejoin or trust_list:
+            action = "auto_rejoin" if rejoin else "auto_federated"
+            extra = log_fields(member.guild, member, action)
+            self.join_times.pop((member.guild.id, member.id), None)
+            try:
+                with JOIN_STAGE_SECONDS.time(stage=action):
+                    await self.scheduler.run(
+                        PRIORITY_AUTO,
+                        f"roles:{member.guild.id}",
+                        ("role", member.guild.id, member.id),
+                        member.add_roles,
+                        whitelist_role,
                     )  # Add the whitelist role to the user.
-                    member.send(
-                        "You have been automatically whitelisted from a previous join."
+                if rejoin:
+                    self.dms.send(member.guild.id, member, config["rejoin_dm"], "rejoin")
+                await self.log_decision(member, member.guild, action)
+                if rejoin:
+                    logging.info("Automatically whitelisted user %s from log.", member.id, extra=extra)
+                else:
+                    logging.info(
+                        "Automatically whitelisted user %s trusted by list %s.", member.id, trust_list, extra=extra
+                    )
+                JOINS_TOTAL.inc(outcome=action)
+                return  # Exit after auto-whitelisting
+            except discord.Forbidden:
+                # Log an error if the bot doesn't have permission to add the role.
+                logging.error("Failed to add role to user %s during auto-whitelist.", member.id, extra=extra)
+                return
+            except Exception as e:
+                # Log any other exceptions that occur while trying to add the role.
+                logging.exception("Error adding role during auto-whitelist: %s", e, extra=extra)
+                return
+
+        # If the user is not in the whitelist log, queue them for review.
+        with JOIN_STAGE_SECONDS.time(stage="queue"):
+            self.queue_review(member)
+        JOINS_TOTAL.inc(outcome="review")
+
+    # on_ready: Starts a reconciliation pass to catch members who joined while
+    # the bot was offline or restarting.  on_ready also fires after some
+    # reconnects, so a pass only starts if none is already running.
+    @commands.Cog.listener()
+    async def on_ready(self):
+        """Reconciles guild members with the whitelist after connecting."""
+        if self.reconcile_task is None or self.reconcile_task.done():
+            self.reconcile_task = self.bot.loop.create_task(self.reconcile())
+
+    # reconcile: Reconciles every guild the bot is in, one at a time.
+    async def reconcile(self):
+        for guild in self.bot.guilds:
+            try:
+                await self.reconcile_guild(guild)
+            except Exception as e:
+                logging.exception("Error reconciling guild %s: %s", guild.id, e, extra=log_fields(guild))
+
+    # reconcile_guild: Streams the guild's members from the API in chunks and
+    # diffs them against the whitelist index and the pending reviews.  The ID
+    # of the last processed member is saved after every chunk, so an
+    # interrupted pass resumes where it stopped.  Members who joined before
+    # the previous pass started were already handled (by that pass or live),
+    # so only newer joins cost any work.
+    async def reconcile_guild(self, guild):
+        whitelist_role = self.get_whitelist_role(guild)
+        if not whitelist_role:
+            return
+        cursor_key = f"reconcile:{guild.id}:cursor"
+        started_key = f"reconcile:{guild.id}:started_at"
+        since_key = f"reconcile:{guild.id}:since"
+
+        cursor = await self.store.get_meta(cursor_key)
+        started_at = await self.store.get_meta(started_key) if cursor else None
+        if started_at is None:
+            started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+            await self.store.set_meta(started_key, started_at)
+        since = await self.store.get_meta(since_key)
+        since = datetime.datetime.fromisoformat(since) if since else None
+
+        semaphore = asyncio.Semaphore(self.bulk_concurrency)
+        options = {"limit": None}
+        if cursor:
+            options["after"] = discord.Object(id=cursor)
+        processed, chunk = 0, []
+        async for member in guild.fetch_members(**options):
+            chunk.append(member)
+            if len(chunk) >= self.reconcile_chunk_size:
+                await self.reconcile_chunk(chunk, whitelist_role, since, semaphore)
+                await self.store.set_meta(cursor_key, chunk[-1].id)
+                processed += len(chunk)
+                chunk = []
+        if chunk:
+            await self.reconcile_chunk(chunk, whitelist_role, since, semaphore)
+            processed += len(chunk)
+
+        await self.store.set_meta(since_key, started_at)
+        await self.store.set_meta(cursor_key, None)
+        await self.store.set_meta(started_key, None)
+        logging.info("Reconciled %s members in guild %s.", processed, guild.id, extra=log_fields(guild))
+
+    # reconcile_chunk: Re-applies the whitelist role to logged members and
+    # queues reviews for unknown ones.  Role grants share a bounded pool.
+    async def reconcile_chunk(self, members, whitelist_role, since, semaphore):
+        guild_id = whitelist_role.guild.id
+        buffered = {member.id for member in self.review_buffer.get(guild_id, [])}
+
+        async def restore_role(member):
+            async with semaphore:
+                try:
+                    await self.scheduler.run(
+                        PRIORITY_AUTO,
+                        f"roles:{member.guild.id}",
+                        ("role", member.guild.id, member.id),
+                        member.add_roles,
+                        whitelist_role,
+                        reason="Whitelisted in log (missed while offline)",
                     )
                     logging.info(
-                        f"Automatically whitelisted user {member.id} from log."
+                        "Reconciled whitelist role for user %s.",
+                        member.id,
+                        extra=log_fields(member.guild, member, "reconcile"),
                     )
-                    return  # Exit after auto-whitelisting
-                except discord.Forbidden:
-                    # Log an error if the bot doesn't have permission to add the role.
+                except discord.HTTPException as e:
                     logging.error(
-                        f"Failed to add role to user {member.id} during auto-whitelist."
+                        "Failed to reconcile role for user %s: %s",
+                        member.id,
+                        e,
+                        extra=log_fields(member.guild, member, "reconcile"),
                     )
-                    return
-                except Exception as e:
-                    # Log any other exceptions that occur while trying to add the role.
-                    logging.exception(f"Error adding role during auto-whitelist: {e}")
-                    return
 
-        # If the user is not in the whitelist log, send a message to the review
-        # channel with the Accept and Deny buttons.
-        review_channel = self.bot.get_channel(self.whitelist_channel)
-        # Check if the review channel exists.
-        if not review_channel:
-            logging.error("Whitelist channel not found. Check configuration.")
+        restores = []
+        for member in members:
+            if member.bot or whitelist_role in member.roles:
+                continue
+            if since and member.joined_at and member.joined_at < since:
+                continue
+            if self.is_whitelisted(guild_id, member.id):
+                restores.append(restore_role(member))
+            elif (
+                (guild_id, member.id) not in self.pending_reviews
+                and (guild_id, member.id) not in self.reviews_in_flight
+                and member.id not in buffered
+            ):
+                self.queue_review(member)
+        await asyncio.gather(*restores)
+
+    # queue_review: Buffers a member for review.  The first join in a quiet
+    # period starts a timer; everyone who joins before it fires is posted in
+    # the same digest.
+    def queue_review(self, member: discord.Member):
+        """Queues a member for the review channel."""
+        lockdown = self.lockdowns.get(member.guild.id)
+        if lockdown is not None:
+            # Held until the raid is over, then posted as digests.
+            lockdown.members.append(member)
+            lockdown.unquarantined.append(member)
+            return
+        if self.review_window <= 0:
+            self.bot.loop.create_task(self.post_reviews([member]))
             return
+        self.review_buffer.setdefault(member.guild.id, []).append(member)
+        if member.guild.id not in self.review_flushers:
+            self.review_flushers[member.guild.id] = self.bot.loop.create_task(
+                self.flush_reviews(member.guild.id)
+            )
 
-        # Create an embed with information about the new member.
-        embed = discord.Embed(
-            title="New Member Joined", description=f"{member.mention} has joined the server"
+    # check_join_rate: Records a join and puts the guild into lockdown when
+    # its join rate reaches the raid threshold.
+    def check_join_rate(self, guild, config):
+        if not config["raid_joins"]:
+            return
+        rate = self.join_rates.record(guild.id, config["raid_window"])
+        lockdown = self.lockdowns.get(guild.id)
+        if lockdown is not None:
+            lockdown.peak_rate = max(lockdown.peak_rate, rate)
+        elif rate >= config["raid_joins"]:
+            self.start_lockdown(guild, rate)
+
+    # start_lockdown: Stops posting reviews for the guild.  Members already
+    # waiting in the review window are held too, so the raid's first joins
+    # end up with the rest of it.
+    def start_lockdown(self, guild, rate):
+        lockdown = self.lockdowns[guild.id] = Lockdown(guild.id, rate)
+        flusher = self.review_flushers.pop(guild.id, None)
+        if flusher is not None:
+            flusher.cancel()
+        for member in self.review_buffer.pop(guild.id, []):
+            lockdown.members.append(member)
+            lockdown.unquarantined.append(member)
+        lockdown.task = self.bot.loop.create_task(self.watch_lockdown(guild, lockdown))
+        LOCKDOWNS_TOTAL.inc()
+        logging.warning(
+            "Raid detected in guild %s: %s joins in the window.  Entering lockdown.",
+            guild.id,
+            rate,
+            extra=log_fields(guild, action="lockdown"),
         )
-        embed.set_thumbnail(url=member.display_avatar)
-        embed.add_field(name="Username", value=member.name, inline=False)
-        embed.add_field(name="ID", value=member.id, inline=False)
-        embed.add_field(
-            name="Joined At", value=member.joined_at.strftime("%Y-%m-%d %H:%M:%S"), inline=False
-        )
-        # Create the ReviewView with the Accept and Deny buttons.
-        view = ReviewView(
-            self.whitelist_role_id, member, self
-        )  # Pass self to ReviewView
-        await review_channel.send(
-            embed=embed, view=view
-        )  # Send the embed and view to the review channel.
+        config = self.configs.get(guild.id)
+        self.bot.loop.create_task(
+            self.announce_lockdown(
+                guild,
+                discord.Embed(
+                    title="Raid Lockdown",
+                    description=(
+                        f"{rate} members joined within {config['raid_window']} seconds.  Reviews are "
+                        "paused and new members are queued; they will be posted as digests once "
+                        "the join rate drops."
+                    ),
+                    color=discord.Color.orange(),
+                ),
+            )
+        )
+
+    # watch_lockdown: Applies the quarantine role to queued members once a
+    # second, and ends the lockdown after the join rate has stayed below half
+    # the threshold for a whole window.
+    async def watch_lockdown(self, guild, lockdown):
+        calm_since = None
+        while True:
+            await asyncio.sleep(1)
+            config = self.configs.get(guild.id)
+            if lockdown.unquarantined:
+                self.start_background(self.quarantine(guild, lockdown, config))
+            if not config["raid_joins"]:
+                break  # Raid detection was turned off.
+            now = time.monotonic()
+            if self.join_rates.count(guild.id, config["raid_window"]) * 2 >= config["raid_joins"]:
+                calm_since = None
+            elif calm_since is None:
+                calm_since = now
+            elif now - calm_since >= config["raid_window"]:
+                break
+        await self.end_lockdown(guild, lockdown)
+
+    # grant_role: Gives a member the whitelist role through the scheduler.  A
+    # member held in a lockdown loses the quarantine role in the same batch,
+    # so accepting them never leaves them with both.  If their quarantine is
+    # still queued, it is moved up to this priority and run first, so it
+    # can't land after the removal.
+    async def grant_role(self, priority, member, whitelist_role, reason=None):
+        guild_id = member.guild.id
+        quarantine_id = self.configs.get(guild_id)["quarantine_role_id"]
+        quarantine = None
+        if (guild_id, member.id) in self.quarantining:
+            quarantine = member.guild.get_role(quarantine_id) if quarantine_id else None
+            if quarantine is not None:
+                with contextlib.suppress(Exception):
+                    await self.scheduler.run(
+                        priority,
+                        f"roles:{guild_id}",
+                        ("quarantine", guild_id, member.id),
+                        member.add_roles,
+                        quarantine,
+                        reason="Joined during a raid lockdown",
+                    )
+        if quarantine is None:
+            quarantine = next((role for role in member.roles if quarantine_id and role.id == quarantine_id), None)
+        calls = [
+            self.scheduler.run(
+                priority,
+                f"roles:{guild_id}",
+                ("role", guild_id, member.id),
+                member.add_roles,
+                whitelist_role,
+                reason=reason,
+            )
+        ]
+        if quarantine is not None:
+            calls.append(
+                self.scheduler.run(
+                    priority,
+                    f"roles:{guild_id}",
+                    ("unquarantine", guild_id, member.id),
+                    member.remove_roles,
+                    quarantine,
+                    reason="Accepted after a raid lockdown",
+                )
+            )
+        await asyncio.gather(*calls)
+
+    # quarantine: Gives the quarantine role to every member queued since the
+    # last call, as one batch through the scheduler.  Runs in the background
+    # so slow role grants never delay the end of the lockdown.
+    async def quarantine(self, guild, lockdown, config):
+        members, lockdown.unquarantined = lockdown.unquarantined, []
+        role = guild.get_role(config["quarantine_role_id"]) if config["quarantine_role_id"] else None
+        if not members or role is None:
+            return
+        # Each member stays in quarantining until their role grant has run,
+        # so grant_role knows to wait for it.
+        self.quarantining.update((guild.id, member.id) for member in members)
+
+        async def hold(member):
+            try:
+                await self.scheduler.run(
+                    PRIORITY_AUTO,
+                    f"roles:{guild.id}",
+                    ("quarantine", guild.id, member.id),
+                    member.add_roles,
+                    role,
+                    reason="Joined during a raid lockdown",
+                )
+            finally:
+                self.quarantining.discard((guild.id, member.id))
+
+        results = await asyncio.gather(*(hold(member) for member in members), return_exceptions=True)
+        failed = sum(isinstance(result, Exception) for result in results)
+        if failed:
+            logging.error(
+                "Failed to quarantine %s of %s members.",
+                failed,
+                len(members),
+                extra=log_fields(guild, action="quarantine"),
+            )
+
+    # end_lockdown: Leaves lockdown and posts everyone who joined during it,
+    # triaged and in digests.
+    async def end_lockdown(self, guild, lockdown):
+        self.lockdowns.pop(guild.id, None)
+        minutes = (time.monotonic() - lockdown.started) / 60
+        logging.warning(
+            "Lockdown in guild %s ended after %.1f minutes with %s members queued.",
+            guild.id,
+            minutes,
+            len(lockdown.members),
+            extra=log_fields(guild, action="lockdown"),
+        )
+        await self.announce_lockdown(
+            guild,
+            discord.Embed(
+                title="Raid Lockdown Ended",
+                description=(
+                    f"Lasted {minutes:.1f} minutes, peaking at {lockdown.peak_rate} joins per window.  "
+                    f"{len(lockdown.members)} queued members follow for review."
+                ),
+                color=discord.Color.green(),
+            ),
+        )
+        await self.post_reviews(lockdown.members)
+
+    # announce_lockdown: Posts a lockdown notice in the review channel.
+    async def announce_lockdown(self, guild, embed):
+        channel_id = self.configs.get(guild.id)["channel_id"]
+        channel = self.bot.get_channel(channel_id) if channel_id else None
+        if channel is None:
+            return
+        try:
+            await channel.send(embed=embed)
+        except discord.HTTPException as e:
+            logging.error("Failed to post lockdown notice: %s", e, extra=log_fields(guild))
+
+    # flush_reviews: Waits for the review window to close and posts every
+    # member buffered for the guild.
+    async def flush_reviews(self, guild_id):
+        try:
+            await asyncio.sleep(self.review_window)
+        finally:
+            self.review_flushers.pop(guild_id, None)
+            members = self.review_buffer.pop(guild_id, [])
+        await self.post_reviews(members)
+
+    # post_reviews: Sends a single review embed for a lone join, or paginated
+    # digests when several members joined within the window.
+    async def post_reviews(self, members, triage=True):
+        """Posts review messages for the given members."""
+        if not members:
+            return
+        if triage:
+            try:
+                members = self.triage(members)
+            except Exception as e:
+                logging.exception("Error triaging %s joins: %s", len(members), e)
+            if not members:
+                return
+        channel_id = self.configs.get(members[0].guild.id)["channel_id"]
+        review_channel = self.bot.get_channel(channel_id) if channel_id else None
+        try:
+            # Check if the review channel exists.
+            if not review_channel:
+                logging.error("Whitelist channel not found. Check configuration.")
+                return
+            if len(members) == 1:
+                message = await self.send_review(review_channel, members[0])
+                await self.remember_reviews(members, message)
+                return
+            for start in range(0, len(members), DigestView.PAGE_SIZE):
+                page = members[start : start + DigestView.PAGE_SIZE]
+                # Clicks are handled by the registered stateless instance, so
+                # the message only needs the component payloads.
+                embed, components = self.renderer.digest(page)
+                message = await review_channel.send(embed=embed, view=components)
+                await self.remember_reviews(page, message)
+        except Exception as e:
+            logging.exception("Error posting review for %s members: %s", len(members), e)
+        finally:
+            # Drop join timestamps of members whose review couldn't be posted.
+            for member in members:
+                self.join_times.pop((member.guild.id, member.id), None)
+
+    # triage: Scores a burst of joins in one pass.  Members below the guild's
+    # accept threshold get the whitelist role and members at or above its
+    # deny threshold are silently banned, in the background so a raid's bans
+    # don't hold up the reviews; the rest are returned for review.  Anyone
+    # whose automatic action fails is reviewed after all.
+    def triage(self, members):
+        guild = members[0].guild
+        config = self.configs.get(guild.id)
+        accept_below, deny_above = config["risk_accept_below"], config["risk_deny_above"]
+        scores = self.risk.score(members)  # Always scored, to keep the join history.
+        accepted, denied, review = [], [], []
+        for member, score in zip(members, scores):
+            RISK_SCORES.observe(score)
+            if accept_below is not None and score < accept_below:
+                accepted.append(member)
+            elif deny_above is not None and score >= deny_above:
+                denied.append(member)
+            else:
+                review.append(member)
+        whitelist_role = self.get_whitelist_role(guild)
+        if accepted and whitelist_role:
+            self.start_background(
+                self.auto_decide(
+                    accepted,
+                    "auto_accept",
+                    lambda member: self.grant_role(
+                        PRIORITY_AUTO, member, whitelist_role, reason="Low join risk score"
+                    ),
+                )
+            )
+        else:
+            review += accepted
+        if denied:
+            self.start_background(
+                self.auto_decide(
+                    denied,
+                    "auto_deny",
+                    lambda member: self.scheduler.run(
+                        PRIORITY_AUTO,
+                        f"ban:{guild.id}",
+                        ("ban", guild.id, member.id),
+                        guild.ban,
+                        member,
+                        reason="High join risk score",
+                    ),
+                )
+            )
+        return review
+
+    # start_background: Runs a batch of automatic actions as a task that
+    # drain() waits for.
+    def start_background(self, coro):
+        task = self.bot.loop.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    # auto_decide: Runs one automatic action per member (call(member) returns
+    # it), logs the ones that succeeded as a single batch and posts reviews
+    # for the ones that failed.
+    async def auto_decide(self, members, action, call):
+        results = await asyncio.gather(*(call(member) for member in members), return_exceptions=True)
+        done, failed, cancelled = [], [], 0
+        for member, result in zip(members, results):
+            if isinstance(result, asyncio.CancelledError):
+                cancelled += 1  # The scheduler stopped; nothing was done.
+            elif isinstance(result, Exception):
+                logging.error(
+                    "%s failed for user %s: %s",
+                    action,
+                    member.id,
+                    result,
+                    extra=log_fields(member.guild, member, action),
+                )
+                failed.append(member)
+            else:
+                done.append(member)
+                self.join_times.pop((member.guild.id, member.id), None)
+        if done:
+            await self.log_decisions(done, members[0].guild, action)
+            logging.info(
+                "%s %s members by join risk score.",
+                action,
+                len(done),
+                extra=log_fields(members[0].guild, action=action),
+            )
+        if cancelled:
+            logging.warning("%s cancelled for %s members by shutdown.", action, cancelled)
+            return
+        await self.post_reviews(failed, triage=False)
+
+    # send_review: Sends the review embed with Accept and Deny buttons for a
+    # single member.  The buttons are dynamic items routed by custom ID, so
+    # no view object is kept.
+    async def send_review(self, review_channel, member: discord.Member):
+        embed, components = self.renderer.review(member)
+        return await review_channel.send(embed=embed, view=components)
 
 
 # setup: This function is required for all cogs.  It's called when the cog is
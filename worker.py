@@ -0,0 +1,48 @@
+import argparse, asyncio, logging, os, signal, socket
+import discord
+from source.functions.log import setup_logging, stop_logging
+from source.functions.scheduler import ActionScheduler
+from source.functions.workqueue import WorkQueue, run_worker
+
+from dotenv import load_dotenv
+load_dotenv()
+setup_logging()
+
+# Must match the work queue the whitelist cog writes to in split mode.
+WORK_QUEUE_FILE = "config/work_queue.db"
+
+async def serve(args):
+    # Logs in for a REST session only; workers never open a gateway connection.
+    client = discord.Client(intents=discord.Intents.none())
+    await client.login(os.getenv("TOKEN"))
+    # Every worker gets an equal share of the scheduler's route limits.
+    scheduler = ActionScheduler(rate_share=1 / max(1, args.count))
+    scheduler.start()
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:
+            pass
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    logging.info("Worker %s taking jobs from %s.", name, WORK_QUEUE_FILE)
+    try:
+        await run_worker(client.http, WorkQueue(WORK_QUEUE_FILE), scheduler, name, stopping, args.capacity)
+    finally:
+        await scheduler.stop()
+        await client.close()
+    logging.info("Worker %s stopped.", name)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run role grants, bans and DMs queued by a bot in split mode.")
+    parser.add_argument("--capacity", type=int, default=20, help="jobs in flight at once, besides admin actions (default: 20)")
+    parser.add_argument("--count", type=int, default=int(os.getenv("WORKER_COUNT", "1")), help="number of workers sharing the rate limits (default: WORKER_COUNT or 1)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    finally:
+        stop_logging()
+
+if __name__ == "__main__":
+    main()